@@ -0,0 +1,69 @@
+"""
+Simulation steps per second with the traci (socket) and libsumo (in-process) backends.
+
+Every scenario and model runs headless with each backend, a few times, and the
+median steps per second of the step loop (SUMO steps, snapshot, decisions and
+metrics) is reported; starting and closing SUMO are not timed. The runs use a
+generated copy of each scenario without output files (see scenario_generator.py),
+since some configurations name output paths that only exist on their author's
+machine and writing them is not the cost of the backend. The SUMO logs go to a
+temporary directory.
+
+Run from the repository root:
+    python -m benchmarks.backends
+    python -m benchmarks.backends --scenarios ScenarioC --steps 1000 --repeat 5
+"""
+import argparse
+import contextlib
+import os
+import statistics
+import tempfile
+
+from scenario_generator import generate
+from simulation_manager import SimulationManager
+from sumo_backend import BACKENDS
+from sweep import MODELS
+
+
+def bench(scenario: str, model_name: str, backend: str, steps: int, repeat: int) -> dict:
+    scenario = generate(scenario)
+    rates = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as log_dir:
+            manager = SimulationManager(
+                scenario,
+                {model_name: MODELS[model_name]()},
+                max_steps=steps,
+                gui=False,
+                backend=backend,
+                log_dir=log_dir,
+            )
+            # keep the progress lines of the manager out of the table
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = manager.run_simulation_for_model(model_name, manager.models[model_name])
+        rates.append((result["steps"] - result["warmup_steps"]) / result["step_time"])
+    return {"steps_per_s": statistics.median(rates), "min": min(rates), "max": max(rates)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenarios", nargs="+", default=["ScenarioB", "ScenarioC"])
+    parser.add_argument("--models", nargs="+", default=["Liu"], choices=list(MODELS))
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'scenario':>10} {'model':>12} {'backend':>8} {'steps/s':>9} {'min':>9} {'max':>9} {'speedup':>8}")
+    for scenario in args.scenarios:
+        for model_name in args.models:
+            baseline = None
+            for backend in args.backends:
+                result = bench(scenario, model_name, backend, args.steps, args.repeat)
+                baseline = baseline or result["steps_per_s"]
+                print(f"{scenario:>10} {model_name:>12} {backend:>8} {result['steps_per_s']:9.0f} "
+                      f"{result['min']:9.0f} {result['max']:9.0f} {result['steps_per_s'] / baseline:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
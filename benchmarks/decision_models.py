@@ -0,0 +1,410 @@
+"""
+Micro-benchmark of the lane-change decision models, without SUMO.
+
+Each model decides on synthetic neighborhood states served by a fake traci
+module, for an increasing number of vehicles per lane and of controlled
+vehicles per step, or on the steps of a recorded state log (see state_log.py).
+For every model and occupancy it reports the per-decision latency percentiles,
+the TraCI calls per decision (including the snapshot read) and the peak memory
+allocated per decision.
+
+Results can be stored as a baseline and compared against it later; the
+comparison fails (exit status 1) when a model got slower at the median or the
+99th percentile, makes more TraCI calls or allocates more than the baseline
+allows. The baseline stores the latencies as multiples of a reference kernel
+timed in the same run, so it can be compared on other machines than the one
+that wrote it.
+
+Run from the repository root:
+    python -m benchmarks.decision_models
+    python -m benchmarks.decision_models --save-baseline
+    python -m benchmarks.decision_models --compare
+    python -m benchmarks.decision_models --vehicles-per-lane 20 --controlled 1 32 64
+    python -m benchmarks.decision_models --log recordings/Liu
+"""
+import argparse
+import contextlib
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import traci.constants as tc
+
+import models.neighborhood
+import models.sl2015_model
+from models.improved_liu_model import LiuImproved
+from models.liu_model import Liu
+from models.ml_model import ML
+from models.neighborhood import NeighborhoodSnapshot
+from models.topology import LaneInfo, LaneTopology
+from models.sl2015_model import SL2015
+from state_log import StateLog
+
+MODELS = {
+    "Liu": Liu,
+    "LiuImproved": LiuImproved,
+    "SL2015": SL2015,
+    "ML": ML,
+}
+
+# Modules that reach traci during a decision; the fake replaces it there
+TRACI_USERS = (
+    models.neighborhood,
+    models.sl2015_model,
+)
+
+BASELINE_PATH = Path(__file__).parent / "baselines" / "decision_models.json"
+
+EGO = "Ego"
+EDGE = "E"
+LANES = 3
+LANE_LENGTH = 1000.0
+NEIGHBORHOOD_LENGTH = 400.0  # meters of road around Ego the vehicles are placed on
+
+
+class _FakeDomain:
+    def __init__(self, name: str, calls: Counter, methods: dict):
+        self._name = name
+        self._calls = calls
+        self._methods = methods
+
+    def __getattr__(self, method):
+        if method not in self._methods:
+            raise AttributeError(f"fake traci has no {self._name}.{method}")
+        function = self._methods[method]
+
+        def counted(*args, **kwargs):
+            self._calls[f"{self._name}.{method}"] += 1
+            return function(*args, **kwargs)
+
+        return counted
+
+
+class FakeTraci:
+    """Stands in for the traci module: serves one neighborhood state and counts the calls."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.state = {}
+        self.lane_lengths: dict[str, float] = {}
+        self.vehicle = _FakeDomain("vehicle", self.calls, {
+            "getRoadID": lambda veh_id: self.state[veh_id][tc.VAR_LANE_ID].rsplit("_", 1)[0],
+            "setParameter": lambda *args: None,
+        })
+        self.edge = _FakeDomain("edge", self.calls, {
+            "getAllContextSubscriptionResults": lambda: self.edge_results,
+            "getContextSubscriptionResults": lambda edge: self.edge_results.get(edge, {}),
+            "subscribeContext": lambda *args, **kwargs: None,
+        })
+        self.lane = _FakeDomain("lane", self.calls, {
+            "getLength": lambda lane_id: self.lane_lengths.get(lane_id, LANE_LENGTH),
+        })
+
+    @property
+    def state(self) -> dict[str, dict[int, object]]:
+        return self._state
+
+    @state.setter
+    def state(self, state: dict[str, dict[int, object]]):
+        # every edge of the state is subscribed, each returning the whole state
+        self._state = state
+        edges = {values[tc.VAR_LANE_ID].rsplit("_", 1)[0] for values in state.values()}
+        self.edge_results = dict.fromkeys(edges, state)
+
+    @contextlib.contextmanager
+    def installed(self):
+        originals = [module.traci for module in TRACI_USERS]
+        for module in TRACI_USERS:
+            module.traci = self
+        try:
+            yield self
+        finally:
+            for module, original in zip(TRACI_USERS, originals):
+                module.traci = original
+
+
+def synthetic_states(vehicles_per_lane: int, n: int, controlled: int = 1, seed: int = 0) -> list[tuple]:
+    """
+    Neighborhood states with Ego on the middle lane and vehicles_per_lane other
+    vehicles on each lane, in the format of the context subscription results,
+    each with its (vehicle, current lane, desired lane) requests.
+
+    Ego and the first controlled - 1 other vehicles, taken round the lanes,
+    each ask for a neighbouring lane, as in a step with that many controlled
+    vehicles.
+    """
+    if controlled > 1 + LANES * vehicles_per_lane:
+        raise ValueError(f"{controlled} controlled vehicles, but only {1 + LANES * vehicles_per_lane} in a state")
+    rng = np.random.default_rng(seed)
+    others = [(lane, i) for i in range(vehicles_per_lane) for lane in range(LANES)][:controlled - 1]
+    specs = [(EGO, f"{EDGE}_1", f"{EDGE}_0")] + [
+        (f"veh_{lane}_{i}", f"{EDGE}_{lane}", f"{EDGE}_{lane + 1 if lane + 1 < LANES else lane - 1}")
+        for lane, i in others
+    ]
+    states = []
+    for _ in range(n):
+        ego_pos = rng.uniform(NEIGHBORHOOD_LENGTH, LANE_LENGTH - NEIGHBORHOOD_LENGTH)
+        state = {EGO: _vehicle(1, ego_pos, rng.uniform(5, 25), rng.uniform(-2, 2))}
+        for lane in range(LANES):
+            positions = ego_pos + rng.uniform(-NEIGHBORHOOD_LENGTH / 2, NEIGHBORHOOD_LENGTH / 2, vehicles_per_lane)
+            for i, pos in enumerate(positions):
+                state[f"veh_{lane}_{i}"] = _vehicle(lane, pos, rng.uniform(0, 30), rng.uniform(-3, 3))
+        states.append((state, specs))
+    return states
+
+
+def synthetic_topology() -> LaneTopology:
+    """Lane table of the road of synthetic_states."""
+    lane_ids = [f"{EDGE}_{lane}" for lane in range(LANES)]
+    return LaneTopology({
+        lane_id: LaneInfo(
+            edge=EDGE,
+            index=lane,
+            length=LANE_LENGTH,
+            speed=33.33,
+            left=lane_ids[lane + 1] if lane + 1 < LANES else None,
+            right=lane_ids[lane - 1] if lane > 0 else None,
+        )
+        for lane, lane_id in enumerate(lane_ids)
+    })
+
+
+def recorded_states(log: StateLog, n: int | None = None) -> list[tuple]:
+    """The first n steps of a state log, in the format of synthetic_states."""
+    states = []
+    for i in range(min(len(log), n or len(log))):
+        requests = log.step_requests(i, snapshot=None)
+        states.append((
+            log.state(i),
+            [(request["veh_id"], request["current_lane"], request["desired_lane"]) for request in requests],
+        ))
+    return states
+
+
+def _vehicle(lane: int, pos: float, speed: float, acceleration: float) -> dict:
+    return {
+        tc.VAR_POSITION: (pos, -1.6 - 3.2 * lane),
+        tc.VAR_SPEED: speed,
+        tc.VAR_ACCELERATION: acceleration,
+        tc.VAR_LANE_ID: f"{EDGE}_{lane}",
+        tc.VAR_LANE_INDEX: lane,
+        tc.VAR_LANEPOSITION: pos,
+        tc.VAR_MAXSPEED: 33.33,
+    }
+
+
+def _requests(snapshot: NeighborhoodSnapshot, specs) -> list[dict]:
+    return [
+        {"veh_id": veh_id, "current_lane": current_lane, "desired_lane": desired_lane, "snapshot": snapshot}
+        for veh_id, current_lane, desired_lane in specs
+    ]
+
+
+def bench_model(
+    model, states: list[tuple], fake: FakeTraci, batch: bool, topology: LaneTopology | None, repeat: int = 3
+) -> dict:
+    """
+    Times the decisions of every state; the snapshot is rebuilt for every state,
+    as in a step, and its cost is shared by the state's requests. Each state is
+    timed repeat times and its fastest run kept, so the tail percentiles show
+    slow states rather than interruptions of the machine.
+    """
+    def decide(specs):
+        snapshot = NeighborhoodSnapshot.from_subscriptions([veh_id for veh_id, _, _ in specs], topology=topology)
+        requests = _requests(snapshot, specs)
+        if batch:
+            return model.decide_lane_changes(requests)
+        return [model.decide_lane_change(**request) for request in requests]
+
+    decisions = sum(len(specs) for _, specs in states) * repeat
+    latencies = np.full(len(states), np.inf)
+    fake.calls.clear()
+    # collections of the benchmark's own garbage would land in the tail
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for i, (state, specs) in enumerate(states):
+                fake.state = state
+                start = time.perf_counter()
+                decide(specs)
+                latencies[i] = min(latencies[i], (time.perf_counter() - start) / len(specs))
+    finally:
+        gc.enable()
+    calls = sum(fake.calls.values()) / decisions
+
+    # separate pass, tracemalloc slows the calls down
+    peaks = np.empty(len(states))
+    tracemalloc.start()
+    for i, (state, specs) in enumerate(states):
+        fake.state = state
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        decide(specs)
+        peaks[i] = (tracemalloc.get_traced_memory()[1] - current) / len(specs)
+    tracemalloc.stop()
+
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1e6
+    return {
+        "p50_us": p50,
+        "p90_us": p90,
+        "p99_us": p99,
+        "traci_calls": calls,
+        "peak_alloc_kib": float(np.mean(peaks)) / 1024,
+    }
+
+
+def _reference_kernel(values: dict, array: np.ndarray) -> float:
+    # the mix of a decision: dictionary and arithmetic work in Python, small numpy calls
+    total = 0.0
+    for key, value in values.items():
+        total += value * 0.5 if key % 2 else value
+    index = int(np.searchsorted(array, total % array[-1]))
+    return total + float(array[max(index - 8, 0):index + 8].mean())
+
+
+def reference_us(runs: int = 500, repeat: int = 3) -> float:
+    """
+    Median time of a fixed kernel, in microseconds, timed as bench_model times
+    the decisions; latencies divided by it compare across machines.
+    """
+    values = {i: float(i) for i in range(100)}
+    array = np.arange(256, dtype=float)
+    latencies = np.full(runs, np.inf)
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for i in range(runs):
+                start = time.perf_counter()
+                _reference_kernel(values, array)
+                latencies[i] = min(latencies[i], time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return float(np.median(latencies)) * 1e6
+
+
+def relative(results: dict, reference: float) -> dict:
+    """Results with the latencies as multiples of the reference kernel's time, as baselines store them."""
+    return {
+        key: {
+            "p50": result["p50_us"] / reference,
+            "p90": result["p90_us"] / reference,
+            "p99": result["p99_us"] / reference,
+            "traci_calls": result["traci_calls"],
+            "peak_alloc_kib": result["peak_alloc_kib"],
+        }
+        for key, result in results.items()
+    }
+
+
+def run(
+    occupancies, n_states: int, model_names, log: StateLog | None = None, controlled=(1,), repeat: int = 3
+) -> dict:
+    """
+    Results keyed by "<model>[batch]/<vehicles per lane>", with "x<controlled>"
+    appended for steps of several controlled vehicles, or "/recorded" for a log.
+    Occupancies with fewer vehicles than controlled ones are left out.
+    """
+    fake = FakeTraci()
+    levels = {
+        (f"{vehicles_per_lane}" if count == 1 else f"{vehicles_per_lane}x{count}"): (vehicles_per_lane, count)
+        for vehicles_per_lane in occupancies
+        for count in controlled
+        if count <= 1 + LANES * vehicles_per_lane
+    }
+    topology = synthetic_topology()
+    if log is not None:
+        levels = {"recorded": recorded_states(log, n_states)}
+        # the lanes of a log are looked up through the fake, by their recorded lengths
+        topology = None
+        fake.lane_lengths = log.lane_lengths
+    results = {}
+    with fake.installed():
+        for level, states in levels.items():
+            if isinstance(states, tuple):
+                vehicles_per_lane, count = states
+                states = synthetic_states(vehicles_per_lane, n_states, count)
+            for name in model_names:
+                model = MODELS[name]()
+                # load artifacts and build caches before timing
+                fake.state, specs = states[0]
+                snapshot = NeighborhoodSnapshot.from_subscriptions([veh_id for veh_id, _, _ in specs], topology=topology)
+                model.decide_lane_changes(_requests(snapshot, specs))
+                for batch in (False, True):
+                    key = f"{name}{'[batch]' if batch else ''}/{level}"
+                    results[key] = bench_model(model, states, fake, batch, topology, repeat)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float, tail_tolerance: float) -> list[str]:
+    """
+    Regressions of results against the baseline, as readable lines; both are
+    relative to the reference kernel (see relative).
+    """
+    failures = []
+    for key, base in baseline.items():
+        if key not in results:
+            continue
+        result = results[key]
+        if result["p50"] > base["p50"] * (1 + tolerance):
+            failures.append(f"{key}: p50 {result['p50']:.2f}x reference > baseline {base['p50']:.2f}x")
+        if result["p99"] > base["p99"] * (1 + tail_tolerance):
+            failures.append(f"{key}: p99 {result['p99']:.2f}x reference > baseline {base['p99']:.2f}x")
+        if result["traci_calls"] > base["traci_calls"]:
+            failures.append(f"{key}: {result['traci_calls']:.2f} TraCI calls > baseline {base['traci_calls']:.2f}")
+        if result["peak_alloc_kib"] > base["peak_alloc_kib"] * (1 + tolerance):
+            failures.append(
+                f"{key}: {result['peak_alloc_kib']:.1f} KiB allocated > baseline {base['peak_alloc_kib']:.1f} KiB")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vehicles-per-lane", nargs="+", type=int, default=[1, 5, 20, 50])
+    parser.add_argument("--controlled", nargs="+", type=int, default=[1, 32, 64],
+                        help="controlled vehicles per state")
+    parser.add_argument("--states", type=int, default=500, help="states timed per model and occupancy")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per state, the fastest is kept")
+    parser.add_argument("--log", type=Path, default=None, help="use the steps of a state log instead")
+    parser.add_argument("--models", nargs="+", default=list(MODELS), choices=list(MODELS))
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="fail when results regress against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed relative increase of the median latency and allocations")
+    parser.add_argument("--tail-tolerance", type=float, default=1.0,
+                        help="allowed relative increase of the p99 latency")
+    args = parser.parse_args()
+
+    log = StateLog(args.log) if args.log else None
+    results = run(args.vehicles_per_lane, args.states, args.models, log, args.controlled, args.repeat)
+    reference = reference_us(repeat=args.repeat)
+    print(f"reference kernel {reference:.2f} us")
+    print(f"{'model/vehicles per lane':>28} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'TraCI':>6} {'KiB':>8}")
+    for key, result in results.items():
+        print(f"{key:>28} {result['p50_us']:9.1f} {result['p90_us']:9.1f} {result['p99_us']:9.1f} "
+              f"{result['traci_calls']:6.2f} {result['peak_alloc_kib']:8.1f}")
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        baseline = {"reference_us": reference, "results": relative(results, reference)}
+        args.baseline.write_text(json.dumps(baseline, indent=1, sort_keys=True) + "\n")
+        print(f"baseline written to {args.baseline}")
+    if args.compare:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        failures = compare(relative(results, reference), baseline, args.tolerance, args.tail_tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+        print("no regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
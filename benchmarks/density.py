@@ -0,0 +1,129 @@
+"""
+Step cost of the models as traffic grows.
+
+Variants of a scenario are generated at increasing demand multipliers (and
+optionally lane counts and vehicle-type mix, see scenario_generator.py), and
+every model runs headless on each of them. For every run the wall time per
+simulated second and the mean number of vehicles in the network are reported,
+written as CSV and plotted against each other, one line per model.
+
+With --controlled all every vehicle is driven by the model, so the cost of the
+decisions grows with the traffic too; by default only Ego is.
+
+Run from the repository root:
+    python -m benchmarks.density
+    python -m benchmarks.density --scenario ScenarioB --demands 0.5 1 2 4 8 --lanes 3 4
+    python -m benchmarks.density --controlled all --backend libsumo --mix car=0.8 bus=0.2
+"""
+import argparse
+import contextlib
+import itertools
+import os
+import statistics
+import tempfile
+from pathlib import Path
+
+import matplotlib
+matplotlib.use("Agg")  # headless: the figure is saved instead of shown
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from scenario_generator import generate, parse_mix
+from simulation_manager import EGO_VEHICLES, SimulationManager
+from sumo_backend import BACKENDS
+from sweep import MODELS
+
+
+def control_all(veh_id: str) -> bool:
+    return True
+
+
+CONTROLLED = {"ego": EGO_VEHICLES, "all": control_all}
+
+
+def bench(scenario: str, model_name: str, controlled, backend: str, steps: int, repeat: int) -> dict:
+    costs = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as log_dir:
+            manager = SimulationManager(
+                scenario,
+                {model_name: MODELS[model_name]()},
+                max_steps=steps,
+                gui=False,
+                controlled=controlled,
+                backend=backend,
+                log_dir=log_dir,
+            )
+            # keep the progress lines of the manager out of the table
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = manager.run_simulation_for_model(model_name, manager.models[model_name])
+        simulated = (result["steps"] - result["warmup_steps"]) * result["step_length"]
+        costs.append(result["wall_time"] / simulated)
+    # the traffic is the same in every repetition
+    return {
+        "wall_per_sim_s": statistics.median(costs),
+        "min": min(costs),
+        "max": max(costs),
+        "mean_vehicles": result["mean_vehicles"],
+        "decisions": result["decisions"],
+    }
+
+
+def plot(table: pd.DataFrame, path: Path):
+    fig, ax = plt.subplots(figsize=(7, 4.5))
+    for (model, lanes), runs in table.groupby(["model", "lanes"], dropna=False):
+        runs = runs.sort_values("mean_vehicles")
+        label = model if pd.isna(lanes) else f"{model}, {lanes:g} lanes"
+        ax.errorbar(
+            runs["mean_vehicles"],
+            runs["wall_per_sim_s"] * 1e3,
+            yerr=[(runs["wall_per_sim_s"] - runs["min"]) * 1e3, (runs["max"] - runs["wall_per_sim_s"]) * 1e3],
+            marker="o",
+            capsize=3,
+            label=label,
+        )
+    ax.set_xlabel("mean vehicles in the network")
+    ax.set_ylabel("wall time per simulated second (ms)")
+    ax.set_title(f"{table['scenario'].iloc[0]}: step cost vs. traffic")
+    ax.grid(alpha=0.3)
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenario", default="ScenarioC")
+    parser.add_argument("--models", nargs="+", default=list(MODELS), choices=list(MODELS))
+    parser.add_argument("--demands", nargs="+", type=float, default=[0.1, 0.25, 0.5, 1.0, 2.0])
+    parser.add_argument("--lanes", nargs="+", type=int, default=[None])
+    parser.add_argument("--mix", nargs="+", default=None, metavar="VTYPE=SHARE")
+    parser.add_argument("--controlled", default="ego", choices=list(CONTROLLED))
+    parser.add_argument("--backend", default="traci", choices=list(BACKENDS))
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", type=Path, default=Path("sweeps/density"))
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    rows = []
+    print(f"{'scenario':>40} {'model':>12} {'vehicles':>9} {'ms/sim s':>9} {'min':>9} {'max':>9}")
+    for demand, lanes in itertools.product(args.demands, args.lanes):
+        scenario = generate(args.scenario, demand, lanes, mix)
+        for model_name in args.models:
+            result = bench(scenario, model_name, CONTROLLED[args.controlled], args.backend, args.steps, args.repeat)
+            rows.append({"scenario": args.scenario, "demand": demand, "lanes": lanes, "model": model_name, **result})
+            print(f"{scenario:>40} {model_name:>12} {result['mean_vehicles']:9.1f} "
+                  f"{result['wall_per_sim_s'] * 1e3:9.2f} {result['min'] * 1e3:9.2f} {result['max'] * 1e3:9.2f}")
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    table = pd.DataFrame(rows)
+    name = f"{args.scenario}_{args.controlled}_{args.backend}"
+    table.to_csv(args.out / f"{name}.csv", index=False)
+    plot(table, args.out / f"{name}.png")
+    print(f"Wrote {args.out / name}.csv and .png")
+
+
+if __name__ == "__main__":
+    main()
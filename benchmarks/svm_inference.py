@@ -0,0 +1,85 @@
+"""
+Latency comparison of the ML decision inference paths.
+
+Compares the original per-call path (DataFrame, per-feature unit conversion,
+StandardScaler.transform, SVC.predict) with RBFInferenceEngine, and checks that
+both produce the same labels.
+
+Run from the repository root:
+    python -m benchmarks.svm_inference
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from models.artifacts import registry
+from models.ml_model import MODEL_PATH, SCALER_PATH
+from models.svm_inference import FT_PER_M, RBFInferenceEngine
+
+FEATURE_NAMES = ['v_E', 'a_E', 'P', 'G_TR', 'G_TP', 'v_P', 'v_TR', 'v_TP', 'delta_v_TR', 'delta_v_TP']
+
+
+def sample_features(scaler, n: int, seed: int = 0) -> np.ndarray:
+    """Draws raw (SI unit) feature vectors around the training distribution."""
+    rng = np.random.default_rng(seed)
+    features_ft = scaler.mean_ + scaler.scale_ * rng.standard_normal((n, len(scaler.mean_)))
+    features = features_ft * FT_PER_M
+    # the sentinels ML uses when there is no vehicle in front or behind
+    missing = rng.random(n) < 0.1
+    features[missing, 4] = 1000
+    features[missing, 7] = 1000
+    return features
+
+
+def m_per_sec_2_f_per_sec(speed: float) -> float:
+    return speed / 3.28084 # Go from m/s to ft/s
+
+
+def original_predict(model, scaler, features: np.ndarray):
+    new_data = np.array(features)
+    for i in range(len(new_data)):
+        new_data[i] = m_per_sec_2_f_per_sec(new_data[i])
+    new_data = pd.DataFrame([new_data], columns=FEATURE_NAMES)
+    return model.predict(scaler.transform(new_data))
+
+
+def time_per_call(fn, samples: np.ndarray) -> np.ndarray:
+    latencies = np.empty(len(samples))
+    for i, features in enumerate(samples):
+        start = time.perf_counter()
+        fn(features)
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--check", type=int, default=100_000, help="samples for the label comparison")
+    parser.add_argument("--calls", type=int, default=2_000, help="single calls timed per path")
+    args = parser.parse_args()
+
+    model = registry.get(MODEL_PATH)
+    scaler = registry.get(SCALER_PATH)
+    engine = RBFInferenceEngine(model, scaler)
+
+    samples = sample_features(scaler, args.check)
+    expected = model.predict(scaler.transform(pd.DataFrame(samples / FT_PER_M, columns=FEATURE_NAMES)))
+    mismatches = int(np.count_nonzero(engine.predict(samples) != expected))
+    print(f"labels compared: {args.check}, mismatches: {mismatches}")
+
+    calls = samples[: args.calls]
+    results = {
+        "original": time_per_call(lambda x: original_predict(model, scaler, x), calls),
+        "engine": time_per_call(engine.predict, calls),
+    }
+    for name, latencies in results.items():
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1e6
+        print(f"{name:>8}: p50 {p50:8.1f} us  p99 {p99:8.1f} us")
+    speedup = np.median(results["original"]) / np.median(results["engine"])
+    print(f"median speedup: {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
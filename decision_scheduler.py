@@ -0,0 +1,130 @@
+"""
+Event-driven scheduling of the lane-change decisions.
+
+A controlled vehicle is only handed to the decision model when its surroundings
+changed in a way that can change the decision: it is dirty when
+
+    new      it has no decision yet
+    lane     its current or desired lane changed
+    vehicle  the closest vehicles of the target lane or the vehicle ahead in the
+             current lane are different vehicles
+    gap      the gap to one of them crossed into another GAP_BAND-wide band
+    refresh  its last decision is REFRESH_STEPS steps old
+
+The other vehicles keep their last decision, and the command issued for it
+(changeLane or slowDown) is not sent again.
+"""
+
+import math
+from collections import Counter
+
+from models.neighborhood import NeighborhoodSnapshot
+
+# Width (meters) of the gap bands; a gap moving within its band changes nothing
+GAP_BAND = 10.0
+
+# Steps after which a decision is made again, whatever happened; matches the
+# duration of the slowDown issued for a "no"
+REFRESH_STEPS = 5
+
+REASONS = ("new", "lane", "vehicle", "gap", "refresh")
+
+
+class _VehicleState:
+    __slots__ = ("lanes", "neighbours", "bands", "step", "decision")
+
+    def __init__(self, lanes, neighbours, bands, step, decision):
+        self.lanes = lanes
+        self.neighbours = neighbours
+        self.bands = bands
+        self.step = step
+        self.decision = decision
+
+
+class DecisionScheduler:
+    def __init__(self, gap_band: float = GAP_BAND, refresh_steps: int = REFRESH_STEPS):
+        self.gap_band = gap_band
+        self.refresh_steps = refresh_steps
+        self.vehicles: dict[str, _VehicleState] = {}
+        self.evaluated = 0
+        self.skipped = 0
+        # skipped requests whose kept decision is "no": slowDown commands not sent
+        self.skipped_slowdowns = 0
+        self.reasons = Counter()
+        self._pending: dict[str, tuple] = {}
+
+    def _band(self, snapshot: NeighborhoodSnapshot, veh_id: str, other: str | None) -> int | None:
+        if other is None:
+            return None
+        return math.floor(snapshot.distance_between(other, veh_id) / self.gap_band)
+
+    def _observe(self, request: dict) -> tuple:
+        veh_id = request["veh_id"]
+        snapshot = request["snapshot"]
+        # the neighbours the models look at (see LaneChangeFeatures.from_requests)
+        neighbours = (*snapshot.closest(request["desired_lane"], veh_id), snapshot.vehicle_ahead(veh_id))
+        return (
+            (request["current_lane"], request["desired_lane"]),
+            neighbours,
+            tuple(self._band(snapshot, veh_id, other) for other in neighbours),
+        )
+
+    def _reason(self, step: int, state: _VehicleState | None, lanes, neighbours, bands) -> str | None:
+        if state is None:
+            return "new"
+        if lanes != state.lanes:
+            return "lane"
+        if neighbours != state.neighbours:
+            return "vehicle"
+        if bands != state.bands:
+            return "gap"
+        if step - state.step >= self.refresh_steps:
+            return "refresh"
+        return None
+
+    def select(self, step: int, requests: list[dict]) -> list[bool]:
+        """
+        Marks the requests of a step that need a decision; call update with the
+        decisions of the marked ones.
+
+        Returns:
+            list[bool]: True for the dirty requests, in the order of requests.
+        """
+        dirty = []
+        self._pending.clear()
+        for request in requests:
+            veh_id = request["veh_id"]
+            observation = self._observe(request)
+            state = self.vehicles.get(veh_id)
+            reason = self._reason(step, state, *observation)
+            if reason is None:
+                self.skipped += 1
+                self.skipped_slowdowns += not state.decision
+                dirty.append(False)
+                continue
+            self.reasons[reason] += 1
+            self._pending[veh_id] = observation
+            dirty.append(True)
+        # vehicles without a request this step start over when they get one again
+        present = {request["veh_id"] for request in requests}
+        for veh_id in list(self.vehicles):
+            if veh_id not in present:
+                del self.vehicles[veh_id]
+        return dirty
+
+    def update(self, step: int, requests: list[dict], decisions):
+        """Stores the decisions of the requests select marked as dirty."""
+        for request, decision in zip(requests, decisions):
+            veh_id = request["veh_id"]
+            self.vehicles[veh_id] = _VehicleState(*self._pending[veh_id], step, bool(decision))
+            self.evaluated += 1
+
+    def report(self) -> dict:
+        requests = self.evaluated + self.skipped
+        return {
+            "evaluated": self.evaluated,
+            "skipped": self.skipped,
+            "skip_rate": self.skipped / requests if requests else 0.0,
+            "skipped_slowdowns": self.skipped_slowdowns,
+            **{f"reason_{reason}": self.reasons[reason] for reason in REASONS},
+        }
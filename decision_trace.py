@@ -0,0 +1,163 @@
+"""
+Typed trace of the lane-change decisions of a run, in place of console prints.
+
+Each traced decision is one row of a Parquet file: the step, the vehicle, its
+current and desired lane and the decision, and depending on the level
+
+    decisions  only those columns
+    features   also the LaneChangeFeatures inputs of the decision
+    metrics    also the intermediate values of the model (BaseDecisionModel.last_metrics),
+               as m_<name> columns
+
+Rows are buffered as arrays and written as one row group per buffer, so the step
+loop formats no strings and makes no writes of its own. Steps can be thinned
+out (every n-th step) and rows sampled at random.
+
+    python decision_trace.py traces/Liu.parquet
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from models.base_model import BaseDecisionModel
+from models.features import ALL_FIELDS, LaneChangeFeatures
+
+OFF = 0
+DECISIONS = 1
+FEATURES = 2
+METRICS = 3
+LEVELS = {"off": OFF, "decisions": DECISIONS, "features": FEATURES, "metrics": METRICS}
+
+# Rows held in memory before a row group is written
+BUFFER_ROWS = 16384
+
+
+class DecisionTrace:
+    def __init__(
+        self,
+        path,
+        level: int | str = DECISIONS,
+        every: int = 1,
+        rate: float = 1.0,
+        seed: int = 0,
+        buffer_rows: int = BUFFER_ROWS,
+    ):
+        """
+        Args:
+            path: Parquet file to write.
+            level (int | str): One of LEVELS, by value or name.
+            every (int): Trace every n-th step only.
+            rate (float): Fraction of the rows of a traced step that are kept.
+            seed (int): Seed of the row sampling.
+            buffer_rows (int): Rows buffered before they are written.
+        """
+        self.path = Path(path)
+        self.level = LEVELS[level] if isinstance(level, str) else level
+        self.every = every
+        self.rate = rate
+        self.buffer_rows = buffer_rows
+        self.rows = 0
+        self._rng = np.random.default_rng(seed)
+        self._chunks: list[dict[str, np.ndarray]] = []
+        self._buffered = 0
+        self._writer = None
+
+    def wants(self, step: int) -> bool:
+        """Whether the decisions of this step are traced at all."""
+        return self.level > OFF and step % self.every == 0
+
+    def record(self, step: int, requests: list[dict], decisions, model: BaseDecisionModel | None = None):
+        """
+        Buffers the decisions of one step.
+
+        Args:
+            step (int): Simulation step.
+            requests (list[dict]): The decide_lane_changes requests of the step.
+            decisions: One decision per request.
+            model (BaseDecisionModel): The model that decided, for its features and
+                metrics; features are gathered again from the requests without it.
+        """
+        if not self.wants(step) or not requests:
+            return
+        n = len(requests)
+        columns = {
+            "step": np.full(n, step, dtype=np.int32),
+            "vehicle": np.array([request["veh_id"] for request in requests], dtype=object),
+            "current_lane": np.array([request["current_lane"] for request in requests], dtype=object),
+            "desired_lane": np.array([request["desired_lane"] for request in requests], dtype=object),
+            "decision": np.asarray(decisions, dtype=bool),
+        }
+        if self.level >= FEATURES:
+            features = model.last_features if model is not None else None
+            # the model gathers only the fields it reads, and none for small steps
+            if features is None or len(features) != n or features.fields != ALL_FIELDS:
+                features = LaneChangeFeatures.from_requests(requests)
+            for name in ALL_FIELDS:
+                columns[name] = getattr(features, name)
+        if self.level >= METRICS and model is not None:
+            metrics = model.last_metrics
+            if metrics is None and model.batch_fields:
+                # decided vehicle by vehicle; the batch path gives the same metrics,
+                # unless it decides request by request too (it reads no fields then)
+                model.decide_batch(features)
+                metrics = model.last_metrics
+            for name, values in (metrics or {}).items():
+                columns[f"m_{name}"] = np.broadcast_to(np.asarray(values, dtype=float), (n,))
+        if self.rate < 1.0:
+            keep = self._rng.random(n) < self.rate
+            columns = {name: values[keep] for name, values in columns.items()}
+        self._chunks.append(columns)
+        self._buffered += len(columns["step"])
+        if self._buffered >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._buffered:
+            self._chunks.clear()
+            return
+        table = pa.table({
+            name: np.concatenate([chunk[name] for chunk in self._chunks])
+            for name in self._chunks[0]
+        })
+        if self._writer is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+        self._writer.write_table(table)
+        self.rows += table.num_rows
+        self._chunks.clear()
+        self._buffered = 0
+
+    def close(self) -> dict:
+        """Writes the buffered rows and closes the file; returns a short summary."""
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        return {"path": str(self.path), "rows": self.rows}
+
+
+def load(path, columns=None, filters=None) -> pd.DataFrame:
+    """Reads a trace, optionally only some columns or rows (pyarrow filters)."""
+    return pq.read_table(path, columns=columns, filters=filters).to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", type=Path)
+    parser.add_argument("--vehicle", default=None, help="only the decisions of this vehicle")
+    args = parser.parse_args()
+
+    filters = [("vehicle", "==", args.vehicle)] if args.vehicle else None
+    df = load(args.trace, filters=filters)
+    print(f"{args.trace}: {len(df)} decisions in {df['step'].nunique()} steps, columns {list(df.columns)}")
+    print(df.groupby("vehicle")["decision"].agg(["count", "sum", "mean"]).rename(
+        columns={"count": "decisions", "sum": "lane_changes", "mean": "rate"}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Crash-tolerant job queue for long simulation campaigns.
+
+The jobs of a campaign, one per scenario, model, seed and parameters (demand
+scale and run length), live in a SQLite database together with their results:
+
+    pending  waiting for a worker
+    running  claimed by a worker, which renews its lease while the run goes on
+    done     finished; its result row is stored and it is never run again
+    failed   failed max_attempts times, or once on a configuration error
+
+A worker claims one job at a time and runs it in a child process, so a SUMO
+crash (or a libsumo segfault) only costs that run: the job goes back to pending
+and is retried. A job whose scenario or model cannot be loaded fails right away. When a worker or its machine dies, the lease of its job expires
+and another worker claims it again; a worker that finds its lease taken over
+terminates its run. Each claim counts as an attempt.
+
+Any number of worker processes, on one machine or on several machines sharing
+the database file, can drain the same queue. The database uses SQLite's rollback
+journal rather than WAL, whose shared memory does not work across machines; the
+shared filesystem must support POSIX locks.
+
+    python job_queue.py campaigns/c.sqlite add --scenarios ScenarioC --seeds 50 --scales 0.5 1 1.5
+    python job_queue.py campaigns/c.sqlite work --workers 8 --backend libsumo
+    python job_queue.py campaigns/c.sqlite status
+    python job_queue.py campaigns/c.sqlite export --out sweeps/c.jsonl
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from sumo_backend import BACKENDS
+from sweep import MODELS, ConfigurationError, SweepJob, aggregate, expand_grid, run_job
+
+STATUSES = ("pending", "running", "done", "failed")
+
+# A running job whose lease was not renewed for this long belongs to a dead worker
+LEASE_SECONDS = 120.0
+HEARTBEAT_SECONDS = 15.0
+# Sleep of an idle worker while jobs of other workers are still running
+POLL_SECONDS = 5.0
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    scenario TEXT NOT NULL,
+    model TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until);
+"""
+
+
+def job_key(scenario: str, model: str, seed: int, params: dict) -> str:
+    return json.dumps([scenario, model, seed, params], sort_keys=True)
+
+
+def job_params(job: SweepJob) -> dict:
+    return {"scale": job.scale, "max_steps": job.max_steps}
+
+
+class JobQueue:
+    def __init__(self, path, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # autocommit; the writes that have to be atomic open their own transaction
+        self.db = sqlite3.connect(self.path, timeout=60.0, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=DELETE")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def _transaction(self):
+        # takes the write lock up front, so two workers never claim the same job
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def add(self, jobs: list[SweepJob]) -> int:
+        """Queues the jobs that are not in the queue yet; returns how many were new."""
+        rows = [
+            (job_key(job.scenario, job.model, job.seed, job_params(job)),
+             job.scenario, job.model, job.seed, json.dumps(job_params(job), sort_keys=True))
+            for job in jobs
+        ]
+        db = self._transaction()
+        try:
+            before = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO jobs (key, scenario, model, seed, params) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            added = db.total_changes - before
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return added
+
+    def claim(self, worker: str) -> sqlite3.Row | None:
+        """
+        Claims the next pending job, or a running one whose lease expired.
+
+        Returns:
+            sqlite3.Row | None: The claimed job, or None when there is nothing to claim.
+        """
+        now = time.time()
+        db = self._transaction()
+        try:
+            # jobs of dead workers that used up their attempts are not claimed again
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = 'lease expired', finished_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            job = db.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if job is not None:
+                db.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ? "
+                    "WHERE id = ?",
+                    (worker, now + self.lease_seconds, job["id"]),
+                )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        if job is None:
+            return None
+        return self.db.execute("SELECT * FROM jobs WHERE id = ?", (job["id"],)).fetchone()
+
+    def renew(self, job_id: int, worker: str) -> bool:
+        """Extends the lease of a claimed job; False when the job was taken over meanwhile."""
+        cursor = self.db.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time() + self.lease_seconds, job_id, worker),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker: str, result: dict) -> bool:
+        """Stores the result of a claimed job; False when the job was taken over meanwhile."""
+        cursor = self.db.execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL, finished_at = ? "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (json.dumps(result), time.time(), job_id, worker),
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker: str, error: str, retry: bool = True) -> str | None:
+        """
+        Records a failed attempt of a claimed job; with retry=False the job fails
+        for good whatever its attempts.
+
+        Returns:
+            str | None: The new status, "pending" to retry or "failed", or None when
+                the job was taken over meanwhile.
+        """
+        cursor = self.db.execute(
+            "UPDATE jobs SET status = CASE WHEN ? OR attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "error = ?, lease_until = NULL, finished_at = ? "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (not retry, self.max_attempts, error, time.time(), job_id, worker),
+        )
+        if cursor.rowcount != 1:
+            return None
+        return self.db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()["status"]
+
+    def retry_failed(self) -> int:
+        """Queues the failed jobs again with fresh attempts; returns how many."""
+        cursor = self.db.execute(
+            "UPDATE jobs SET status = 'pending', attempts = 0, worker = NULL WHERE status = 'failed'"
+        )
+        return cursor.rowcount
+
+    def counts(self) -> dict[str, int]:
+        counts = dict.fromkeys(STATUSES, 0)
+        for row in self.db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+        return counts
+
+    def failures(self) -> list[sqlite3.Row]:
+        return self.db.execute(
+            "SELECT scenario, model, seed, params, attempts, error FROM jobs WHERE status = 'failed' ORDER BY id"
+        ).fetchall()
+
+    def results(self) -> list[dict]:
+        """The result rows of the finished jobs, as sweep.run_job returns them."""
+        return [
+            json.loads(row["result"])
+            for row in self.db.execute("SELECT result FROM jobs WHERE status = 'done' ORDER BY id")
+        ]
+
+
+def _job(row: sqlite3.Row) -> SweepJob:
+    return SweepJob(row["scenario"], row["model"], row["seed"], **json.loads(row["params"]))
+
+
+def _run_job_process(sender, job: SweepJob, backend: str, warmup_dir: str | None):
+    """
+    Runs a job in a child process and sends (result row, None, True) or
+    (None, traceback, retry) back; configuration errors are not retried.
+    """
+    try:
+        sender.send((run_job(job, backend, warmup_dir), None, True))
+    except Exception as error:
+        sender.send((None, traceback.format_exc(), not isinstance(error, ConfigurationError)))
+    finally:
+        sender.close()
+
+
+class Worker:
+    """Drains a queue, one job at a time, each in a fresh child process."""
+
+    def __init__(self, queue: JobQueue, name: str, backend: str = "traci", warmup_dir: str | None = None):
+        self.queue = queue
+        self.name = name
+        self.backend = backend
+        self.warmup_dir = warmup_dir
+        self.done = 0
+        self.failed = 0
+
+    def run_one(self, row: sqlite3.Row):
+        job = _job(row)
+        # one process per job: a crashed SUMO (or libsumo) takes only its own run down.
+        # Spawned rather than forked, since the worker threads hold SQLite connections
+        # and locks that a forked child would copy in whatever state they are.
+        context = multiprocessing.get_context("spawn")
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_run_job_process, args=(sender, job, self.backend, self.warmup_dir), name=job.label
+        )
+        process.start()
+        # the child holds the only sending end now, so its death ends the pipe
+        sender.close()
+        try:
+            while not receiver.poll(HEARTBEAT_SECONDS):
+                if not self.queue.renew(row["id"], self.name):
+                    # the lease expired and another worker took the job over
+                    print(f"{self.name}: lost {job.label}")
+                    return
+            try:
+                result, error, retry = receiver.recv()
+            except EOFError:
+                process.join()
+                result, error, retry = None, f"job process exited with code {process.exitcode}", True
+        finally:
+            # stops the run of a lost job before this worker claims the next one
+            if process.is_alive():
+                process.terminate()
+            process.join()
+            receiver.close()
+        if error is not None:
+            status = self.queue.fail(row["id"], self.name, error, retry)
+            self.failed += 1
+            print(f"{self.name}: {job.label} attempt {row['attempts']} failed ({status}): {error}")
+            return
+        if self.queue.complete(row["id"], self.name, result):
+            self.done += 1
+            print(f"{self.name}: {job.label}: {result['decisions']} decisions, {result['lane_changes']} lane changes")
+
+    def run(self):
+        """Works until no job is pending or running anywhere."""
+        while True:
+            row = self.queue.claim(self.name)
+            if row is not None:
+                self.run_one(row)
+                continue
+            if self.queue.counts()["running"] == 0:
+                return
+            # running jobs of other workers may come back if their worker dies
+            time.sleep(POLL_SECONDS)
+
+
+def work(path, workers: int | None = None, backend: str = "traci", warmup_dir: str | None = None) -> dict[str, int]:
+    """
+    Drains the queue with `workers` workers in this process (one job process each).
+
+    Returns:
+        dict[str, int]: Number of jobs per status afterwards.
+    """
+    workers = workers or os.cpu_count() or 1
+    host = f"{socket.gethostname()}:{os.getpid()}"
+    # one connection per worker thread
+    pool = [Worker(JobQueue(path), f"{host}:{i}", backend, warmup_dir) for i in range(workers)]
+    threads = [threading.Thread(target=worker.run, name=worker.name) for worker in pool]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counts = pool[0].queue.counts()
+    for worker in pool:
+        worker.queue.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db", type=Path, help="SQLite file of the campaign")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="queue the jobs of a grid")
+    add.add_argument("--scenarios", nargs="+", default=["ScenarioC"])
+    add.add_argument("--models", nargs="+", default=list(MODELS), choices=list(MODELS))
+    add.add_argument("--seeds", type=int, default=10, help="number of seeds per combination")
+    add.add_argument("--first-seed", type=int, default=0)
+    add.add_argument("--scales", nargs="+", type=float, default=[1.0], help="demand scaling factors")
+    add.add_argument("--max-steps", type=int, default=500)
+
+    work_parser = commands.add_parser("work", help="run queued jobs until none is left")
+    work_parser.add_argument("--workers", type=int, default=None)
+    work_parser.add_argument("--backend", default="traci", choices=list(BACKENDS))
+    work_parser.add_argument("--warmup-dir", default=None)
+
+    commands.add_parser("status", help="jobs per status and the failures")
+    commands.add_parser("retry-failed", help="queue the failed jobs again")
+
+    export = commands.add_parser("export", help="write the results as JSON lines and the aggregate table as CSV")
+    export.add_argument("--out", type=Path, required=True)
+    args = parser.parse_args()
+
+    if args.command == "work":
+        print(work(args.db, args.workers, args.backend, args.warmup_dir))
+        return
+
+    queue = JobQueue(args.db)
+    if args.command == "add":
+        seeds = range(args.first_seed, args.first_seed + args.seeds)
+        jobs = expand_grid(args.scenarios, args.models, seeds, args.scales, args.max_steps)
+        print(f"{len(jobs)} jobs, {queue.add(jobs)} new")
+    elif args.command == "status":
+        print(queue.counts())
+        for row in queue.failures():
+            print(f"{row['scenario']} {row['model']} seed {row['seed']} {row['params']}: "
+                  f"{row['attempts']} attempts, {row['error']}")
+    elif args.command == "retry-failed":
+        print(f"{queue.retry_failed()} jobs queued again")
+    elif args.command == "export":
+        rows = queue.results()
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.out, "w") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+        if rows:
+            table_path = args.out.with_name(args.out.stem + "_summary.csv")
+            aggregate(rows).to_csv(table_path, index=False)
+            print(f"Wrote {len(rows)} results to {args.out} and {table_path}")
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,25 @@ from simulation_manager import SimulationManager
 # SCENARIO = "B"
 SCENARIO = "C"
 
+# Run plain sumo without the GUI delay, one worker process per model
+HEADLESS = False
+
+# SUMO client of headless runs: "traci" (socket) or "libsumo" (in-process, see sumo_backend.py)
+BACKEND = "traci"
+
+# Directory for the TraCI call profile of each run (see traci_profiler.py); None disables it
+PROFILE_DIR = None
+
+# Directory for the decision trace of each run (see decision_trace.py); None disables it
+TRACE_DIR = None
+
+# Directory caching the traffic warm-up of each scenario and seed (see warmup.py); None disables it.
+# Results of cached runs are not comparable to uncached ones
+WARMUP_DIR = None
+
+# Only re-run the decision model when a vehicle's neighborhood changed (see decision_scheduler.py)
+EVENT_DRIVEN = False
+
 
 def main():
     scenario = f"Scenario{SCENARIO}"
@@ -20,8 +39,20 @@ def main():
         "SL2015": SL2015(),
     }
 
-    sim_manager = SimulationManager(scenario=scenario, models=models, max_steps=500)
-    sim_manager.run_all_simulations()
+    sim_manager = SimulationManager(
+        scenario=scenario,
+        models=models,
+        max_steps=500,
+        gui=not HEADLESS,
+        backend=BACKEND,
+        profile_dir=PROFILE_DIR,
+        trace_dir=TRACE_DIR,
+        warmup_dir=WARMUP_DIR,
+        event_driven=EVENT_DRIVEN,
+    )
+    results = sim_manager.run_all_simulations()
+    for model_name, result in results.items():
+        print(f"{model_name}: {result}")
 
 
 if __name__ == "__main__":
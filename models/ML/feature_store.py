@@ -0,0 +1,100 @@
+# Feature store between preprocessing and training
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Columns training needs, in the order the scaler was fitted on (before the deltas)
+STORE_COLUMNS = ['v_E', 'a_E', 'P', 'G_TR', 'G_TP', 'v_P', 'v_TR', 'v_TP', 'mark']
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FeatureStore:
+    """
+    Labelled lane-change rows, stored as Parquet and addressed by content.
+
+    An entry's key is a hash of the raw trajectory file's content and of the
+    extraction parameters, so an input is only processed again when the file or
+    the labelling rules change. Entries hold only the labelled rows (mark != 0)
+    and the columns in STORE_COLUMNS.
+
+    The index file also remembers the content hash per raw file path, mtime and
+    size, so unchanged multi-GB inputs are not hashed again.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / 'index.json'
+        if self.index_path.exists():
+            self.index = json.loads(self.index_path.read_text())
+        else:
+            self.index = {'entries': {}, 'hashes': {}}
+
+    def _save_index(self):
+        tmp_path = self.index_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.index, indent=1, sort_keys=True))
+        os.replace(tmp_path, self.index_path)
+
+    def _content_hash(self, raw_path) -> str:
+        raw_path = Path(raw_path).resolve()
+        stat = raw_path.stat()
+        cached = self.index['hashes'].get(str(raw_path))
+        if cached and cached['mtime_ns'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+            return cached['sha256']
+        sha256 = file_sha256(raw_path)
+        self.index['hashes'][str(raw_path)] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': sha256}
+        self._save_index()
+        return sha256
+
+    def key(self, raw_path, params: dict) -> str:
+        digest = hashlib.sha256(self._content_hash(raw_path).encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()[:32]
+
+    def path(self, key: str) -> Path:
+        return self.root / f'{key}.parquet'
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index['entries'] and self.path(key).exists()
+
+    def put(self, key: str, labelled_path, source: str, params: dict) -> int:
+        """
+        Stores the labelled rows of a preprocessed Parquet file.
+
+        Returns:
+            int: Number of stored rows.
+        """
+        table = pq.read_table(labelled_path, columns=STORE_COLUMNS, filters=[('mark', '!=', 0)])
+        tmp_path = self.path(key).with_suffix('.tmp')
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, self.path(key))
+        self.index['entries'][key] = {'source': source, 'params': params, 'rows': table.num_rows}
+        self._save_index()
+        return table.num_rows
+
+    def load(self, keys=None, columns=None) -> pd.DataFrame:
+        """
+        Args:
+            keys: Entries to load; all entries when None.
+            columns: Columns to read; all STORE_COLUMNS when None.
+
+        Returns:
+            pd.DataFrame: The labelled rows of the entries, concatenated in key order.
+        """
+        keys = sorted(self.index['entries']) if keys is None else list(keys)
+        tables = [pq.read_table(self.path(key), columns=columns or STORE_COLUMNS) for key in keys]
+        if not tables:
+            return pd.DataFrame(columns=columns or STORE_COLUMNS)
+        return pa.concat_tables(tables).to_pandas()
@@ -1,204 +1,574 @@
 # preprocess
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import math
 import numpy as np
-import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from pathlib import Path
-# Load data using pandas
-# List all .csv files
-folder_path = Path("./data")
-files = folder_path.glob("*.csv")
-print(files)
-
-for file in files:
-    print(file.name)
-    
-    df = pd.read_csv('./data/' + file.name)
-    # Cut down size of df for testing
-    #df = df.iloc[:10000]
-
-    # Filter out any row that has a v_Class of 1 or 3 as these are not cars
-    # df = df[df['v_Class'] != 1]
-    # df = df[df['v_Class'] != 3]
-    # Drop collums that are not needed
-    #check if Space_Hdwy is in the data
-    if 'Space_Headway' in df.columns:
-        df = df.rename(columns={'Space_Headway': 'Space_Hdwy', 'Time_Headway': 'Time_Hdwy'})
-    
-    df = df.drop(columns=['v_Length', 'v_Width','Following'])
-   
-    
-
-    # Remove rows where Lane_ID is 6 - 8 as
-    """
-    Lane 1 is farthest left lane; lane 5 is farthest 
-    right lane. Lane 6 is the auxiliary lane between Ventura Boulevard on-ramp and the Cahuenga 
-    Boulevard off-ramp. Lane 7 is the on-ramp at Ventura Boulevard, and Lane 8 is the off-ramp at 
-    Cahuenga Boulevard.
-    """
-    df = df[df['Lane_ID'] != 6]
-    df = df[df['Lane_ID'] != 7]
-    df = df[df['Lane_ID'] != 8]
-
-# New plan: When lane change ID happends than mark the next row where the velocity is increased by 0.6096 m/s or more duirng the first 5 seconds of lane ID change this is START OF LANE CHANGE
-# When this is found, calculate the P, G_TR, G_TP, v_P, v_TR, v_TP, Elapsed_Time and mark the row where the lane change happened and the row before
-    df['P'] = 0.0
-    df['G_TR'] = 0.0
-    df['G_TP'] = 0.0
-    df['v_P'] = 0.0
-    df['v_TR'] = 0.0
-    df['v_TP'] = 0.0
-    # Like in novel paper mark the one before lane change and the one where lane change happens
-    df['mark'] = 0 
-    # Max Space Headway: 1321.55
-    mean_headway = df['Space_Hdwy'].mean()
-    headway_cap = mean_headway*2
-    #df = df[df.index % 2 != 0].reset_index(drop=True)
-    df = df.reset_index(drop=True)
-    # Save the length of the dataframe
-    og_len = len(df)
-    def calc(x):
-        not_faluty = True
-        # Parameters of ego car
-        lane_id = df['Lane_ID'].iloc[x]
-        local_y = df['Local_Y'].iloc[x]
-        global_time = (df['Global_Time'].iloc[x])
-        df["Vehicle_ID"] = df["Vehicle_ID"].round(1)
-        df["Global_Time"] = df["Global_Time"].round(1)
-
-        ## Calualte P
-        pred_id = df['Preceeding'].iloc[x]
-        pred_id = int(pred_id)
-        global_time = int(global_time)
-        if pred_id != 0:
-            # there is a car infront
-            
-            specific_vehicle_data = df[(df["Vehicle_ID"] ==  pred_id) & (df["Global_Time"] == global_time)]
-    
-            if specific_vehicle_data.empty:
-                # We should mark that this pair is faulty
-                not_faluty = False
-                print("Faluoty at:",x, "for pred_id:",pred_id, "current_id:",df['Vehicle_ID'].iloc[x], "global_time:",global_time, "lane_id:",lane_id, "pred_lane_id",specific_vehicle_data['Lane_ID'])
-                return not_faluty
-                
+from feature_store import FeatureStore
 
+# A lane change starts when Lane_ID decreases and is confirmed when the velocity
+# jumps by 0.6096 m/s (1.998 ft/s) or more between two frames within 5 seconds
+SPEED_JUMP_FT_S = 1.9980315
+LANE_CHANGE_WINDOW_S = 5
+
+# Lane 1 is farthest left lane; lane 5 is farthest right lane. Lane 6 is the
+# auxiliary lane between Ventura Boulevard on-ramp and the Cahuenga Boulevard
+# off-ramp. Lane 7 is the on-ramp at Ventura Boulevard, and Lane 8 is the
+# off-ramp at Cahuenga Boulevard.
+EXCLUDED_LANES = (6, 7, 8)
+
+FEATURE_COLUMNS = ['P', 'G_TR', 'G_TP', 'v_P', 'v_TR', 'v_TP']
+
+# Everything that changes the labels; part of the feature store key
+EXTRACTION_PARAMS = {
+    'speed_jump_ft_s': SPEED_JUMP_FT_S,
+    'window_s': LANE_CHANGE_WINDOW_S,
+    'excluded_lanes': list(EXCLUDED_LANES),
+}
+
+# Columns kept from the raw NGSIM files (v_Length, v_Width and Following are pruned).
+# Velocities, positions and headways stay float64 so thresholds and gaps are unchanged.
+RAW_DTYPES = {
+    'Vehicle_ID': 'int32', 'Frame_ID': 'int32', 'Total_Frames': 'int32', 'Global_Time': 'int64',
+    'Local_X': 'float32', 'Local_Y': 'float64', 'Global_X': 'float64', 'Global_Y': 'float64',
+    'v_Class': 'int8', 'v_Vel': 'float64', 'v_Acc': 'float64', 'Lane_ID': 'int8',
+    'Preceeding': 'int32', 'Space_Hdwy': 'float64', 'Time_Hdwy': 'float32',
+}
+# Some NGSIM periods use the long headway column names
+HEADER_ALIASES = {'Space_Headway': 'Space_Hdwy', 'Time_Headway': 'Time_Hdwy'}
+
+CHUNK_ROWS = 500_000
+# Columns of the neighbours that neighbor_features reads
+LOOKUP_COLUMNS = ['Vehicle_ID', 'Global_Time', 'Lane_ID', 'Local_Y', 'v_Vel']
+
+
+def _read_csv(path, chunksize=None):
+    dtypes = {**RAW_DTYPES, **{raw: RAW_DTYPES[name] for raw, name in HEADER_ALIASES.items()}}
+    return pd.read_csv(path, usecols=lambda column: column in dtypes, dtype=dtypes, chunksize=chunksize)
+
+
+def _clean(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.rename(columns=HEADER_ALIASES)
+    df = df[~df['Lane_ID'].isin(EXCLUDED_LANES)]
+    return df.reset_index(drop=True)
+
+
+def load_trajectories(path) -> pd.DataFrame:
+    return _clean(_read_csv(path))
+
+
+def read_trajectory_chunks(path, chunksize: int = CHUNK_ROWS):
+    """Yields the cleaned rows of a raw trajectory CSV in file order, chunksize rows at a time."""
+    for chunk in _read_csv(path, chunksize=chunksize):
+        yield _clean(chunk)
+
+
+def find_candidate_events(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Finds every row where a lane change could start and the row that would confirm it.
+
+    A candidate start is a row whose Lane_ID is lower than in the previous row of the
+    same vehicle. Its end is the first later row of the same vehicle run whose velocity
+    is at least SPEED_JUMP_FT_S above the previous row. The end is -1 when there is
+    no such row or it falls outside LANE_CHANGE_WINDOW_S; the lane change then stays
+    pending until the vehicle run ends.
+
+    Returns:
+        pd.DataFrame: Columns start, end and run (id of the contiguous vehicle run).
+    """
+    n = len(df)
+    vehicle = df['Vehicle_ID'].to_numpy()
+    lane = df['Lane_ID'].to_numpy()
+    vel = df['v_Vel'].to_numpy()
+    frame_time = df['Global_Time'].to_numpy()
+
+    same = np.zeros(n, dtype=bool)
+    same[1:] = vehicle[1:] == vehicle[:-1]
+    run = np.cumsum(~same)
+
+    lane_drop = np.zeros(n, dtype=bool)
+    lane_drop[1:] = lane[1:] < lane[:-1]
+    jump = np.zeros(n, dtype=bool)
+    jump[1:] = vel[1:] - vel[:-1] >= SPEED_JUMP_FT_S
+    jump &= same
+
+    # index of the first jump at or after each row (n when there is none)
+    rows = np.arange(n)
+    next_jump = np.minimum.accumulate(np.where(jump, rows, n)[::-1])[::-1]
+
+    start = np.flatnonzero(same & lane_drop)
+    end = np.full(len(start), -1)
+    has_next = start + 1 < n
+    candidate_end = next_jump[np.minimum(start + 1, n - 1)]
+    found = has_next & (candidate_end < n)
+    found[found] = run[candidate_end[found]] == run[start[found]]
+    timer = np.round((frame_time[candidate_end[found]] - frame_time[start[found]]) * 10e-4, 1)
+    in_window = np.zeros(len(start), dtype=bool)
+    in_window[found] = timer <= LANE_CHANGE_WINDOW_S
+    end[in_window] = candidate_end[in_window]
+    return pd.DataFrame({'start': start, 'end': end, 'run': run[start]})
+
+
+def neighbor_features(rows_df: pd.DataFrame, lookup: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes P, G_TR, G_TP, v_P, v_TR and v_TP for the given rows.
+
+    v_P is looked up by the Preceeding vehicle at the same Global_Time. The gaps and
+    velocities in the target lane (Lane_ID - 1) come from as-of joins on Local_Y
+    against the vehicles in that lane at the same Global_Time.
+
+    Args:
+        rows_df (pd.DataFrame): Rows to compute the features for, indexed by row number.
+        lookup (pd.DataFrame): All vehicles at the Global_Times of those rows, in file order.
+
+    Returns:
+        pd.DataFrame: Indexed by row, with the feature columns and a valid flag that
+        is False when the preceding vehicle or either target lane neighbour is missing.
+    """
+    query = pd.DataFrame({
+        'row': rows_df.index.to_numpy(),
+        'Global_Time': rows_df['Global_Time'].to_numpy().astype(np.int64),
+        'Lane_ID': rows_df['Lane_ID'].to_numpy().astype(np.int64) - 1,
+        'Local_Y': rows_df['Local_Y'].to_numpy().astype(np.float64),
+        'Preceeding': rows_df['Preceeding'].to_numpy().astype(np.int64),
+        'P': rows_df['Space_Hdwy'].to_numpy(),
+    })
+    lookup = lookup[['Vehicle_ID', 'Global_Time', 'Lane_ID', 'Local_Y', 'v_Vel']].astype(
+        {'Vehicle_ID': np.int64, 'Global_Time': np.int64, 'Lane_ID': np.int64, 'Local_Y': np.float64})
+
+    # Preceding vehicle; the first matching row wins, like specific_vehicle_data.values[0]
+    preceding = lookup.drop_duplicates(['Vehicle_ID', 'Global_Time'])
+    preceding = preceding.rename(columns={'Vehicle_ID': 'Preceeding', 'v_Vel': 'v_P'})
+    query = query.merge(preceding[['Preceeding', 'Global_Time', 'v_P']],
+                        on=['Preceeding', 'Global_Time'], how='left')
+
+    # Closest car in the target lane, strictly in front of / behind the ego.
+    # Ties on Local_Y resolve to the first row in file order, like idxmin/idxmax.
+    lane_cars = lookup[['Global_Time', 'Lane_ID', 'Local_Y', 'v_Vel']].assign(nb_Y=lookup['Local_Y'])
+    query = query.sort_values('Local_Y', kind='stable')
+    front = pd.merge_asof(query, lane_cars.sort_values('Local_Y', kind='stable'),
+                          on='Local_Y', by=['Global_Time', 'Lane_ID'],
+                          direction='forward', allow_exact_matches=False)
+    behind = pd.merge_asof(query[['row', 'Global_Time', 'Lane_ID', 'Local_Y']],
+                           lane_cars.iloc[::-1].sort_values('Local_Y', kind='stable'),
+                           on='Local_Y', by=['Global_Time', 'Lane_ID'],
+                           direction='backward', allow_exact_matches=False)
+    front = front.set_index('row')
+    behind = behind.set_index('row').reindex(front.index)
+
+    features = pd.DataFrame(index=front.index)
+    features['P'] = front['P']
+    features['v_P'] = front['v_P']
+    features['G_TP'] = np.round(front['nb_Y'] - front['Local_Y'], 2)
+    features['v_TP'] = front['v_Vel']
+    features['G_TR'] = np.round(behind['Local_Y'] - behind['nb_Y'], 2)
+    features['v_TR'] = behind['v_Vel']
+    features['valid'] = ((front['Preceeding'] != 0) & front['v_P'].notna()
+                         & front['nb_Y'].notna() & behind['nb_Y'].notna())
+    return features.reindex(rows_df.index)
+
+
+def resolve_events(candidates: pd.DataFrame, valid_rows: set, pending_run: int | None = None) -> tuple[list, list, list]:
+    """
+    Walks the candidate events of each vehicle run in order and keeps the ones that
+    the labelling rules accept.
+
+    While a lane change is pending no new one can start. After an accepted lane
+    change the next one can start two rows after its end, after a rejected one
+    (missing neighbours) on the row after its end. A candidate without an end keeps
+    the run pending until the run ends and is then discarded.
+
+    Args:
+        candidates (pd.DataFrame): Output of find_candidate_events.
+        valid_rows (set): Rows whose neighbour features could be computed.
+        pending_run (int | None): Run whose still pending lane change keeps its start
+            mark. The original row loop left it marked for the last run of a file.
+
+    Returns:
+        tuple[list, list, list]: Rows to mark 1 (start) and 2 (end) of accepted lane
+        changes, and the start row left pending in pending_run.
+    """
+    starts, ends, pending = [], [], []
+    for run, events in candidates.groupby('run', sort=True):
+        allowed_from = -1
+        for start, end in zip(events['start'].to_numpy(), events['end'].to_numpy()):
+            if start < allowed_from:
+                continue
+            if end < 0:
+                if run == pending_run:
+                    pending.append(start)
+                break
+            if start in valid_rows and end in valid_rows:
+                starts.append(start)
+                ends.append(end)
+                allowed_from = end + 2
             else:
-                p = df['Space_Hdwy'].iloc[x]
-                df.at[x, 'P'] = p
-                v_p = specific_vehicle_data['v_Vel'].values[0]
-                df.at[x, 'v_P'] = v_p
-                
-        else:
-            return False
-            v_p = df['v_Vel'].iloc[x] - 10
-            df.at[x, 'P'] = headway_cap # Large number should be inf
-            df.at[x, 'v_P'] = v_p
-            
-        
-                
-        ## Calculate G_TR and G_TP
-        
-        if lane_id != 0:
-            next_lane_cars = df[
-                (df["Lane_ID"] == lane_id - 1) &
-                (df["Global_Time"] == global_time)]
-           
-            # Get y values for cars in next lane
-            next_lane_front = next_lane_cars[next_lane_cars["Local_Y"] > local_y]
-            next_lane_behind = next_lane_cars[next_lane_cars["Local_Y"] < local_y]
-            # Get the car closest in the next lane
-            # Front car
-            if not next_lane_front.empty:
-                front_car = next_lane_front.loc[next_lane_front["Local_Y"].idxmin()] # Returns id of the closest car infront
-                v_tp = front_car["v_Vel"]
-                
-                g_tp = front_car["Local_Y"] - local_y  # Distance to the car ahead
-                df.at[x, 'G_TP'] = round(g_tp,2)
-                df.at[x, 'v_TP'] = v_tp
-              
-            else: 
-                return False
-                
-                
-
-            # Behind car  
-            if not next_lane_behind.empty:
-                behind_car = next_lane_behind.loc[next_lane_behind["Local_Y"].idxmax()] # Returns id of the closest car behind
-                v_tr = behind_car["v_Vel"]
-                
-                g_tr = local_y - behind_car["Local_Y"]  # Distance to the car behind
-                df.at[x, 'G_TR'] = round(g_tr,2)
-                df.at[x, 'v_TR'] = v_tr
-                
-            else:
-                return False
-                
-                
-        
-        return not_faluty
-
-    lane_change_idx = 0
-    start_of_lane_change = False
-    one_per_id = False
-    current_vel = 0
-    for x in range(1, len(df)):
-        ## Check if lane change happened
-        if (
-            df['Lane_ID'].iloc[x] < df['Lane_ID'].iloc[x-1] and 
-            df['Vehicle_ID'].iloc[x] == df['Vehicle_ID'].iloc[x-1] and not start_of_lane_change and not one_per_id
-        ):
-            
-            df.at[x,'mark'] = 1
-            vel = df['v_Vel'].iloc[x]
-            lane_change_idx = x
-            start_time = df['Global_Time'].iloc[x]
-            start_of_lane_change = True
-            one_per_id = True
-        elif (df['Vehicle_ID'].iloc[x] == df['Vehicle_ID'].iloc[x-1] and start_of_lane_change and one_per_id):
-            
-            current_vel = df['v_Vel'].iloc[x]
-            timer = round(((df['Global_Time'].iloc[x] - start_time)*10e-4),1)
-            
-            diff_vel = current_vel - vel
-            if diff_vel >= 1.9980315 and timer <= 5: # Feet instead of meters per seconds
-                df.at[x,'mark'] = 2
-                start_of_lane_change = False
-                # Calculate  P, G_TR, G_TP, v_P, v_TR, v_TP for x and lane_change_idx
-                
-                not_faulty1 = calc(lane_change_idx)
-                not_faulty2 = calc(x)
-                if not_faulty1 and not_faulty2:
-                    pass
-                else:
-                    df.at[lane_change_idx,'mark'] = 0
-                    df.at[x,'mark'] = 0
-                    one_per_id = False
-                    start_of_lane_change = False
-                
-                lane_change_idx = 0
-            else:
-                vel = current_vel    
+                allowed_from = end + 1
+    return starts, ends, pending
+
+
+def extract_lane_changes(df: pd.DataFrame, keep_trailing_pending: bool = True) -> pd.DataFrame:
+    """
+    Marks lane changes (1 = row where the lane changes, 2 = row where the velocity
+    jump confirms it) and fills the neighbour features for the marked rows.
+    """
+    df = df.copy()
+    for column in FEATURE_COLUMNS:
+        df[column] = 0.0
+    # Like in novel paper mark the one before lane change and the one where lane change happens
+    df['mark'] = 0
+
+    candidates = find_candidate_events(df)
+    rows = np.unique(np.concatenate([candidates['start'].to_numpy(),
+                                     candidates.loc[candidates['end'] >= 0, 'end'].to_numpy()]))
+    rows_df = df.iloc[rows]
+    # Only the time slices that are queried are needed for the joins
+    features = neighbor_features(rows_df, df[df['Global_Time'].isin(rows_df['Global_Time'].unique())])
+    valid_rows = set(features.index[features['valid']])
+    vehicle = df['Vehicle_ID'].to_numpy()
+    last_run = int(np.count_nonzero(vehicle[1:] != vehicle[:-1])) + 1
+    starts, ends, pending = resolve_events(candidates, valid_rows,
+                                           last_run if keep_trailing_pending else None)
+
+    marked = np.array(sorted(starts + ends), dtype=np.int64)
+    df.loc[marked, FEATURE_COLUMNS] = features.loc[marked, FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    df.loc[starts + pending, 'mark'] = 1
+    df.loc[ends, 'mark'] = 2
+    return df
+
+
+def cache_trajectories(path, clean_path, chunksize: int = CHUNK_ROWS) -> int:
+    """
+    Streams a raw trajectory CSV into a zstd Parquet cache of the cleaned rows.
+
+    Returns:
+        int: Number of cached rows.
+    """
+    writer = None
+    rows = 0
+    for chunk in read_trajectory_chunks(path, chunksize):
+        if chunk.empty:
+            continue
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(clean_path, table.schema, compression='zstd')
+        writer.write_table(table)
+        rows += len(chunk)
+    if writer is not None:
+        writer.close()
+    return rows
+
+
+def _iter_cache(cache: pq.ParquetFile, chunksize: int, vehicle_range=None):
+    for batch in cache.iter_batches(batch_size=chunksize):
+        part = batch.to_pandas()
+        if vehicle_range is not None:
+            part = part[part['Vehicle_ID'].between(*vehicle_range)]
+        if not part.empty:
+            yield part.reset_index(drop=True)
+
+
+def _append(writers: dict, path, df: pd.DataFrame):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if path not in writers:
+        writers[path] = pq.ParquetWriter(path, table.schema)
+    writers[path].write_table(table)
+
+
+def _time_batches(cache: pq.ParquetFile, query_path, chunksize: int) -> list[np.ndarray]:
+    """
+    Groups the Global_Times of the query rows so that each group has at most
+    chunksize rows in the whole file (at least one time per group).
+    """
+    counts = pd.Series(dtype=np.int64)
+    for batch in cache.iter_batches(batch_size=chunksize, columns=['Global_Time']):
+        counts = counts.add(batch.column(0).to_pandas().value_counts(), fill_value=0)
+    times = np.unique(pq.read_table(query_path, columns=['Global_Time']).column(0).to_numpy())
+    sizes = counts.reindex(times).to_numpy()
+    batches, first, size = [], 0, 0
+    for i, rows in enumerate(sizes):
+        if size and size + rows > chunksize:
+            batches.append(times[first:i])
+            first, size = i, 0
+        size += rows
+    batches.append(times[first:])
+    return batches
+
+
+def label_lane_changes(clean_path, output_path, vehicle_range=None, keep_trailing_pending: bool = True,
+                       chunksize: int = CHUNK_ROWS) -> dict:
+    """
+    Labels the cached rows of one trajectory file with bounded memory.
+
+    Pass 1 finds candidate events on complete vehicle runs, carrying the last
+    (possibly unfinished) run of each batch over to the next one, and spills the
+    events and the rows they query to temporary Parquet files. Pass 2 computes
+    the neighbour features of the query rows in groups of Global_Times holding
+    at most chunksize rows of the file, always from all vehicles. Pass 3 resolves
+    the events in slices of vehicle runs and pass 4 writes the labelled rows to
+    output_path. Only the accepted lane changes are kept between passes.
+
+    Args:
+        clean_path: Parquet cache written by cache_trajectories.
+        output_path: Parquet file for the labelled rows.
+        vehicle_range (tuple | None): Inclusive (first, last) Vehicle_ID to label;
+            other vehicles are only used as neighbours.
+        keep_trailing_pending (bool): See extract_lane_changes. Only the shard that
+            holds the end of the file should keep it.
+        chunksize (int): Rows per batch.
+
+    Returns:
+        dict: Number of labelled rows and lane changes.
+    """
+    cache = pq.ParquetFile(clean_path)
+    output_path = Path(output_path)
+    with tempfile.TemporaryDirectory(dir=output_path.parent) as tmp_dir:
+        events_path = Path(tmp_dir) / 'events.parquet'
+        query_path = Path(tmp_dir) / 'query.parquet'
+        features_path = Path(tmp_dir) / 'features.parquet'
+        writers = {}
+        offset = 0  # row number of the first row of the next block
+        run_offset = 0  # number of vehicle runs in the blocks already processed
+
+        def process(block: pd.DataFrame):
+            nonlocal offset, run_offset
+            block = block.reset_index(drop=True)
+            events = find_candidate_events(block)
+            local_rows = np.unique(np.concatenate([events['start'].to_numpy(),
+                                                   events.loc[events['end'] >= 0, 'end'].to_numpy()]))
+            rows_df = block.iloc[local_rows][['Global_Time', 'Lane_ID', 'Local_Y', 'Preceeding', 'Space_Hdwy']]
+            if len(events):
+                _append(writers, query_path, rows_df.assign(row=local_rows + offset))
+                events['start'] += offset
+                events.loc[events['end'] >= 0, 'end'] += offset
+                events['run'] += run_offset
+                _append(writers, events_path, events)
+            vehicle = block['Vehicle_ID'].to_numpy()
+            run_offset += int(np.count_nonzero(vehicle[1:] != vehicle[:-1])) + 1
+            offset += len(block)
+
+        carry = None
+        for part in _iter_cache(cache, chunksize, vehicle_range):
+            block = part if carry is None else pd.concat([carry, part], ignore_index=True)
+            # the last vehicle run may continue in the next batch
+            vehicle = block['Vehicle_ID'].to_numpy()
+            changes = np.flatnonzero(vehicle[1:] != vehicle[:-1])
+            split = changes[-1] + 1 if len(changes) else 0
+            if split:
+                process(block.iloc[:split])
+            carry = block.iloc[split:]
+        if carry is None:
+            return {'rows': 0, 'lane_changes': 0}
+        process(carry)
+        del carry
+        for writer in writers.values():
+            writer.close()
+
+        starts, ends, pending, marked_features = [], [], [], []
+        if events_path.exists():
+            for times in _time_batches(cache, query_path, chunksize):
+                rows_df = pq.read_table(query_path, filters=[('Global_Time', 'in', times.tolist())]).to_pandas()
+                lookup = [
+                    batch.filter(pc.is_in(batch.column('Global_Time'), pa.array(times))).to_pandas()
+                    for batch in cache.iter_batches(batch_size=chunksize, columns=LOOKUP_COLUMNS)
+                ]
+                features = neighbor_features(rows_df.set_index('row'), pd.concat(lookup, ignore_index=True))
+                _append(writers, features_path, features.rename_axis('row').reset_index())
+                del rows_df, lookup, features
+            writers[features_path].close()
+
+            def resolve(events: pd.DataFrame):
+                if events.empty:
+                    return
+                first, last = int(events['start'].min()), int(events[['start', 'end']].to_numpy().max())
+                features = pq.read_table(
+                    features_path, filters=[('row', '>=', first), ('row', '<=', last)]
+                ).to_pandas().set_index('row')
+                valid_rows = set(features.index[features['valid']])
+                run_starts, run_ends, run_pending = resolve_events(
+                    events, valid_rows, run_offset if keep_trailing_pending else None)
+                starts.extend(run_starts)
+                ends.extend(run_ends)
+                pending.extend(run_pending)
+                marked = np.array(sorted(run_starts + run_ends), dtype=np.int64)
+                marked_features.append(features.loc[marked, FEATURE_COLUMNS].astype(np.float64))
+
+            carry = None
+            for batch in pq.ParquetFile(events_path).iter_batches(batch_size=chunksize):
+                events = batch.to_pandas()
+                if carry is not None:
+                    events = pd.concat([carry, events], ignore_index=True)
+                # the events of the last run may continue in the next batch
+                last_run = events['run'].iloc[-1]
+                carry = events[events['run'] == last_run]
+                resolve(events[events['run'] != last_run])
+            resolve(carry)
+
+        marks = pd.Series(0, index=np.array(starts + pending + ends, dtype=np.int64), dtype=np.int8)
+        marks[starts + pending] = 1
+        marks[ends] = 2
+        marks = marks.sort_index()
+        if marked_features:
+            marked_features = pd.concat(marked_features).sort_index()
         else:
-            one_per_id = False
-            start_of_lane_change = False
-            df.at[lane_change_idx,'mark'] = 0
-            lane_change_idx = 0
+            marked_features = pd.DataFrame(columns=FEATURE_COLUMNS, dtype=np.float64)
+
+        writer = None
+        row = 0
+        for part in _iter_cache(cache, chunksize, vehicle_range):
+            part.index = np.arange(row, row + len(part))
+            row += len(part)
+            for column in FEATURE_COLUMNS:
+                part[column] = 0.0
+            part['mark'] = np.int8(0)
+            in_part = marked_features.index[(marked_features.index >= part.index[0]) & (marked_features.index <= part.index[-1])]
+            part.loc[in_part, FEATURE_COLUMNS] = marked_features.loc[in_part].to_numpy()
+            in_part = marks.index[(marks.index >= part.index[0]) & (marks.index <= part.index[-1])]
+            part.loc[in_part, 'mark'] = marks.loc[in_part].to_numpy()
+            part = part.rename(columns={'v_Vel': 'v_E', 'v_Acc': 'a_E'})
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema, compression='zstd')
+            writer.write_table(table)
+        writer.close()
+    return {'rows': row, 'lane_changes': len(ends)}
+
+
+def stream_lane_changes(path, output_path, chunksize: int = CHUNK_ROWS) -> dict:
+    """
+    Labels a raw trajectory CSV with bounded memory and writes it as Parquet.
+
+    Returns:
+        dict: Number of rows and of labelled lane changes.
+    """
+    output_path = Path(output_path)
+    clean_path = output_path.with_name(output_path.stem + '.clean.parquet')
+    if not cache_trajectories(path, clean_path, chunksize):
+        return {'rows': 0, 'lane_changes': 0}
+    summary = label_lane_changes(clean_path, output_path, chunksize=chunksize)
+    clean_path.unlink()
+    return summary
+
+
+def plan_shards(clean_path, shards: int) -> list[tuple[int, int]]:
+    """
+    Splits the vehicles of a cached file into contiguous Vehicle_ID ranges with about
+    the same number of rows each.
+
+    Returns:
+        list[tuple[int, int]]: Inclusive (first, last) Vehicle_ID per shard.
+    """
+    vehicles = pq.read_table(clean_path, columns=['Vehicle_ID']).column('Vehicle_ID').to_numpy()
+    ids, counts = np.unique(vehicles, return_counts=True)
+    if len(ids) == 0:
+        return []
+    cumulative = np.cumsum(counts)
+    bounds = np.searchsorted(cumulative, cumulative[-1] * np.arange(1, shards) / shards)
+    edges = np.unique(np.concatenate([[0], bounds + 1, [len(ids)]]))
+    edges = edges[edges <= len(ids)]
+    return [(int(ids[lo]), int(ids[hi - 1])) for lo, hi in zip(edges[:-1], edges[1:]) if hi > lo]
+
+
+def _cache_worker(path, clean_path, chunksize):
+    start = time.perf_counter()
+    rows = cache_trajectories(path, clean_path, chunksize)
+    return rows, time.perf_counter() - start
+
 
-            
-    
-    # find all index with mark != 0
-    print(df[df['mark'] != 0])
+def _shard_worker(clean_path, shard_path, vehicle_range, keep_trailing_pending, chunksize):
+    start = time.perf_counter()
+    summary = label_lane_changes(clean_path, shard_path, vehicle_range, keep_trailing_pending, chunksize)
+    summary['seconds'] = time.perf_counter() - start
+    return summary
 
 
-    df = df.rename(columns={'v_Vel': 'v_E', 'v_Acc': 'a_E'})
-    # Drop the extra rows that are produced
-    df = df.drop(df.tail(len(df)-og_len).index)
-    
-    # REMOVE ALL LANE CAHNGES THAT INCREASE THE LANE ID - want to go from fast lane to slowest lane
+def preprocess_all(data_dir, output_dir, workers: int | None = None, shards_per_file: int | None = None,
+                   chunksize: int = CHUNK_ROWS, store: FeatureStore | None = None) -> list[dict]:
+    """
+    Labels every trajectory CSV in data_dir on a process pool.
+
+    Each file is first cached as Parquet (one task per file), then split into
+    Vehicle_ID ranges that are labelled in parallel. Every shard still sees the
+    full time slices of its file for the neighbour lookups. Shard outputs are
+    merged in Vehicle_ID order into output_dir/update_<name>.parquet, which matches
+    the row order of the NGSIM files (sorted by vehicle, then time).
+
+    With a feature store, files whose content and EXTRACTION_PARAMS are already in
+    the store are skipped, and the labelled rows of new files are added to it.
+
+    Returns:
+        list[dict]: Per shard: file, vehicle range, rows, lane changes, seconds and rows per second.
+    """
+    data_dir, output_dir = Path(data_dir), Path(output_dir)
+    work_dir = output_dir / 'tmp'
+    work_dir.mkdir(parents=True, exist_ok=True)
+    files = sorted(data_dir.glob('*.csv'))
+    if store is not None:
+        keys = {file: store.key(file, EXTRACTION_PARAMS) for file in files}
+        for file in files:
+            if keys[file] in store:
+                print(f"{file.name}: unchanged, already in the feature store")
+        files = [file for file in files if keys[file] not in store]
+    if not files:
+        return []
+    workers = workers or os.cpu_count() or 1
+    shards_per_file = shards_per_file or max(1, -(-workers // len(files)))
+
+    report = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        clean_paths = {file: work_dir / (file.stem + '.clean.parquet') for file in files}
+        cached = {file: executor.submit(_cache_worker, file, clean_paths[file], chunksize) for file in files}
 
-    #save the dataframe to a new csv file
-    update_file = 'update_' + file.name
+        shards = {}
+        for file in files:
+            rows, seconds = cached[file].result()
+            print(f"{file.name}: cached {rows} rows in {seconds:.1f}s")
+            if not rows:
+                continue
+            ranges = plan_shards(clean_paths[file], shards_per_file)
+            last_vehicle = pq.read_table(clean_paths[file], columns=['Vehicle_ID']).column('Vehicle_ID')[-1].as_py()
+            shards[file] = []
+            for index, vehicle_range in enumerate(ranges):
+                shard_path = work_dir / f'{file.stem}.shard{index}.parquet'
+                # only the shard holding the end of the file keeps a trailing pending lane change
+                keep_pending = vehicle_range[0] <= last_vehicle <= vehicle_range[1]
+                future = executor.submit(_shard_worker, clean_paths[file], shard_path, vehicle_range,
+                                         keep_pending, chunksize)
+                shards[file].append((vehicle_range, shard_path, future))
 
-    df.to_csv('./update_data/'+ update_file, index=False)
+        for file in files:
+            writer = None
+            for vehicle_range, shard_path, future in shards.get(file, []):
+                summary = future.result()
+                summary.update(file=file.name, vehicles=vehicle_range)
+                summary['rows_per_s'] = summary['rows'] / summary['seconds'] if summary['seconds'] else 0.0
+                report.append(summary)
+                print(f"{file.name} vehicles {vehicle_range[0]}-{vehicle_range[1]}: {summary['rows']} rows, "
+                      f"{summary['lane_changes']} lane changes, {summary['rows_per_s']:.0f} rows/s")
+                if not summary['rows']:
+                    continue
+                shard = pq.ParquetFile(shard_path)
+                for batch in shard.iter_batches(batch_size=chunksize):
+                    if writer is None:
+                        writer = pq.ParquetWriter(output_dir / f'update_{file.stem}.parquet', batch.schema,
+                                                  compression='zstd')
+                    writer.write_batch(batch)
+                shard_path.unlink()
+            if writer is not None:
+                writer.close()
+                if store is not None:
+                    rows = store.put(keys[file], output_dir / f'update_{file.stem}.parquet', file.name,
+                                     EXTRACTION_PARAMS)
+                    print(f"{file.name}: {rows} labelled rows added to the feature store")
+            clean_paths[file].unlink(missing_ok=True)
+    return report
 
 
+if __name__ == "__main__":
+    # Label every new or changed .csv file in ./data, sharded across all cores
+    preprocess_all(Path("./data"), Path("./update_data"), store=FeatureStore("./feature_store"))
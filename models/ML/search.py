@@ -0,0 +1,143 @@
+# Hyperparameter search for the RBF SVC
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+from sklearn.metrics.pairwise import rbf_kernel
+from sklearn.svm import SVC
+
+
+def scale_gamma(X) -> float:
+    """gamma='scale' as SVC computes it: 1 / (n_features * X.var())"""
+    X = np.asarray(X, dtype=np.float64)
+    return 1.0 / (X.shape[1] * X.var())
+
+
+def _fit_trial(C, rows, K_train, y_train, K_test, y_test):
+    model = SVC(C=C, kernel='precomputed', random_state=42, class_weight='balanced')
+    model.fit(K_train[np.ix_(rows, rows)], y_train[rows])
+    y_pred = model.predict(K_test[:, rows])
+    return {
+        'C': float(C),
+        'n_train': int(len(rows)),
+        'accuracy': accuracy_score(y_test, y_pred),
+        'precision': precision_score(y_test, y_pred, zero_division=0),
+        'recall': recall_score(y_test, y_pred, zero_division=0),
+        'f1': f1_score(y_test, y_pred, zero_division=0),
+    }
+
+
+class KernelSearch:
+    """
+    Search over C for an RBF SVC with a fixed gamma.
+
+    The RBF kernel between all training rows (and between test and training rows)
+    is computed once and reused by every trial through kernel='precomputed', which
+    gives the same fits as kernel='rbf' with that gamma. Trials run on all cores
+    and every finished trial is appended to a JSON-lines checkpoint, so an
+    interrupted search skips the trials it already has when it is run again.
+
+    With eta set, the search uses successive halving: all C values are fitted on a
+    random subset of the training rows, the best 1/eta (by test accuracy) move on
+    to a subset eta times larger, until the survivors are fitted on all rows.
+    """
+
+    def __init__(self, X_train, y_train, X_test, y_test, gamma: float | None = None,
+                 checkpoint_path=None, n_jobs: int = -1, random_state: int = 0):
+        X_train = np.asarray(X_train, dtype=np.float64)
+        X_test = np.asarray(X_test, dtype=np.float64)
+        self.y_train = np.asarray(y_train)
+        self.y_test = np.asarray(y_test)
+        self.gamma = scale_gamma(X_train) if gamma is None else gamma
+        self.K_train = rbf_kernel(X_train, X_train, gamma=self.gamma)
+        self.K_test = rbf_kernel(X_test, X_train, gamma=self.gamma)
+        self.checkpoint_path = Path(checkpoint_path) if checkpoint_path else None
+        self.n_jobs = n_jobs
+        # rung subsets are prefixes of one permutation, so they are nested
+        self.order = np.random.default_rng(random_state).permutation(len(self.y_train))
+
+        # trials in the checkpoint only count for the same data and gamma
+        digest = hashlib.sha256()
+        for array in (X_train, self.y_train, X_test, self.y_test):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        digest.update(repr(self.gamma).encode())
+        self.data_key = digest.hexdigest()[:16]
+        self.trials = self._load_checkpoint()
+
+    def _load_checkpoint(self) -> dict:
+        trials = {}
+        if self.checkpoint_path is None or not self.checkpoint_path.exists():
+            return trials
+        with open(self.checkpoint_path) as f:
+            for line in f:
+                try:
+                    trial = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line of an interrupted write
+                    continue
+                if trial.get('data') == self.data_key:
+                    trials[(round(trial['C'], 10), trial['n_train'])] = trial
+        return trials
+
+    def _record(self, trial: dict):
+        trial['data'] = self.data_key
+        self.trials[(round(trial['C'], 10), trial['n_train'])] = trial
+        if self.checkpoint_path is not None:
+            with open(self.checkpoint_path, 'a') as f:
+                f.write(json.dumps(trial) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def evaluate(self, cs, n_train: int) -> list[dict]:
+        """Fits every C on the first n_train rows of a fixed permutation of the training set."""
+        n = len(self.y_train)
+        rows = np.sort(self.order[:n_train]) if n_train < n else np.arange(n)
+        todo = [C for C in cs if (round(float(C), 10), n_train) not in self.trials]
+        if todo:
+            jobs = (delayed(_fit_trial)(C, rows, self.K_train, self.y_train, self.K_test, self.y_test)
+                    for C in todo)
+            for trial in Parallel(n_jobs=self.n_jobs, return_as='generator')(jobs):
+                self._record(trial)
+        return [self.trials[(round(float(C), 10), n_train)] for C in cs]
+
+    def run(self, cs, eta: int | None = 3, min_train: int = 200) -> list[dict]:
+        """
+        Args:
+            cs: Candidate C values.
+            eta (int | None): Halving factor; None fits every C on all training rows.
+            min_train (int): Training rows in the first halving rung.
+
+        Returns:
+            list[dict]: Every trial of the search, in the order they were evaluated.
+        """
+        n = len(self.y_train)
+        cs = [float(C) for C in cs]
+        if eta is None:
+            return self.evaluate(cs, n)
+
+        # each rung has eta times fewer candidates and eta times more rows than the last
+        n_rungs = 1
+        while len(cs) // eta ** n_rungs >= 1 and n // eta ** n_rungs >= min_train:
+            n_rungs += 1
+        rungs = [n // eta ** k for k in reversed(range(n_rungs))]
+
+        history = []
+        for n_train in rungs:
+            trials = self.evaluate(cs, n_train)
+            history += trials
+            if n_train == n:
+                break
+            keep = max(1, len(cs) // eta)
+            ranked = sorted(trials, key=lambda trial: trial['accuracy'], reverse=True)
+            cs = sorted(trial['C'] for trial in ranked[:keep])
+        return history
+
+    def best(self, history: list[dict], metric: str = 'accuracy') -> dict:
+        """Best trial fitted on all training rows; ties go to the smallest C."""
+        n = len(self.y_train)
+        full = [trial for trial in history if trial['n_train'] == n]
+        return max(full, key=lambda trial: (trial[metric], -trial['C']))
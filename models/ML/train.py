@@ -1,5 +1,7 @@
 # split into test and train set
 from sklearn.model_selection import train_test_split
+import matplotlib
+matplotlib.use('Agg')  # headless: figures are saved instead of shown
 import matplotlib.pyplot as plt
 from sklearn.model_selection import learning_curve
 import numpy as np
@@ -13,10 +15,26 @@ from sklearn.metrics import precision_score, recall_score, f1_score
 from sklearn.model_selection import GridSearchCV,RandomizedSearchCV
 import joblib
 from sklearn.preprocessing import StandardScaler,RobustScaler
-
-folder_path = Path("./update_data")
-all_files = folder_path.glob("*.csv")
-df = pd.concat((pd.read_csv(file) for file in all_files), ignore_index=True)
+from search import KernelSearch
+from feature_store import FeatureStore
+from preprocess import EXTRACTION_PARAMS
+
+# Successive-halving factor for the C search (None fits every C on the full training set)
+HALVING_ETA = 3
+# Finished trials; an interrupted search resumes from here
+CHECKPOINT_PATH = './search_checkpoint.jsonl'
+
+# Labelled rows of the files in ./data, as written by preprocess.py
+store = FeatureStore("./feature_store")
+raw_files = sorted(Path("./data").glob("*.csv"))
+keys = [store.key(file, EXTRACTION_PARAMS) for file in raw_files] or None  # every entry when ./data is absent
+missing = [str(file) for file, key in zip(raw_files, keys or []) if key not in store]
+if missing:
+    raise SystemExit(
+        f"{len(missing)} file(s) in ./data are not in the feature store (or changed since): "
+        f"{', '.join(missing)}\nRun preprocess.py first."
+    )
+df = store.load(keys)
 #df = pd.read_csv('./update_data/update_trajectories-0515-0530.csv')
 
 # From meeting with Marco
@@ -40,12 +58,7 @@ columns = list(df.columns)
 #put mark at the end of the dataframe
 df['mark']=df.pop('mark')
 print(df.head(1))
-# save csv file
-df.to_csv('./temp.csv', index=False)
 
-df = df.drop(columns=['Vehicle_ID', 'Frame_ID','v_Class','Space_Hdwy','Time_Hdwy', 'Total_Frames','Lane_ID', 'Global_Time', 'Local_X', 'Preceeding', 'Local_Y',  'Global_X'  , 'Global_Y'])
-# Save temp file
-df.to_csv('./temp_clean.csv', index=False)
 # Split data into training and test sets
 x = df.iloc[:, :-1]
 y = df.iloc[:, -1]
@@ -71,54 +84,31 @@ print("Standard deviations after scaling:\n", np.round(scaled_df.std(), 5))
 # Define Model
 
 css = np.arange(1,4,0.01)
-acc = []
-prec = []
-rec = []
-f = []
-for i in css: 
-    model = SVC(C=i,kernel='rbf', random_state=42, class_weight='balanced')
-    model.fit(X_train, y_train)
-    predictions = model.predict(X_test)
-    accuracy = model.score(X_test, y_test) 
-    acc.append(accuracy)
-    
-    # Calculate precision, recall, and F1-score
-    y_true = y_test
-    y_pred = predictions
-    precision = precision_score(y_true, y_pred)
-    recall = recall_score(y_true, y_pred)
-    f1 = f1_score(y_true, y_pred)
-    prec.append(precision)
-    rec.append(recall)
-    f.append(f1)
-    
+search = KernelSearch(X_train, y_train, X_test, y_test, checkpoint_path=CHECKPOINT_PATH)
+history = search.run(css, eta=HALVING_ETA)
 
+# Scores per C on the full training set
+full = sorted((trial for trial in history if trial['n_train'] == len(y_train)), key=lambda trial: trial['C'])
 plt.xlabel('C')
 plt.ylabel('Score')
-plt.plot(css, acc,label="Accuracy")
-# plt.scatter(css, acc)
-plt.plot(css, prec,label="Precision")
-# plt.scatter(css, prec)
-plt.plot(css, rec,label="Recall")
-# plt.scatter(css, rec)
-plt.plot(css, f,label="F1")
-# plt.scatter(css, f)
+for metric, label in [('accuracy', "Accuracy"), ('precision', "Precision"), ('recall', "Recall"), ('f1', "F1")]:
+    plt.plot([trial['C'] for trial in full], [trial[metric] for trial in full], marker='.', label=label)
 plt.legend()
-plt.show()
-
+plt.savefig('search_scores.png')
+plt.close()
 
 
 # Evaluate the predictions
 
-print("Accuracy of SVM:", np.max(acc), np.argmax(acc))
-print("Max precision:", np.max(prec), np.argmax(prec))
-print("Max recall:", np.max(rec), np.argmax(rec))
-print("Max F1-score:", np.max(f), np.argmax(f))
-print("C value for best accuracy:", css[np.argmax(acc)])
+for metric in ['accuracy', 'precision', 'recall', 'f1']:
+    trial = search.best(history, metric)
+    print(f"Max {metric}:", trial[metric], "C:", trial['C'])
+best_C = search.best(history, 'accuracy')['C']
+print("C value for best accuracy:", best_C)
 
 
 # Best model: 
-model = SVC(C=css[np.argmax(acc)],kernel='rbf', random_state=42, class_weight='balanced')
+model = SVC(C=best_C,kernel='rbf', random_state=42, class_weight='balanced')
 model.fit(X_train, y_train)
 y_pred = model.predict(X_test)
 cm = confusion_matrix(y_test, y_pred)
@@ -127,7 +117,8 @@ cm = confusion_matrix(y_test, y_pred)
 disp = ConfusionMatrixDisplay(confusion_matrix=cm, display_labels=model.classes_)
 disp.plot(cmap='Blues', colorbar=True)
 plt.title("Confusion Matrix")
-plt.show()
+plt.savefig('confusion_matrix.png')
+plt.close()
 
 # Save the model and scaler
 joblib.dump(model, 'svm_model.pkl')
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _object_size(obj, seen: set) -> tuple[int, int]:
+    """
+    Walks an unpickled object and sums the memory held by it.
+
+    Returns:
+        tuple[int, int]: (heap bytes, memory-mapped bytes). Memory-mapped arrays
+        are backed by the page cache and shared between processes.
+    """
+    if id(obj) in seen:
+        return 0, 0
+    seen.add(id(obj))
+    if isinstance(obj, np.memmap):
+        return sys.getsizeof(obj), obj.nbytes
+    if isinstance(obj, np.ndarray):
+        if obj.base is not None:
+            heap, mapped = _object_size(obj.base, seen)
+            return sys.getsizeof(obj) + heap, mapped
+        return sys.getsizeof(obj) + obj.nbytes, 0
+    heap, mapped = sys.getsizeof(obj), 0
+    if isinstance(obj, dict):
+        children = list(obj.keys()) + list(obj.values())
+    elif isinstance(obj, (list, tuple, set)):
+        children = list(obj)
+    elif hasattr(obj, "__dict__"):
+        children = [obj.__dict__]
+    else:
+        children = []
+    for child in children:
+        child_heap, child_mapped = _object_size(child, seen)
+        heap += child_heap
+        mapped += child_mapped
+    return heap, mapped
+
+
+class LoadedArtifact:
+    def __init__(self, path: str, obj, sha256: str, stat: os.stat_result, load_seconds: float):
+        self.path = path
+        self.obj = obj
+        self.sha256 = sha256
+        self.stat_key = (stat.st_mtime_ns, stat.st_size)
+        self.load_seconds = load_seconds
+        self.heap_bytes, self.mapped_bytes = _object_size(obj, set())
+        self.loads = 1
+
+
+class ArtifactRegistry:
+    """
+    Process-wide cache of joblib artifacts (trained models, scalers).
+
+    Every artifact is loaded once per process. Numpy arrays inside the pickle are
+    memory-mapped, so worker processes that load the same file share those pages.
+    A file is only reloaded when its content hash changes; the hash is only
+    recomputed when the file's mtime or size changes.
+    """
+
+    def __init__(self, mmap_mode: str | None = "r"):
+        self.mmap_mode = mmap_mode
+        self._artifacts: dict[str, LoadedArtifact] = {}
+
+    def get(self, path: str):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        artifact = self._artifacts.get(path)
+        if artifact is not None:
+            if artifact.stat_key == (stat.st_mtime_ns, stat.st_size):
+                return artifact.obj
+            sha256 = file_sha256(path)
+            if sha256 == artifact.sha256:
+                artifact.stat_key = (stat.st_mtime_ns, stat.st_size)
+                return artifact.obj
+        else:
+            sha256 = file_sha256(path)
+
+        start = time.perf_counter()
+        obj = joblib.load(path, mmap_mode=self.mmap_mode)
+        loaded = LoadedArtifact(path, obj, sha256, stat, time.perf_counter() - start)
+        if artifact is not None:
+            loaded.loads = artifact.loads + 1
+        self._artifacts[path] = loaded
+        return obj
+
+    def clear(self):
+        self._artifacts.clear()
+
+    def report(self) -> dict[str, dict]:
+        """
+        Returns:
+            dict[str, dict]: Per artifact path: content hash, number of loads,
+            last load time in seconds and resident size (heap and memory-mapped bytes).
+        """
+        return {
+            path: {
+                "sha256": artifact.sha256,
+                "loads": artifact.loads,
+                "load_seconds": artifact.load_seconds,
+                "heap_bytes": artifact.heap_bytes,
+                "mapped_bytes": artifact.mapped_bytes,
+            }
+            for path, artifact in self._artifacts.items()
+        }
+
+
+# Shared by all models in this process
+registry = ArtifactRegistry()
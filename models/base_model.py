@@ -1,7 +1,25 @@
 from abc import ABC, abstractmethod
 
+import numpy as np
+
+from models.features import LaneChangeFeatures
+
+# Below this many requests a step is decided vehicle by vehicle: gathering a
+# feature block costs about as much as 30 scalar decisions of the analytic
+# models (benchmarks/decision_models.py)
+BATCH_MIN_REQUESTS = 32
+
 
 class BaseDecisionModel(ABC):
+    # Inputs and intermediate values (name -> one value per row) of the last
+    # decide_lane_changes call, for the decision trace; None when not available
+    last_features: LaneChangeFeatures | None = None
+    last_metrics: dict[str, np.ndarray] | None = None
+    # Fields of LaneChangeFeatures that decide_batch reads; only these are gathered.
+    # The default decide_batch decides request by request and reads none.
+    batch_fields: tuple[str, ...] = ()
+    batch_min_requests: int = BATCH_MIN_REQUESTS
+
     @abstractmethod
     def decide_lane_change(self, **kwargs):
         """
@@ -12,3 +30,33 @@ class BaseDecisionModel(ABC):
             bool: True if the vehicle decides to change lanes, False otherwise.
         """
         pass
+
+    def decide_batch(self, features: LaneChangeFeatures) -> np.ndarray:
+        """
+        Vectorized decide_lane_change over many (vehicle, candidate lane) pairs.
+        Models without a vectorized implementation keep this default, which calls
+        decide_lane_change for each of the requests the block was gathered from.
+        Args:
+            features (LaneChangeFeatures): Struct-of-arrays inputs, one row per pair.
+        Returns:
+            np.ndarray: One bool decision per row.
+        """
+        return np.fromiter(
+            (self.decide_lane_change(**request) for request in features.requests), dtype=bool, count=len(features)
+        )
+
+    def decide_lane_changes(self, requests: list[dict]) -> list[bool]:
+        """
+        Determines the lane-change decisions of all controlled vehicles in one step.
+        Uses decide_batch when the step has at least batch_min_requests requests.
+        Args:
+            requests (list[dict]): Keyword arguments of decide_lane_change, one per vehicle.
+        Returns:
+            list[bool]: One decision per request, in the same order.
+        """
+        if len(requests) < self.batch_min_requests:
+            self.last_features = self.last_metrics = None
+            return [self.decide_lane_change(**request) for request in requests]
+        self.last_features = LaneChangeFeatures.from_requests(requests, self.batch_fields)
+        self.last_metrics = None
+        return self.decide_batch(self.last_features).tolist()
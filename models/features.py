@@ -0,0 +1,165 @@
+import numpy as np
+
+# Float fields of a feature block. For the neighbour fields the matching has_* mask
+# tells whether the vehicle exists; the values are 0 where it does not.
+FLOAT_FIELDS = (
+    "v_E",  # ego speed
+    "a_E",  # ego acceleration
+    "max_speed",  # ego max speed
+    "d_tf",  # distance_between(ego, closest_front) in the target lane
+    "v_tf",
+    "d_tb",  # distance_between(closest_back, ego) in the target lane
+    "v_tb",
+    "v_cf",  # speed of the closest_front in the current lane
+    "d_p",  # distance_between(preceding, ego), preceding = next vehicle in the current lane
+    "v_p",
+    "d_last",  # distance_between(last, ego), last = frontmost vehicle of the target lane
+    "v_last",
+    "target_length",  # length of the target lane
+)
+INT_FIELDS = (
+    "current_index",  # lane index of the current lane
+    "target_index",  # lane index of the target lane
+    "target_count",  # vehicles on the target lane
+)
+BOOL_FIELDS = ("has_tf", "has_tb", "has_cf", "has_p", "has_last", "same_lane")
+
+
+ALL_FIELDS = FLOAT_FIELDS + INT_FIELDS + BOOL_FIELDS
+
+
+class LaneChangeFeatures:
+    """
+    Struct-of-arrays block with the inputs of the decision models, one row per
+    (vehicle, candidate lane) pair.
+
+    The neighbours are the same vehicles the per-vehicle models pick through
+    NeighborhoodSnapshot.closest and the lane order, so a vectorized decision
+    over a block matches decide_lane_change row by row. Blocks gathered for a
+    subset of the fields have None for the others; blocks gathered from requests
+    keep them, for models that decide row by row.
+    """
+
+    def __init__(self, requests: list[dict] | None = None, **arrays):
+        self.fields = tuple(name for name in ALL_FIELDS if name in arrays)
+        self.requests = requests
+        if self.fields:
+            self._n = len(arrays[self.fields[0]])
+        else:
+            self._n = len(requests) if requests is not None else 0
+        for name in ALL_FIELDS:
+            setattr(self, name, arrays.get(name))
+
+    def __len__(self) -> int:
+        return self._n
+
+    @classmethod
+    def from_requests(cls, requests: list[dict], fields=ALL_FIELDS) -> "LaneChangeFeatures":
+        """
+        Gathers a feature block from decide_lane_change keyword arguments
+        (veh_id, current_lane, desired_lane, snapshot).
+
+        The values come from the column view of the requests' snapshot, so
+        apart from the per-request row and lane lookups the work is done with
+        one NumPy call per field (and one neighbour search per lane).
+
+        Args:
+            requests (list[dict]): The requests, usually sharing one snapshot.
+            fields: The fields to gather; the others are left None.
+        """
+        snapshot = requests[0]["snapshot"] if requests else None
+        if any(request["snapshot"] is not snapshot for request in requests):
+            # requests of several snapshots: one block per snapshot, in request order
+            return cls._concatenate(
+                [cls.from_requests([request], fields) for request in requests], fields, requests
+            )
+        wanted = set(fields)
+        n = len(requests)
+        arrays = {}
+        if n == 0 or not wanted:
+            arrays.update({name: np.zeros(0) for name in FLOAT_FIELDS if name in wanted})
+            arrays.update({name: np.zeros(0, dtype=np.int64) for name in INT_FIELDS if name in wanted})
+            arrays.update({name: np.zeros(0, dtype=bool) for name in BOOL_FIELDS if name in wanted})
+            return cls(requests, **arrays)
+
+        table = snapshot.table()
+        ego = np.fromiter((table.rows[request["veh_id"]] for request in requests), dtype=np.intp, count=n)
+        desired_lanes = [request["desired_lane"] for request in requests]
+        target = np.fromiter(
+            (table.lane_codes.get(lane_id, -1) for lane_id in desired_lanes), dtype=np.intp, count=n
+        )
+
+        if "v_E" in wanted:
+            arrays["v_E"] = table.speed[ego]
+        if "a_E" in wanted:
+            arrays["a_E"] = table.acceleration[ego]
+        if "max_speed" in wanted:
+            arrays["max_speed"] = table.max_speed[ego]
+        if wanted & {"current_index", "target_index"}:
+            numbers = {}
+            for request in requests:
+                for lane_id in (request["current_lane"], request["desired_lane"]):
+                    if lane_id not in numbers:
+                        numbers[lane_id] = snapshot.lane_number(lane_id)
+            if "current_index" in wanted:
+                arrays["current_index"] = np.fromiter(
+                    (numbers[request["current_lane"]] for request in requests), dtype=np.int64, count=n
+                )
+            if "target_index" in wanted:
+                arrays["target_index"] = np.fromiter(
+                    (numbers[lane_id] for lane_id in desired_lanes), dtype=np.int64, count=n
+                )
+        if "same_lane" in wanted:
+            arrays["same_lane"] = np.fromiter(
+                (request["desired_lane"] == request["current_lane"] for request in requests), dtype=bool, count=n
+            )
+        if "target_length" in wanted:
+            lengths = {lane_id: snapshot.lane_length(lane_id) for lane_id in set(desired_lanes)}
+            arrays["target_length"] = np.fromiter(
+                (lengths[lane_id] for lane_id in desired_lanes), dtype=np.float64, count=n
+            )
+
+        if wanted & {"has_last", "d_last", "v_last", "target_count"}:
+            # frontmost vehicle and number of vehicles of the target lane
+            known = target >= 0
+            count = np.where(known, (table.lane_end - table.lane_start)[target], 0)
+            last = np.where(count > 0, table.order[table.lane_end[target] - 1], -1)
+            arrays["target_count"] = count.astype(np.int64)
+            cls._neighbour(arrays, table, "last", last, ego, other_first=True)
+
+        if wanted & {"has_tf", "d_tf", "v_tf", "has_tb", "d_tb", "v_tb"}:
+            # the models call the vehicle behind "front" and the one ahead "back",
+            # by the sign of distance_between(other, ego)
+            front, back = table.closest(target, ego)
+            cls._neighbour(arrays, table, "tf", front, ego, other_first=False)
+            cls._neighbour(arrays, table, "tb", back, ego, other_first=True)
+
+        if wanted & {"has_cf", "v_cf"}:
+            current = np.fromiter(
+                (table.lane_codes.get(request["current_lane"], -1) for request in requests), dtype=np.intp, count=n
+            )
+            front, _ = table.closest(current, ego)
+            arrays["has_cf"] = front >= 0
+            arrays["v_cf"] = np.where(front >= 0, table.speed[front], 0.0)
+
+        if wanted & {"has_p", "d_p", "v_p"}:
+            cls._neighbour(arrays, table, "p", table.vehicle_ahead(ego), ego, other_first=True)
+
+        return cls(requests, **{name: values for name, values in arrays.items() if name in wanted})
+
+    @staticmethod
+    def _neighbour(arrays: dict, table, name: str, other: np.ndarray, ego: np.ndarray, other_first: bool):
+        """
+        has_<name>, v_<name> and d_<name> of a neighbour, 0 where there is none;
+        the distance is distance_between(other, ego) when other_first, else
+        distance_between(ego, other).
+        """
+        found = other >= 0
+        arrays[f"has_{name}"] = found
+        arrays[f"v_{name}"] = np.where(found, table.speed[other], 0.0)
+        distance = table.distance(other, ego) if other_first else table.distance(ego, other)
+        arrays[f"d_{name}"] = np.where(found, distance, 0.0)
+
+    @classmethod
+    def _concatenate(cls, blocks: list["LaneChangeFeatures"], fields, requests) -> "LaneChangeFeatures":
+        return cls(requests, **{name: np.concatenate([getattr(block, name) for block in blocks]) for name in fields})
@@ -1,5 +1,7 @@
-import traci
+import numpy as np
 from models.base_model import BaseDecisionModel
+from models.features import LaneChangeFeatures
+from models.neighborhood import NeighborhoodSnapshot
 import math
 
 # Desired speed in km/h
@@ -25,75 +27,47 @@ def adaptive_coefficients(v_E, traffic_density):
     E = 1
     return A, B, C, D, E
 
-# def distance_between(vehicle_1, vehicle_2): # Should not be necessary as we are only interested in the x-axis
-#     pos1 = traci.vehicle.getPosition(vehicle_1)
-#     pos2 = traci.vehicle.getPosition(vehicle_2)
-#     return math.sqrt((pos2[0] - pos1[0]) ** 2 + (pos2[1] - pos1[1]) ** 2)
-
-def distance_between(vehicle_1, vehicle_2):
-    pos1 = traci.vehicle.getPosition(vehicle_1)
-    pos2 = traci.vehicle.getPosition(vehicle_2)
-    return pos2[0] - pos1[0]
-
-def findclosest(vehicles, ego):
-    if vehicles:
-        closest_front = None
-        closest_back = None
-        min_front_distance = float('inf')
-        min_back_distance = float('-inf')
-        for veh in vehicles:
-            dis = distance_between(veh, ego)
-            # compare distances to ego if greater than 0 then it is infront of ego vehicle
-            if dis > 0 and dis < min_front_distance:
-                min_front_distance = dis
-                closest_front = veh
-            if dis < 0 and dis > min_back_distance:
-                min_back_distance = dis
-                closest_back = veh
-    else:
-        closest_front = None
-        closest_back = None
-    return closest_front,closest_back
-
 def dynamic_safe_gap(v_E, v_TR):
     return DEFAULT_G_TR_MIN + abs(v_E - v_TR) * 2  # Increase gap based on relative speed
 
 class LiuImproved(BaseDecisionModel):
-    def decide_lane_change(self, veh_id: str, current_lane: str, desired_lane: str) -> bool:
+    batch_fields = (
+        "v_E", "target_length", "d_tf", "d_p", "v_p", "d_last", "v_last", "target_count",
+        "has_tf", "has_p", "has_last",
+    )
+
+    def decide_lane_change(self, veh_id: str, current_lane: str, desired_lane: str, snapshot: NeighborhoodSnapshot) -> bool:
         v_set = kmh_2_ms(V_SET_KMH)
-        v_E = traci.vehicle.getSpeed(veh_id)
-        vehicle_type = traci.vehicle.getTypeID(veh_id) # dont think this is necessary
+        v_E = snapshot.speed(veh_id)
 
-        traffic_density = traci.lane.getLastStepVehicleNumber(desired_lane) / max(traci.lane.getLength(desired_lane), 1)
+        traffic_density = len(snapshot.lane_vehicles(desired_lane)) / max(snapshot.lane_length(desired_lane), 1)
 
         A, B, C, D, E = adaptive_coefficients(v_E, traffic_density)
 
         # vehicles in the target lane
-        target_lane_vehicles = traci.lane.getLastStepVehicleIDs(desired_lane)
+        target_lane_vehicles = snapshot.lane_vehicles(desired_lane)
         
         # identify the closest front and back vehicles in the target lane
-        closest_front_tl,closest_back_tl = findclosest(target_lane_vehicles, veh_id)
+        closest_front_tl,closest_back_tl = snapshot.closest(desired_lane, veh_id)
         if target_lane_vehicles and closest_front_tl:
-            G_tp = distance_between(veh_id, closest_front_tl)
+            G_tp = snapshot.distance_between(veh_id, closest_front_tl)
         else:
             G_tp = float('inf')
 
         # identify the following vehicle in the target lane 
         if target_lane_vehicles and closest_back_tl:
-            G_tr = abs(distance_between(closest_back_tl, veh_id))
-            v_TR = traci.vehicle.getSpeed(closest_back_tl)
+            G_tr = abs(snapshot.distance_between(closest_back_tl, veh_id))
+            v_TR = snapshot.speed(closest_back_tl)
         else:
             G_tr = float('inf')
             v_TR = 0.0
 
 
         # identify the preceding vehicle in the current lane 
-        current_lane_vehicles = traci.lane.getLastStepVehicleIDs(current_lane)
-    
-        if current_lane_vehicles.index('Ego') < (len(current_lane_vehicles)-1):
-            preceding_vehicle = current_lane_vehicles[current_lane_vehicles.index('Ego') + 1]
-            G_p = distance_between(preceding_vehicle, veh_id)
-            v_p = traci.vehicle.getSpeed(preceding_vehicle)
+        preceding_vehicle = snapshot.vehicle_ahead(veh_id)
+        if preceding_vehicle:
+            G_p = snapshot.distance_between(preceding_vehicle, veh_id)
+            v_p = snapshot.speed(preceding_vehicle)
         else:
             G_p = float('inf')
             v_p = 1000
@@ -109,8 +83,8 @@ class LiuImproved(BaseDecisionModel):
         # Safety function
         if target_lane_vehicles:
             trailing_tr = target_lane_vehicles[-1] # Again wrong indexing
-            G_tr = distance_between(trailing_tr, veh_id)
-            v_TR = traci.vehicle.getSpeed(trailing_tr)
+            G_tr = snapshot.distance_between(trailing_tr, veh_id)
+            v_TR = snapshot.speed(trailing_tr)
         else:
             G_tr = float('inf')
             v_TR = 0
@@ -132,3 +106,40 @@ class LiuImproved(BaseDecisionModel):
         should_change_lane = f_safety > 0 and (f_ben - 0.5 * f_tol) > 0
 
         return should_change_lane
+
+    def decide_batch(self, features: LaneChangeFeatures) -> np.ndarray:
+        """
+        Vectorized decide_lane_change: the same criteria computed over a feature block.
+        """
+        v_set = kmh_2_ms(V_SET_KMH)
+        f = features
+        v_E = f.v_E
+        traffic_density = f.target_count / np.maximum(f.target_length, 1)
+        A, B, C, D, E = adaptive_coefficients(v_E, traffic_density)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            G_tp = np.where(f.has_tf, f.d_tf, np.inf)
+            G_p = np.where(f.has_p, f.d_p, np.inf)
+            v_p = np.where(f.has_p, f.v_p, 1000.0)
+
+            v_ben = np.minimum(v_set - v_p, 0)
+            f_ben = A * v_ben + B * (G_tp - G_p)
+
+            t_h = np.where(v_E > 0, G_p / v_E, np.inf)
+            f_tol = C * (G_p - v_E * t_h)
+
+            # safety uses the frontmost vehicle of the target lane, as decide_lane_change does
+            G_tr = np.where(f.has_last, f.d_last, np.inf)
+            v_TR = np.where(f.has_last, f.v_last, 0.0)
+            dynamic_G_TR_MIN = dynamic_safe_gap(v_E, v_TR)
+            f_safety = D * np.maximum(G_tr - dynamic_G_TR_MIN, 0) + E * (v_E - v_TR)
+
+            speed_advantage = v_p - v_E
+            should_change_lane = (f_safety > 0) & ((f_ben - 0.5 * f_tol) > 0)
+        should_change_lane |= speed_advantage > kmh_2_ms(SPEED_ADVANTAGE_THRESHOLD)
+        should_change_lane &= ~(traffic_density > TRAFFIC_DENSITY_THRESHOLD)
+        self.last_metrics = {
+            "traffic_density": traffic_density, "f_ben": f_ben, "f_tol": f_tol, "f_safety": f_safety,
+            "speed_advantage": speed_advantage,
+        }
+        return should_change_lane
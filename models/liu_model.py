@@ -1,5 +1,8 @@
-import traci
+import numpy as np
+
 from models.base_model import BaseDecisionModel
+from models.features import LaneChangeFeatures
+from models.neighborhood import NeighborhoodSnapshot
 
 # coefficient values (configurable)
 A = 1
@@ -26,33 +29,10 @@ def F_saf(g_tr, G_tr_MIN, v_E, v_tr):
         return D * (g_tr - G_tr_MIN) + E * (v_E - v_tr)
     return -float("inf")
 
-def distance_between(vehicle_1, vehicle_2):
-    pos1 = traci.vehicle.getPosition(vehicle_1)
-    pos2 = traci.vehicle.getPosition(vehicle_2)
-    return pos2[0] - pos1[0]
-
-def findclosest(vehicles, ego):
-    if vehicles:
-        closest_front = None
-        closest_back = None
-        min_front_distance = float('inf')
-        min_back_distance = float('-inf')
-        for veh in vehicles:
-            dis = distance_between(veh, ego)
-            # compare distances to ego if greater than 0 then it is infront of ego vehicle
-            if dis > 0 and dis < min_front_distance:
-                min_front_distance = dis
-                closest_front = veh
-            if dis < 0 and dis > min_back_distance:
-                min_back_distance = dis
-                closest_back = veh
-    else:
-        closest_front = None
-        closest_back = None
-    return closest_front,closest_back
-
 class Liu(BaseDecisionModel):
-    def decide_lane_change(self, veh_id: str, current_lane: str, desired_lane: str) -> bool:
+    batch_fields = ("v_E", "d_tf", "d_tb", "v_tb", "d_p", "v_p", "has_tf", "has_tb", "has_p")
+
+    def decide_lane_change(self, veh_id: str, current_lane: str, desired_lane: str, snapshot: NeighborhoodSnapshot) -> bool:
         """
         Determines whether the vehicle should change lanes based on Liu et al. model.
 
@@ -60,6 +40,7 @@ class Liu(BaseDecisionModel):
             veh_id (str): The ID of the vehicle.
             current_lane (str): The current lane ID of the vehicle.
             desired_lane (str): The target lane ID for the vehicle.
+            snapshot (NeighborhoodSnapshot): State of the surrounding vehicles at this step.
 
         Returns:
             bool: True if the vehicle decides to change lanes, False otherwise.
@@ -68,30 +49,28 @@ class Liu(BaseDecisionModel):
         v_set = kmh_2_ms(V_SET_KMH)  # Desired speed in m/s
 
         # vehicles in the target lane
-        target_lane_vehicles = traci.lane.getLastStepVehicleIDs(desired_lane)
+        target_lane_vehicles = snapshot.lane_vehicles(desired_lane)
         
         # identify the closest front and back vehicles in the target lane
-        closest_front_tl,closest_back_tl = findclosest(target_lane_vehicles, veh_id)
+        closest_front_tl,closest_back_tl = snapshot.closest(desired_lane, veh_id)
 
         if target_lane_vehicles and closest_front_tl:
-            G_tp = distance_between(veh_id, closest_front_tl)
+            G_tp = snapshot.distance_between(veh_id, closest_front_tl)
         else:
             G_tp = float('inf')
 
         # identify the following vehicle in the target lane 
         if target_lane_vehicles and closest_back_tl:
-            G_tr = abs(distance_between(closest_back_tl, veh_id))
-            v_TR = traci.vehicle.getSpeed(closest_back_tl)
+            G_tr = abs(snapshot.distance_between(closest_back_tl, veh_id))
+            v_TR = snapshot.speed(closest_back_tl)
         else:
             G_tr = float('inf')
             v_TR = 0.0
         ### Identify the trailing vehicle in the current lane ###
-        current_lane_vehicles = traci.lane.getLastStepVehicleIDs(current_lane)
-    
-        if current_lane_vehicles.index('Ego') < (len(current_lane_vehicles)-1):
-            preceding_vehicle = current_lane_vehicles[current_lane_vehicles.index('Ego') + 1]
-            G_p = distance_between(preceding_vehicle, veh_id)
-            v_p = traci.vehicle.getSpeed(preceding_vehicle)
+        preceding_vehicle = snapshot.vehicle_ahead(veh_id)
+        if preceding_vehicle:
+            G_p = snapshot.distance_between(preceding_vehicle, veh_id)
+            v_p = snapshot.speed(preceding_vehicle)
         else:
             G_p = float('inf')
             v_p = 1000
@@ -101,17 +80,41 @@ class Liu(BaseDecisionModel):
         f_ben = F_ben(v_ben, G_tp, G_p)
 
         # tolerance metrics
-        v_E = traci.vehicle.getSpeed(veh_id)
+        v_E = snapshot.speed(veh_id)
         t_h = G_p / v_E if v_E > 0 else G_p / kmh_2_ms(1) # can not be else: infinity
         f_tol = F_tol(G_p, v_E, t_h)
 
         # safety metric
         f_safety = F_saf(G_tr, G_tr_MIN, v_E, v_TR)
 
-        # print all metrics in one row
         # decision based on Liu et al. criteria
         should_change_lane = f_safety > 0 and (f_ben - THETA * f_tol) > 0
 
-        print(f"v_ben: {v_ben:.2f}, f_ben: {f_ben:.2f}, f_tol: {f_tol:.2f}, f_safety: {f_safety:.2f}, v_E: {v_E:.2f}, G_p: {G_p:.2f}, G_tp: {G_tp:.2f}, G_tr: {G_tr:.2f}, v_TR: {v_TR:.2f}, v_p: {v_p:.2f}, t_h: {t_h:.2f}, should_change_lane: {should_change_lane}")
-
         return should_change_lane
+
+    def decide_batch(self, features: LaneChangeFeatures) -> np.ndarray:
+        """
+        Vectorized decide_lane_change: the same metrics computed over a feature block.
+        """
+        v_set = kmh_2_ms(V_SET_KMH)
+        f = features
+        with np.errstate(divide='ignore', invalid='ignore'):
+            G_tp = np.where(f.has_tf, f.d_tf, np.inf)
+            G_tr = np.where(f.has_tb, np.abs(f.d_tb), np.inf)
+            v_TR = np.where(f.has_tb, f.v_tb, 0.0)
+            G_p = np.where(f.has_p, f.d_p, np.inf)
+            v_p = np.where(f.has_p, f.v_p, 1000.0)
+
+            v_ben = np.minimum(v_set - v_p, 0)
+            f_ben = F_ben(v_ben, G_tp, G_p)
+
+            v_E = f.v_E
+            t_h = np.where(v_E > 0, G_p / v_E, G_p / kmh_2_ms(1))
+            f_tol = F_tol(G_p, v_E, t_h)
+
+            f_safety = np.where(G_tr >= G_tr_MIN, D * (G_tr - G_tr_MIN) + E * (v_E - v_TR), -np.inf)
+            # the metrics the scalar path used to print, for the decision trace
+            self.last_metrics = {
+                "v_ben": v_ben, "f_ben": f_ben, "f_tol": f_tol, "f_safety": f_safety, "t_h": t_h,
+            }
+            return (f_safety > 0) & ((f_ben - THETA * f_tol) > 0)
@@ -1,43 +1,35 @@
 import numpy as np
-import joblib
-import traci
+from models.artifacts import registry
 from models.base_model import BaseDecisionModel
+from models.features import LaneChangeFeatures
+from models.neighborhood import NeighborhoodSnapshot
+from models.svm_inference import RBFInferenceEngine
 import os
-import pandas as pd
-
-def m_per_sec_2_f_per_sec(speed: float) -> float:
-    return speed / 3.28084 # Go from m/s to ft/s
-
-
-
-def distance_between(vehicle_1, vehicle_2):
-    pos1 = traci.vehicle.getPosition(vehicle_1)
-    pos2 = traci.vehicle.getPosition(vehicle_2)
-    return (pos2[0] - pos1[0])
-
-def findclosest(vehicles, ego):
-    if vehicles:
-        closest_front = None
-        closest_back = None
-        min_front_distance = float('inf')
-        min_back_distance = float('-inf')
-        for veh in vehicles:
-            dis = distance_between(veh, ego)
-            # compare distances to ego if greater than 0 then it is infront of ego vehicle
-            if dis > 0 and dis < min_front_distance:
-                min_front_distance = dis
-                closest_front = veh
-            if dis < 0 and dis > min_back_distance:
-                min_back_distance = dis
-                closest_back = veh
-    else:
-        closest_front = None
-        closest_back = None
-    return closest_front,closest_back
+
+# Trained artifacts written by ML/train.py
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(BASE_PATH, 'ML', 'svm_model.pkl')
+SCALER_PATH = os.path.join(BASE_PATH, 'ML', 'scaler.pkl')
 
 
 class ML(BaseDecisionModel):
-    def decide_lane_change(self, veh_id: str, current_lane: str, desired_lane: str) -> bool:
+    batch_fields = ("v_E", "a_E", "d_tf", "v_tf", "d_tb", "v_tb", "d_p", "v_p", "has_tf", "has_tb", "has_p")
+    # one SVM evaluation per block pays off from a few rows on
+    batch_min_requests = 4
+
+    def __init__(self):
+        # built from the registry artifacts on first use
+        self._engine = None
+
+    def _get_engine(self) -> RBFInferenceEngine:
+        # Load the saved model and scaler (cached by the registry, loaded once per process)
+        model = registry.get(MODEL_PATH)
+        scaler = registry.get(SCALER_PATH)
+        if self._engine is None or not self._engine.built_from(model, scaler):
+            self._engine = RBFInferenceEngine(model, scaler)
+        return self._engine
+
+    def decide_lane_change(self, veh_id: str, current_lane: str, desired_lane: str, snapshot: NeighborhoodSnapshot) -> bool:
         """
         Determines whether the vehicle should change lanes based on Liu et al. model.
 
@@ -45,6 +37,7 @@ class ML(BaseDecisionModel):
             veh_id (str): The ID of the vehicle.
             current_lane (str): The current lane ID of the vehicle.
             desired_lane (str): The target lane ID for the vehicle.
+            snapshot (NeighborhoodSnapshot): State of the surrounding vehicles at this step.
 
         Returns:
             bool: True if the vehicle decides to change lanes, False otherwise.
@@ -52,75 +45,68 @@ class ML(BaseDecisionModel):
 
         # Vehicles in the target lane
         # This will give us a list of all the vehicles in the target lane in order of their position
-        target_lane_vehicles = traci.lane.getLastStepVehicleIDs(desired_lane)
-        print("target_lane_vechicles:",target_lane_vehicles)
+        target_lane_vehicles = snapshot.lane_vehicles(desired_lane)
         # identify the closest leading vehicle in the target lane
-        closest_front_tl,closest_back_tl = findclosest(target_lane_vehicles, veh_id)
-        print("closest_front_tl:",closest_front_tl, "closest_back_tl:",closest_back_tl)
+        closest_front_tl,closest_back_tl = snapshot.closest(desired_lane, veh_id)
         if target_lane_vehicles and closest_front_tl:
-            v_tp = traci.vehicle.getSpeed(closest_front_tl)
-            G_tp = distance_between(veh_id, closest_front_tl)
+            v_tp = snapshot.speed(closest_front_tl)
+            G_tp = snapshot.distance_between(veh_id, closest_front_tl)
         else:
             v_tp = 1000     # values can not be infinite so we set it to a large number (for the ml model)
             G_tp = 1000
 
         # identify the following vehicle in the target lane 
         if target_lane_vehicles and closest_back_tl:
-            G_tr = abs(distance_between(closest_back_tl, veh_id))
-            v_tr = traci.vehicle.getSpeed(closest_back_tl)
+            G_tr = abs(snapshot.distance_between(closest_back_tl, veh_id))
+            v_tr = snapshot.speed(closest_back_tl)
         else:
             G_tr = 1000
             v_tr = 0.0
 
         # Current lane
         # identify the trailing vehicle in the current lane 
-        current_lane_vehicles = traci.lane.getLastStepVehicleIDs(current_lane)
-        print("current_lane_vechicles:",current_lane_vehicles)
       
-        # find the index of the ego vehicle and add 1 to get the index of the preceding vehicle (car infront)
-        if current_lane_vehicles.index('Ego') < (len(current_lane_vehicles)-1):
-            preceding_vehicle = current_lane_vehicles[current_lane_vehicles.index('Ego') + 1]
-            G_p = distance_between(preceding_vehicle, veh_id)
-            v_p = traci.vehicle.getSpeed(preceding_vehicle)
+        # the vehicle after the ego vehicle in the lane order is the preceding vehicle (car infront)
+        preceding_vehicle = snapshot.vehicle_ahead(veh_id)
+        if preceding_vehicle:
+            G_p = snapshot.distance_between(preceding_vehicle, veh_id)
+            v_p = snapshot.speed(preceding_vehicle)
         else:
             G_p = 1000
             v_p = 1000
 
       
         # Ego vehicle speed
-        v_E = traci.vehicle.getSpeed(veh_id)
+        v_E = snapshot.speed(veh_id)
         # Get acceleration
-        a_E = traci.vehicle.getAcceleration(veh_id)
+        a_E = snapshot.acceleration(veh_id)
         # Get the delta of speed between the ego vehicle and the leading vehicle
         delta_v_tp = v_E - v_tp
         delta_v_tr = v_E - v_tr
 
         ### Decision based model ###
 
-        # Load the saved model and scaler
-        base_path = os.path.dirname(os.path.abspath(__file__))  # Path of the current script
-        model_path = os.path.join(base_path, 'ML', 'svm_model.pkl')
-        scaler_path = os.path.join(base_path, 'ML', 'scaler.pkl')
-        model = joblib.load(model_path)
-        scaler = joblib.load(scaler_path)
-       
+        # the engine applies the m to ft conversion and the scaler itself
         new_data = np.array([v_E,a_E,G_p,G_tr,G_tp,v_p,v_tr,v_tp,delta_v_tr,delta_v_tp])
-        # convert the speeds and distances from m to ft
-        for i in range(len(new_data)):
-            new_data[i] = m_per_sec_2_f_per_sec(new_data[i])
-        
-        ## Preprocess the data 
-
-        # define the column names as used during training
-        feature_names = ['v_E', 'a_E', 'P', 'G_TR', 'G_TP', 'v_P', 'v_TR', 'v_TP', 'delta_v_TR', 'delta_v_TP']
-  
-        # convert to a pandas dataframe format
-        new_data = pd.DataFrame([new_data], columns=feature_names)
-
-        new_data_scaled = scaler.transform(new_data)
-        # make predictions
-        prediction = model.predict(new_data_scaled)
-
-        print("Predictions:", prediction)
+        prediction = self._get_engine().predict(new_data)
+
         should_change_lane = prediction[0]
         return should_change_lane
+
+    def decide_batch(self, features: LaneChangeFeatures) -> np.ndarray:
+        """
+        Vectorized decide_lane_change: one SVM evaluation for the whole feature block.
+        """
+        f = features
+        # same placeholders as decide_lane_change for missing vehicles
+        v_tp = np.where(f.has_tf, f.v_tf, 1000.0)
+        G_tp = np.where(f.has_tf, f.d_tf, 1000.0)
+        G_tr = np.where(f.has_tb, np.abs(f.d_tb), 1000.0)
+        v_tr = np.where(f.has_tb, f.v_tb, 0.0)
+        G_p = np.where(f.has_p, f.d_p, 1000.0)
+        v_p = np.where(f.has_p, f.v_p, 1000.0)
+
+        new_data = np.column_stack(
+            [f.v_E, f.a_E, G_p, G_tr, G_tp, v_p, v_tr, v_tp, f.v_E - v_tr, f.v_E - v_tp]
+        )
+        return self._get_engine().predict(new_data).astype(bool)
@@ -0,0 +1,310 @@
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+from typing import NamedTuple
+
+import numpy as np
+import traci
+import traci.constants as tc
+
+from models.topology import LaneTopology
+
+# Range (meters) of the context subscription around the shape of each edge with
+# a controlled vehicle. It covers the lanes of the widest edges in the
+# scenarios, so the vehicles seen in a lane match
+# traci.lane.getLastStepVehicleIDs for the current and target lanes.
+EDGE_CONTEXT_RANGE = 20.0
+
+SUBSCRIBED_VARIABLES = (
+    tc.VAR_POSITION,
+    tc.VAR_SPEED,
+    tc.VAR_ACCELERATION,
+    tc.VAR_LANE_ID,
+    tc.VAR_LANE_INDEX,
+    tc.VAR_LANEPOSITION,
+    tc.VAR_MAXSPEED,
+)
+
+
+class SnapshotTable(NamedTuple):
+    """Column view of a snapshot, for the vectorized feature gathering."""
+
+    rows: dict[str, int]  # vehicle -> row
+    lane_codes: dict[str, int]  # lane -> code
+    speed: np.ndarray
+    acceleration: np.ndarray
+    max_speed: np.ndarray
+    lane_position: np.ndarray
+    x: np.ndarray
+    lane: np.ndarray  # lane code of each row
+    edge: np.ndarray  # edge code of each row
+    order: np.ndarray  # rows by lane code, then lane position (the lane index order)
+    rank: np.ndarray  # place of each row in order
+    lane_start: np.ndarray  # first place in order of each lane code
+    lane_end: np.ndarray  # one past the last place in order of each lane code
+    keys: np.ndarray  # lane code + 1j * lane position of the rows in order, ascending
+
+    def distance(self, row_1: np.ndarray, row_2: np.ndarray) -> np.ndarray:
+        """distance_between for arrays of rows."""
+        return np.where(
+            self.edge[row_1] == self.edge[row_2],
+            self.lane_position[row_2] - self.lane_position[row_1],
+            self.x[row_2] - self.x[row_1],
+        )
+
+    def closest(self, lanes: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        NeighborhoodSnapshot.closest for arrays of lane codes (-1 for lanes
+        without vehicles) and rows.
+
+        Returns:
+            tuple: (behind, ahead) rows, -1 where there is no such vehicle.
+        """
+        # complex numbers compare by real part first, so one search covers every lane
+        queries = lanes + 1j * self.lane_position[rows]
+        known = lanes >= 0
+        i = self.keys.searchsorted(queries, "left")
+        found = known & (i > self.lane_start[lanes])
+        # the first of several vehicles at the same position, as closest picks it
+        first = self.keys.searchsorted(self.keys[i - 1], "left")
+        behind = np.where(found, self.order[first], -1)
+        j = self.keys.searchsorted(queries, "right")
+        found = known & (j < self.lane_end[lanes])
+        ahead = np.where(found, self.order[np.minimum(j, len(self.order) - 1)], -1)
+        return behind, ahead
+
+    def vehicle_ahead(self, rows: np.ndarray) -> np.ndarray:
+        """NeighborhoodSnapshot.vehicle_ahead for an array of rows, -1 for none."""
+        place = self.rank[rows] + 1
+        found = place < self.lane_end[self.lane[rows]]
+        return np.where(found, self.order[np.minimum(place, len(self.order) - 1)], -1)
+
+
+def _edge_of(lane_id: str, topology: LaneTopology | None) -> str:
+    if topology is not None and lane_id in topology:
+        return topology[lane_id].edge
+    return lane_id.rsplit("_", 1)[0]
+
+
+class NeighborhoodSnapshot:
+    """
+    State of the vehicles around the controlled vehicles for a single simulation step.
+
+    The snapshot is filled from TraCI context subscriptions on the edges of the
+    controlled vehicles, so the values arrive together with the simulation step
+    and reading them costs no extra socket round-trips. Each edge is subscribed
+    once, however many controlled vehicles drive on it, so the per-step data
+    grows with the number of vehicles on those edges, not with controlled
+    vehicles times neighbours. The snapshot is built once per step and shared
+    by all decision models and controlled vehicles.
+    """
+
+    def __init__(
+        self,
+        vehicles: dict[str, dict[int, object]],
+        lane_lengths: dict[str, float] | None = None,
+        topology: LaneTopology | None = None,
+    ):
+        self._vehicles = vehicles
+        self.topology = topology
+        # lane -> (vehicles, lane positions), both ordered from back to front
+        self._lanes: dict[str, tuple[tuple[str, ...], list[float]]] | None = None
+        self._table: SnapshotTable | None = None
+        # lanes neither given here nor in the topology are looked up through TraCI on first use
+        self._lane_lengths = dict(lane_lengths or {})
+
+    @classmethod
+    def from_subscriptions(
+        cls,
+        veh_ids,
+        radius: float = EDGE_CONTEXT_RANGE,
+        topology: LaneTopology | None = None,
+    ) -> "NeighborhoodSnapshot":
+        """
+        Builds the snapshot for the controlled vehicles, subscribing to the
+        edges they drive on the first time one of them gets there.
+
+        Edges stay subscribed when the vehicles leave them, so the snapshot may
+        hold vehicles of edges without controlled vehicles; the per-lane queries
+        only look at the lanes they are asked about.
+
+        Args:
+            veh_ids: The IDs of the controlled vehicles.
+            radius (float): Range of the edge context subscriptions in meters.
+            topology (LaneTopology): Lane table of the network, for lane lengths
+                and indices without TraCI calls.
+
+        Returns:
+            NeighborhoodSnapshot: The vehicles on the subscribed edges at this step.
+        """
+        all_results = traci.edge.getAllContextSubscriptionResults()
+        subscribed = set(all_results)
+        vehicles = {}
+        for results in all_results.values():
+            vehicles.update(results)
+        for veh_id in veh_ids:
+            values = vehicles.get(veh_id)
+            # a vehicle in the range of a neighbouring edge still needs its own edge
+            if values is None:
+                edge = traci.vehicle.getRoadID(veh_id)
+            else:
+                edge = _edge_of(values[tc.VAR_LANE_ID], topology)
+            if edge not in subscribed:
+                traci.edge.subscribeContext(
+                    edge, tc.CMD_GET_VEHICLE_VARIABLE, radius, SUBSCRIBED_VARIABLES
+                )
+                subscribed.add(edge)
+                vehicles.update(traci.edge.getContextSubscriptionResults(edge))
+        return cls(vehicles, topology=topology)
+
+    def __contains__(self, veh_id: str) -> bool:
+        return veh_id in self._vehicles
+
+    def __iter__(self):
+        return iter(self._vehicles)
+
+    def __len__(self) -> int:
+        return len(self._vehicles)
+
+    def position(self, veh_id: str) -> tuple[float, float]:
+        return self._vehicles[veh_id][tc.VAR_POSITION]
+
+    def speed(self, veh_id: str) -> float:
+        return self._vehicles[veh_id][tc.VAR_SPEED]
+
+    def acceleration(self, veh_id: str) -> float:
+        return self._vehicles[veh_id][tc.VAR_ACCELERATION]
+
+    def max_speed(self, veh_id: str) -> float:
+        return self._vehicles[veh_id][tc.VAR_MAXSPEED]
+
+    def lane_id(self, veh_id: str) -> str:
+        return self._vehicles[veh_id][tc.VAR_LANE_ID]
+
+    def lane_index(self, veh_id: str) -> int:
+        return self._vehicles[veh_id][tc.VAR_LANE_INDEX]
+
+    def lane_position(self, veh_id: str) -> float:
+        return self._vehicles[veh_id][tc.VAR_LANEPOSITION]
+
+    def _lane_index(self) -> dict[str, tuple[tuple[str, ...], list[float]]]:
+        # built on first use and shared by every model and vehicle of the step
+        if self._lanes is None:
+            lanes: dict[str, list[str]] = {}
+            for veh_id, values in self._vehicles.items():
+                lanes.setdefault(values[tc.VAR_LANE_ID], []).append(veh_id)
+            self._lanes = {}
+            for lane, vehicles in lanes.items():
+                vehicles.sort(key=self.lane_position)
+                self._lanes[lane] = (tuple(vehicles), [self.lane_position(veh_id) for veh_id in vehicles])
+        return self._lanes
+
+    def table(self) -> SnapshotTable:
+        """The snapshot as columns, built on first use."""
+        if self._table is None:
+            n = len(self._vehicles)
+            values = self._vehicles.values()
+
+            def column(*keys):
+                items = values
+                for key in keys:
+                    items = map(itemgetter(key), items)
+                return np.fromiter(items, dtype=np.float64, count=n)
+
+            lane_ids = list(map(itemgetter(tc.VAR_LANE_ID), values))
+            lane_codes = {lane_id: code for code, lane_id in enumerate(dict.fromkeys(lane_ids))}
+            lane = np.fromiter(map(lane_codes.__getitem__, lane_ids), dtype=np.intp, count=n)
+            lane_position = column(tc.VAR_LANEPOSITION)
+            edge_codes: dict[str, int] = {}
+            lane_edge = np.array(
+                [edge_codes.setdefault(_edge_of(lane_id, self.topology), len(edge_codes)) for lane_id in lane_codes],
+                dtype=np.intp,
+            )
+            # stable, so vehicles level with each other keep the order of the lane index
+            order = np.lexsort((lane_position, lane))
+            rank = np.empty(n, dtype=np.intp)
+            rank[order] = np.arange(n)
+            counts = np.bincount(lane, minlength=len(lane_codes))
+            lane_end = np.cumsum(counts)
+            self._table = SnapshotTable(
+                rows=dict(zip(self._vehicles, range(n))),
+                lane_codes=lane_codes,
+                speed=column(tc.VAR_SPEED),
+                acceleration=column(tc.VAR_ACCELERATION),
+                max_speed=column(tc.VAR_MAXSPEED),
+                lane_position=lane_position,
+                x=column(tc.VAR_POSITION, 0),
+                lane=lane,
+                edge=lane_edge[lane] if n else lane,
+                order=order,
+                rank=rank,
+                lane_start=lane_end - counts,
+                lane_end=lane_end,
+                keys=lane[order] + 1j * lane_position[order],
+            )
+        return self._table
+
+    def lane_vehicles(self, lane_id: str) -> tuple[str, ...]:
+        """
+        Returns the vehicles on a lane ordered from back to front,
+        the same order as traci.lane.getLastStepVehicleIDs.
+        """
+        return self._lane_index().get(lane_id, ((), []))[0]
+
+    def closest(self, lane_id: str, veh_id: str) -> tuple[str | None, str | None]:
+        """
+        The nearest vehicles on a lane behind and ahead of a vehicle's lane
+        position, found by bisection; vehicles level with it are neither.
+
+        Returns:
+            tuple: (behind, ahead), None where there is no such vehicle. This is
+                the (closest_front, closest_back) pair of the models, which name
+                them by the sign of distance_between(other, ego).
+        """
+        vehicles, positions = self._lane_index().get(lane_id, ((), []))
+        position = self.lane_position(veh_id)
+        behind = ahead = None
+        i = bisect_left(positions, position)
+        if i > 0:
+            # the first of several vehicles at the same position, as a linear scan finds it
+            behind = vehicles[bisect_left(positions, positions[i - 1])]
+        j = bisect_right(positions, position)
+        if j < len(vehicles):
+            ahead = vehicles[j]
+        return behind, ahead
+
+    def vehicle_ahead(self, veh_id: str) -> str | None:
+        """The next vehicle in the order of the vehicle's own lane, None for the first one."""
+        vehicles, positions = self._lane_index()[self.lane_id(veh_id)]
+        rank = bisect_left(positions, self.lane_position(veh_id))
+        # past the vehicles level with it that come first in the order
+        while vehicles[rank] != veh_id:
+            rank += 1
+        return vehicles[rank + 1] if rank < len(vehicles) - 1 else None
+
+    def lane_length(self, lane_id: str) -> float:
+        if self.topology is not None and lane_id in self.topology:
+            return self.topology[lane_id].length
+        if lane_id not in self._lane_lengths:
+            self._lane_lengths[lane_id] = traci.lane.getLength(lane_id)
+        return self._lane_lengths[lane_id]
+
+    def lane_number(self, lane_id: str) -> int:
+        """Index of a lane on its edge."""
+        if self.topology is not None and lane_id in self.topology:
+            return self.topology[lane_id].index
+        return int(lane_id.rsplit("_", 1)[1])
+
+    def distance_between(self, vehicle_1: str, vehicle_2: str) -> float:
+        """
+        Distance from vehicle_1 to vehicle_2 along the road, positive when
+        vehicle_2 is ahead. Vehicles on lanes of the same edge are compared by
+        lane position, like the lane index orders them, so curved edges give the
+        same gaps as straight ones; vehicles on different edges by x-coordinate.
+        """
+        values_1 = self._vehicles[vehicle_1]
+        values_2 = self._vehicles[vehicle_2]
+        lane_1 = values_1[tc.VAR_LANE_ID]
+        lane_2 = values_2[tc.VAR_LANE_ID]
+        if lane_1 == lane_2 or _edge_of(lane_1, self.topology) == _edge_of(lane_2, self.topology):
+            return values_2[tc.VAR_LANEPOSITION] - values_1[tc.VAR_LANEPOSITION]
+        return values_2[tc.VAR_POSITION][0] - values_1[tc.VAR_POSITION][0]
@@ -1,6 +1,9 @@
+import numpy as np
 import traci
 
 from models.base_model import BaseDecisionModel
+from models.features import LaneChangeFeatures
+from models.neighborhood import NeighborhoodSnapshot
 
 # SL2015 model parameters
 STRATEGIC_PARAM = 1.0
@@ -27,34 +30,12 @@ def kmh_2_ms(speed: float) -> float:
     return speed / 3.6
 
 
-def distance_between(vehicle_1, vehicle_2):
-    pos1 = traci.vehicle.getPosition(vehicle_1)
-    pos2 = traci.vehicle.getPosition(vehicle_2)
-    return pos2[0] - pos1[0]
-
-
-def findclosest(vehicles, ego):
-    if vehicles:
-        closest_front = None
-        closest_back = None
-        min_front_distance = float("inf")
-        min_back_distance = float("-inf")
-
-        for veh in vehicles:
-            dis = distance_between(veh, ego)
-            if dis > 0 and dis < min_front_distance:
-                min_front_distance = dis
-                closest_front = veh
-            if dis < 0 and dis > min_back_distance:
-                min_back_distance = dis
-                closest_back = veh
-    else:
-        closest_front = None
-        closest_back = None
-    return closest_front, closest_back
-
-
 class SL2015(BaseDecisionModel):
+    batch_fields = (
+        "v_E", "max_speed", "d_tf", "v_tf", "d_tb", "v_tb", "v_cf", "current_index", "target_index",
+        "has_tf", "has_tb", "has_cf", "same_lane",
+    )
+
     def __init__(self):
         super().__init__()
         self.lc_params = LC_PARAMS
@@ -71,28 +52,31 @@ class SL2015(BaseDecisionModel):
         self.set_vehicle_parameters(veh_id)
 
     def decide_lane_change(
-        self, veh_id: str, current_lane: str, desired_lane: str
+        self,
+        veh_id: str,
+        current_lane: str,
+        desired_lane: str,
+        snapshot: NeighborhoodSnapshot,
     ) -> bool:
         # Get vehicle states
-        ego_speed = traci.vehicle.getSpeed(veh_id)
-        ego_max_speed = traci.vehicle.getMaxSpeed(veh_id)
+        ego_speed = snapshot.speed(veh_id)
+        ego_max_speed = snapshot.max_speed(veh_id)
 
         # Get surrounding vehicles
-        target_vehicles = traci.lane.getLastStepVehicleIDs(desired_lane)
-        current_vehicles = traci.lane.getLastStepVehicleIDs(current_lane)
-
-        leader_target, follower_target = findclosest(target_vehicles, veh_id)
-        leader_current, follower_current = findclosest(current_vehicles, veh_id)
+        leader_target, follower_target = snapshot.closest(desired_lane, veh_id)
+        leader_current, follower_current = snapshot.closest(current_lane, veh_id)
 
         # Calculate strategic incentive
         strategic = self._calculate_strategic(current_lane, desired_lane)
 
         # Calculate safety criterion
-        is_safe = self._check_safety(veh_id, ego_speed, leader_target, follower_target)
+        is_safe = self._check_safety(
+            snapshot, veh_id, ego_speed, leader_target, follower_target
+        )
 
         # Calculate speed gain incentive
         speed_gain = self._calculate_speed_gain(
-            ego_speed, ego_max_speed, leader_current, leader_target
+            snapshot, ego_speed, ego_max_speed, leader_current, leader_target
         )
 
         # Calculate keep right incentive
@@ -107,6 +91,40 @@ class SL2015(BaseDecisionModel):
 
         return is_safe and total_incentive > 0
 
+    def decide_batch(self, features: LaneChangeFeatures) -> np.ndarray:
+        """
+        Vectorized decide_lane_change: the same incentives and safety checks over a feature block.
+        """
+        f = features
+        to_right = f.target_index < f.current_index
+        strategic = np.where(f.same_lane, 0.0, np.where(to_right, 1.0, -1.0))
+
+        # safety: front gap to the target leader, rear gap and approach speed of the target follower
+        gap_rear = np.abs(f.d_tb)
+        required_gap = REACTION_TIME * (f.v_tb - f.v_E)
+        unsafe_front = f.has_tf & (f.d_tf < MIN_SAFE_GAP)
+        unsafe_rear = f.has_tb & (
+            (gap_rear < MIN_SAFE_GAP) | ((f.v_tb > f.v_E) & (gap_rear < required_gap))
+        )
+        is_safe = ~(unsafe_front | unsafe_rear)
+
+        current_achievable = np.where(f.has_cf, np.minimum(f.max_speed, f.v_cf), f.max_speed)
+        target_achievable = np.where(f.has_tf, np.minimum(f.max_speed, f.v_tf), f.max_speed)
+        speed_gain = target_achievable - current_achievable
+
+        keep_right = np.where(to_right, 1.0, -1.0)
+
+        total_incentive = (
+            STRATEGIC_PARAM * strategic
+            + SPEEDGAIN_PARAM * speed_gain
+            + KEEPRIGHT_PARAM * keep_right
+        )
+        self.last_metrics = {
+            "strategic": strategic, "speed_gain": speed_gain, "keep_right": keep_right,
+            "total_incentive": total_incentive, "is_safe": is_safe,
+        }
+        return is_safe & (total_incentive > 0)
+
     def _calculate_strategic(self, current_lane: str, desired_lane: str) -> float:
         if desired_lane == current_lane:
             return 0.0
@@ -117,17 +135,22 @@ class SL2015(BaseDecisionModel):
         )
 
     def _check_safety(
-        self, ego_id: str, ego_speed: float, leader: str, follower: str
+        self,
+        snapshot: NeighborhoodSnapshot,
+        ego_id: str,
+        ego_speed: float,
+        leader: str,
+        follower: str,
     ) -> bool:
         if leader:
-            leader_speed = traci.vehicle.getSpeed(leader)
-            gap_front = distance_between(ego_id, leader)
+            leader_speed = snapshot.speed(leader)
+            gap_front = snapshot.distance_between(ego_id, leader)
             if gap_front < MIN_SAFE_GAP:
                 return False
 
         if follower:
-            follower_speed = traci.vehicle.getSpeed(follower)
-            gap_rear = abs(distance_between(follower, ego_id))
+            follower_speed = snapshot.speed(follower)
+            gap_rear = abs(snapshot.distance_between(follower, ego_id))
             if gap_rear < MIN_SAFE_GAP:
                 return False
 
@@ -141,6 +164,7 @@ class SL2015(BaseDecisionModel):
 
     def _calculate_speed_gain(
         self,
+        snapshot: NeighborhoodSnapshot,
         ego_speed: float,
         max_speed: float,
         leader_current: str,
@@ -150,10 +174,10 @@ class SL2015(BaseDecisionModel):
         target_achievable = max_speed
 
         if leader_current:
-            current_achievable = min(max_speed, traci.vehicle.getSpeed(leader_current))
+            current_achievable = min(max_speed, snapshot.speed(leader_current))
 
         if leader_target:
-            target_achievable = min(max_speed, traci.vehicle.getSpeed(leader_target))
+            target_achievable = min(max_speed, snapshot.speed(leader_target))
 
         return target_achievable - current_achievable
 
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# ML.decide_lane_change divides every feature by this factor before scaling
+FT_PER_M = 3.28084
+
+# Decision values closer to zero than this are re-checked with the scikit-learn
+# path, so rounding differences can never flip a label
+EXACT_MARGIN = 1e-9
+
+
+class RBFInferenceEngine:
+    """
+    Evaluates the trained RBF SVC directly with NumPy.
+
+    The unit conversion and the StandardScaler are folded into one weight and
+    bias per feature, and the decision function is computed over the stored
+    support vectors:
+
+        z = x * weight + bias
+        f(z) = sum_i dual_coef_i * exp(-gamma * ||sv_i - z||^2) + intercept
+
+    Labels are classes_[f(z) > 0], the same rule SVC.predict uses for binary
+    problems. Rows with |f(z)| < EXACT_MARGIN fall back to scaler + SVC.predict.
+    """
+
+    def __init__(self, model, scaler):
+        self.model = model
+        self.scaler = scaler
+        scale = np.asarray(scaler.scale_, dtype=np.float64)
+        mean = np.asarray(scaler.mean_, dtype=np.float64)
+        # (x / FT_PER_M - mean) / scale == x * weight + bias
+        self.weight = 1.0 / (FT_PER_M * scale)
+        self.bias = -mean / scale
+        self.support_vectors = np.ascontiguousarray(model.support_vectors_, dtype=np.float64)
+        self.sv_sq_norms = np.einsum("sf,sf->s", self.support_vectors, self.support_vectors)
+        self.dual_coef = np.ascontiguousarray(model.dual_coef_[0], dtype=np.float64)
+        self.intercept = float(model.intercept_[0])
+        self.gamma = float(model._gamma)
+        self.classes = np.asarray(model.classes_)
+        self.feature_names = list(getattr(scaler, "feature_names_in_", []))
+
+    def built_from(self, model, scaler) -> bool:
+        return self.model is model and self.scaler is scaler
+
+    def decision_function(self, features: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            features (np.ndarray): Raw feature vectors in SI units, shape (n, 10) or (10,).
+
+        Returns:
+            np.ndarray: Decision values, shape (n,).
+        """
+        z = np.atleast_2d(features) * self.weight + self.bias
+        # ||z - sv||^2 expanded, so only the (n, n_sv) distance matrix is allocated
+        sq_dist = z @ self.support_vectors.T
+        sq_dist *= -2.0
+        sq_dist += np.einsum("nf,nf->n", z, z)[:, None]
+        sq_dist += self.sv_sq_norms
+        np.maximum(sq_dist, 0.0, out=sq_dist)
+        return np.exp(-self.gamma * sq_dist) @ self.dual_coef + self.intercept
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        features = np.atleast_2d(features)
+        decision = self.decision_function(features)
+        labels = self.classes[(decision > 0).astype(np.intp)]
+        uncertain = np.abs(decision) < EXACT_MARGIN
+        if uncertain.any():
+            labels[uncertain] = self._predict_exact(features[uncertain])
+        return labels
+
+    def _predict_exact(self, features: np.ndarray) -> np.ndarray:
+        # Same steps as the original ML path: unit conversion, scaler, SVC.predict
+        data = pd.DataFrame(features / FT_PER_M, columns=self.feature_names or None)
+        return self.model.predict(self.scaler.transform(data))
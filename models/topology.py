@@ -0,0 +1,81 @@
+import os
+import pickle
+import xml.etree.ElementTree as ET
+from typing import NamedTuple
+
+import sumolib
+
+from models.artifacts import file_sha256
+
+# Pickled lane tables, named by the hash of their network file
+CACHE_DIR = os.path.join("cache", "topology")
+
+
+class LaneInfo(NamedTuple):
+    edge: str
+    index: int
+    length: float  # m
+    speed: float  # speed limit, m/s
+    left: str | None  # lane with the next higher index on the same edge
+    right: str | None  # lane with the next lower index on the same edge
+
+
+class LaneTopology:
+    """
+    Static lane table of a SUMO network, so the step loop and the models resolve
+    neighbouring lanes, lane indices and lengths without TraCI calls or parsing
+    lane IDs (edge IDs may contain underscores).
+
+    The table is read once from the .net.xml with sumolib and pickled under the
+    hash of the file; later loads of the same network read the pickle.
+    """
+
+    def __init__(self, lanes: dict[str, LaneInfo]):
+        self.lanes = lanes
+
+    @classmethod
+    def from_net(cls, net_file: str) -> "LaneTopology":
+        net = sumolib.net.readNet(net_file, withInternal=True)
+        lanes = {}
+        for edge in net.getEdges(withInternal=True):
+            edge_lanes = edge.getLanes()
+            for lane in edge_lanes:
+                index = lane.getIndex()
+                lanes[lane.getID()] = LaneInfo(
+                    edge=edge.getID(),
+                    index=index,
+                    length=lane.getLength(),
+                    speed=lane.getSpeed(),
+                    left=edge_lanes[index + 1].getID() if index + 1 < len(edge_lanes) else None,
+                    right=edge_lanes[index - 1].getID() if index > 0 else None,
+                )
+        return cls(lanes)
+
+    @classmethod
+    def load(cls, net_file: str, cache_dir: str | None = CACHE_DIR) -> "LaneTopology":
+        """The lane table of a network, from the cache when the file is unchanged."""
+        if cache_dir is None:
+            return cls.from_net(net_file)
+        cache_path = os.path.join(cache_dir, f"{file_sha256(net_file)}.pkl")
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                return cls(pickle.load(f))
+        topology = cls.from_net(net_file)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(topology.lanes, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        return topology
+
+    @classmethod
+    def for_config(cls, config_file: str, cache_dir: str | None = CACHE_DIR) -> "LaneTopology":
+        """The lane table of the network named in a .sumocfg."""
+        net_file = ET.parse(config_file).getroot().find("input/net-file").get("value")
+        return cls.load(os.path.join(os.path.dirname(config_file), net_file), cache_dir)
+
+    def __contains__(self, lane_id: str) -> bool:
+        return lane_id in self.lanes
+
+    def __getitem__(self, lane_id: str) -> LaneInfo:
+        return self.lanes[lane_id]
@@ -0,0 +1,177 @@
+"""
+Safety, comfort and efficiency metrics of the controlled vehicles, accumulated
+inside the TraCI step loop.
+
+The values come from variable subscriptions on the controlled vehicles and from
+the colliding-vehicles subscription of the simulation, so the collector needs no
+SUMO output files and only a fixed amount of memory per vehicle. The report has
+the same keys as output_metrics.summarize where the two overlap.
+"""
+
+import math
+
+import numpy as np
+import traci
+import traci.constants as tc
+
+from output_metrics import GASOLINE_DENSITY_MG_PER_L, RunningStats
+
+# Look-ahead distance (meters) for the leader of a controlled vehicle
+LEADER_LOOKAHEAD = 250.0
+
+# Time headway is only sampled above this speed (m/s); standing vehicles have none
+MIN_HEADWAY_SPEED = 0.1
+
+# Steps in the moving window of the RMS jerk
+JERK_WINDOW = 10
+
+SUBSCRIBED_VARIABLES = (
+    tc.VAR_SPEED,
+    tc.VAR_ACCELERATION,
+    tc.VAR_FUELCONSUMPTION,
+)
+
+
+class VehicleMetrics:
+    """Running metrics of one vehicle."""
+
+    def __init__(self, window: int = JERK_WINDOW):
+        self.speed = RunningStats()
+        self.abs_jerk = RunningStats()
+        self.leader_gap = RunningStats()
+        self.time_headway = RunningStats()
+        self.ttc = RunningStats()
+        self.distance = 0.0  # m
+        self.fuel = 0.0  # mg
+        self.collisions = 0
+        # ring buffer of the last squared jerks, for the moving RMS
+        self._squared_jerks = np.zeros(window)
+        self._window_sum = 0.0
+        self._samples = 0
+        self.peak_rms_jerk = math.nan
+        self._last_acceleration = None
+
+    def add(self, dt: float, speed: float, acceleration: float, fuel_rate: float,
+            leader_gap: float | None, leader_speed: float | None):
+        self.speed.add(speed)
+        self.distance += speed * dt
+        self.fuel += fuel_rate * dt
+
+        if self._last_acceleration is not None:
+            jerk = (acceleration - self._last_acceleration) / dt
+            self.abs_jerk.add(abs(jerk))
+            slot = self._samples % len(self._squared_jerks)
+            self._window_sum += jerk * jerk - self._squared_jerks[slot]
+            self._squared_jerks[slot] = jerk * jerk
+            self._samples += 1
+            if self._samples >= len(self._squared_jerks):
+                # max(..., 0) guards against rounding drift of the running sum
+                rms = math.sqrt(max(self._window_sum, 0.0) / len(self._squared_jerks))
+                if math.isnan(self.peak_rms_jerk) or rms > self.peak_rms_jerk:
+                    self.peak_rms_jerk = rms
+        self._last_acceleration = acceleration
+
+        if leader_gap is None:
+            return
+        self.leader_gap.add(leader_gap)
+        if speed > MIN_HEADWAY_SPEED:
+            self.time_headway.add(leader_gap / speed)
+        # time to collision only exists while the gap is closing
+        if leader_speed is not None and speed > leader_speed:
+            self.ttc.add(leader_gap / (speed - leader_speed))
+
+
+class OnlineMetrics:
+    """
+    Collects metrics for the controlled vehicles of one run.
+
+    Call count_collisions after every simulation step and update with the
+    controlled vehicles present, and report right before traci.close(), while
+    the subscriptions still exist.
+    """
+
+    def __init__(self, is_controlled, window: int = JERK_WINDOW):
+        self.is_controlled = is_controlled
+        self.window = window
+        self.vehicles: dict[str, VehicleMetrics] = {}
+        self.dt = traci.simulation.getDeltaT()
+        traci.simulation.subscribe([tc.VAR_COLLIDING_VEHICLES_IDS])
+
+    def count_collisions(self):
+        # a colliding vehicle may already be removed, so this runs on every step
+        colliding = traci.simulation.getSubscriptionResults().get(tc.VAR_COLLIDING_VEHICLES_IDS, ())
+        for veh_id in colliding:
+            if self.is_controlled(veh_id):
+                self.vehicles.setdefault(veh_id, VehicleMetrics(self.window)).collisions += 1
+
+    def update(self, controlled, snapshot=None):
+        """
+        Args:
+            controlled: IDs of the controlled vehicles in the simulation.
+            snapshot (NeighborhoodSnapshot): The step's snapshot, for the leader
+                speeds; leaders outside it get no TTC sample.
+        """
+        all_results = traci.vehicle.getAllSubscriptionResults()
+        for veh_id in controlled:
+            results = all_results.get(veh_id)
+            if not results or tc.VAR_FUELCONSUMPTION not in results:
+                # first step of this vehicle: its values arrive from the next step on.
+                # The leader gets its own call, which adds VAR_LEADER to the same
+                # subscription; libsumo's subscribe takes no parameters from Python
+                traci.vehicle.subscribe(veh_id, SUBSCRIBED_VARIABLES)
+                traci.vehicle.subscribeLeader(veh_id, LEADER_LOOKAHEAD)
+                continue
+            metrics = self.vehicles.setdefault(veh_id, VehicleMetrics(self.window))
+            leader = results[tc.VAR_LEADER]
+            leader_gap = leader_speed = None
+            if leader and leader[0]:
+                leader_id, leader_gap = leader
+                if snapshot is not None and leader_id in snapshot:
+                    leader_speed = snapshot.speed(leader_id)
+            metrics.add(
+                self.dt,
+                results[tc.VAR_SPEED],
+                results[tc.VAR_ACCELERATION],
+                results[tc.VAR_FUELCONSUMPTION],
+                leader_gap,
+                leader_speed,
+            )
+
+    def report(self) -> dict:
+        """Metrics over all controlled vehicles seen during the run."""
+        merged = {name: RunningStats() for name in ("speed", "abs_jerk", "leader_gap", "time_headway", "ttc")}
+        distance = fuel = 0.0
+        collisions = 0
+        peak_rms_jerk = math.nan
+        for metrics in self.vehicles.values():
+            for name, stats in merged.items():
+                stats.merge(getattr(metrics, name))
+            distance += metrics.distance
+            fuel += metrics.fuel
+            collisions += metrics.collisions
+            if math.isnan(peak_rms_jerk) or metrics.peak_rms_jerk > peak_rms_jerk:
+                peak_rms_jerk = metrics.peak_rms_jerk
+
+        def mean(stats):
+            return stats.mean if stats.count else math.nan
+
+        def minimum(stats):
+            return stats.min if stats.count else math.nan
+
+        liters = fuel / GASOLINE_DENSITY_MG_PER_L
+        return {
+            "vehicles": len(self.vehicles),
+            "mean_speed": mean(merged["speed"]),
+            "mean_abs_jerk": mean(merged["abs_jerk"]),
+            "max_abs_jerk": merged["abs_jerk"].max if merged["abs_jerk"].count else math.nan,
+            "rms_jerk": merged["abs_jerk"].rms,
+            "peak_rms_jerk": peak_rms_jerk,
+            "distance": distance,
+            "fuel_mg": fuel,
+            "km_per_l": distance / 1000 / liters if liters > 0 else math.nan,
+            "min_leader_gap": minimum(merged["leader_gap"]),
+            "mean_time_headway": mean(merged["time_headway"]),
+            "min_time_headway": minimum(merged["time_headway"]),
+            "min_ttc": minimum(merged["ttc"]),
+            "collisions": collisions,
+        }
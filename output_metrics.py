@@ -0,0 +1,274 @@
+"""
+Safety, fuel and comfort metrics from the SUMO output files of a run.
+
+Each file is read once with incremental parsing: elements are handled when they
+close and cleared right away, so memory stays bounded by the number of vehicles
+and not by the length of the run.
+
+- amitran trajectories: longitudinal jerk from consecutive motion states
+- tripinfo (with the emissions device): distance and fuel, giving km/L
+- lanechange output: gaps to the new leader and follower, and the time to
+  collision with them, at the moment of each lane change
+- collision output: collisions per vehicle, as collider or victim
+
+    python output_metrics.py scenarios/Sim_data --model Liu
+"""
+
+import argparse
+import math
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pandas as pd
+
+# Output file names in a run's output directory, by SUMO option
+OUTPUT_FILES = {
+    "amitran-output": "trajectories.xml",
+    "tripinfo-output": "Trip_data_Ego_vehicle.xml",
+    "lanechange-output": "lane_change_output.xml",
+    "collision-output": "collision_Ego_vehicle.xml",
+}
+
+# amitran stores integers: time in ms, speed in cm/s, acceleration in mm/s^2
+AMITRAN_TIME_UNIT = 1e-3
+AMITRAN_SPEED_UNIT = 1e-2
+AMITRAN_ACCEL_UNIT = 1e-3
+
+# tripinfo fuel_abs is in mg
+GASOLINE_DENSITY_MG_PER_L = 742_000
+
+
+class RunningStats:
+    """Count, mean, variance (Welford), minimum and maximum of a stream of values."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "RunningStats"):
+        """Combines the statistics of another stream into this one (Chan et al.)."""
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    @property
+    def rms(self) -> float:
+        # mean of squares = variance (population) + mean^2
+        return math.sqrt(self._m2 / self.count + self.mean**2) if self.count else math.nan
+
+
+def iter_elements(path, tags):
+    """
+    Yields the elements with the given tags as they close, then frees them.
+
+    Attributes (and, for a parent like tripinfo, its children) can be read until
+    the next element is requested.
+    """
+    tags = set(tags)
+    context = ET.iterparse(path, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event == "end" and elem.tag in tags:
+            yield elem
+            # dropping the handled elements from the root keeps the tree empty
+            root.clear()
+
+
+def _optional_float(value: str | None) -> float:
+    return math.nan if value in (None, "None", "") else float(value)
+
+
+def parse_trajectories(path) -> dict[str, dict]:
+    """Absolute longitudinal jerk (m/s^3) and speed (m/s) statistics per vehicle."""
+    names = {}  # amitran numeric id -> vehicle id
+    last = {}  # amitran numeric id -> (time, acceleration) of the previous motion state
+    jerk = {}
+    speed = {}
+    for elem in iter_elements(path, ("vehicle", "motionState")):
+        if elem.tag == "vehicle":
+            names[elem.get("id")] = elem.get("ref")
+            continue
+        vehicle = elem.get("vehicle")
+        time = int(elem.get("time")) * AMITRAN_TIME_UNIT
+        acceleration = int(elem.get("acceleration")) * AMITRAN_ACCEL_UNIT
+        speed.setdefault(vehicle, RunningStats()).add(int(elem.get("speed")) * AMITRAN_SPEED_UNIT)
+        previous = last.get(vehicle)
+        if previous is not None and time > previous[0]:
+            stats = jerk.setdefault(vehicle, RunningStats())
+            stats.add(abs(acceleration - previous[1]) / (time - previous[0]))
+        last[vehicle] = (time, acceleration)
+    return {
+        names.get(vehicle, vehicle): {"jerk": jerk.get(vehicle, RunningStats()), "speed": stats}
+        for vehicle, stats in speed.items()
+    }
+
+
+def parse_tripinfo(path) -> dict[str, dict]:
+    """Distance (m), duration and time loss (s) and fuel (mg, NaN without emissions device) per vehicle."""
+    trips = {}
+    for elem in iter_elements(path, ("tripinfo",)):
+        emissions = elem.find("emissions")
+        trips[elem.get("id")] = {
+            "route_length": float(elem.get("routeLength")),
+            "duration": float(elem.get("duration")),
+            "time_loss": float(elem.get("timeLoss")),
+            "fuel_mg": float(emissions.get("fuel_abs")) if emissions is not None else math.nan,
+        }
+    return trips
+
+
+def parse_lane_changes(path) -> dict[str, dict]:
+    """Lane changes, smallest gaps (m) and smallest time to collision (s) at lane changes per vehicle."""
+    changes = {}
+    for elem in iter_elements(path, ("change",)):
+        row = changes.setdefault(
+            elem.get("id"),
+            {"lane_changes": 0, "min_leader_gap": math.inf, "min_follower_gap": math.inf, "min_ttc": math.inf},
+        )
+        row["lane_changes"] += 1
+        speed = float(elem.get("speed"))
+        leader_gap = _optional_float(elem.get("leaderGap"))
+        leader_speed = _optional_float(elem.get("leaderSpeed"))
+        follower_gap = _optional_float(elem.get("followerGap"))
+        follower_speed = _optional_float(elem.get("followerSpeed"))
+        # NaN (no such vehicle) never passes the comparisons below
+        if leader_gap < row["min_leader_gap"]:
+            row["min_leader_gap"] = leader_gap
+        if follower_gap < row["min_follower_gap"]:
+            row["min_follower_gap"] = follower_gap
+        # time to collision only exists while the gap is closing
+        if speed > leader_speed:
+            row["min_ttc"] = min(row["min_ttc"], leader_gap / (speed - leader_speed))
+        if follower_speed > speed:
+            row["min_ttc"] = min(row["min_ttc"], follower_gap / (follower_speed - speed))
+    return changes
+
+
+def parse_collisions(path) -> dict[str, int]:
+    """Collisions per vehicle, counting both the collider and the victim."""
+    collisions = {}
+    for elem in iter_elements(path, ("collision",)):
+        for vehicle in (elem.get("collider"), elem.get("victim")):
+            collisions[vehicle] = collisions.get(vehicle, 0) + 1
+    return collisions
+
+
+def vehicle_metrics(output_dir) -> tuple[pd.DataFrame, dict[str, RunningStats]]:
+    """
+    Parses the output files found in output_dir.
+
+    Returns:
+        pd.DataFrame: One row per vehicle, indexed by vehicle ID.
+        dict[str, RunningStats]: Jerk statistics per vehicle, to merge across vehicles.
+    """
+    output_dir = Path(output_dir)
+    files = {option: output_dir / name for option, name in OUTPUT_FILES.items()}
+    rows: dict[str, dict] = {}
+    jerk = {}
+
+    if files["amitran-output"].exists():
+        for vehicle, stats in parse_trajectories(files["amitran-output"]).items():
+            jerk[vehicle] = stats["jerk"]
+            rows.setdefault(vehicle, {}).update({
+                "mean_speed": stats["speed"].mean,
+                "mean_abs_jerk": stats["jerk"].mean if stats["jerk"].count else math.nan,
+                "max_abs_jerk": stats["jerk"].max if stats["jerk"].count else math.nan,
+                "rms_jerk": stats["jerk"].rms,
+            })
+    if files["tripinfo-output"].exists():
+        for vehicle, trip in parse_tripinfo(files["tripinfo-output"]).items():
+            liters = trip["fuel_mg"] / GASOLINE_DENSITY_MG_PER_L
+            trip["km_per_l"] = trip["route_length"] / 1000 / liters if liters > 0 else math.nan
+            rows.setdefault(vehicle, {}).update(trip)
+    if files["lanechange-output"].exists():
+        for vehicle, changes in parse_lane_changes(files["lanechange-output"]).items():
+            rows.setdefault(vehicle, {}).update(changes)
+    if files["collision-output"].exists():
+        for vehicle, count in parse_collisions(files["collision-output"]).items():
+            rows.setdefault(vehicle, {})["collisions"] = count
+
+    df = pd.DataFrame.from_dict(rows, orient="index")
+    df.index.name = "vehicle"
+    for column in ("lane_changes", "collisions"):
+        if column in df.columns:
+            df[column] = df[column].fillna(0).astype(int)
+    # no lane change, or none with a closing gap, leaves inf; report it as missing
+    return df.replace(math.inf, math.nan), jerk
+
+
+def summarize(df: pd.DataFrame, jerk: dict[str, RunningStats], vehicles=None) -> dict:
+    """
+    One row of metrics over a set of vehicles (all when None).
+
+    Jerk statistics are merged over all motion states of the vehicles, fuel economy
+    is total distance over total fuel, and minima are taken over all vehicles.
+    """
+    if vehicles is not None:
+        df = df[df.index.isin(list(vehicles))]
+    total_jerk = RunningStats()
+    for vehicle in df.index:
+        if vehicle in jerk:
+            total_jerk.merge(jerk[vehicle])
+    summary = {
+        "vehicles": len(df),
+        "mean_abs_jerk": total_jerk.mean if total_jerk.count else math.nan,
+        "max_abs_jerk": total_jerk.max if total_jerk.count else math.nan,
+        "rms_jerk": total_jerk.rms,
+    }
+    if "fuel_mg" in df.columns:
+        fueled = df[df["fuel_mg"] > 0]
+        liters = fueled["fuel_mg"].sum() / GASOLINE_DENSITY_MG_PER_L
+        summary["km_per_l"] = fueled["route_length"].sum() / 1000 / liters if liters else math.nan
+    for column in ("min_leader_gap", "min_follower_gap", "min_ttc"):
+        if column in df.columns:
+            summary[column] = df[column].min()
+    for column in ("lane_changes", "collisions"):
+        summary[column] = int(df[column].sum()) if column in df.columns else 0
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_dir", type=Path)
+    parser.add_argument("--model", default=None, help="model name to label the summary with")
+    parser.add_argument("--vehicles", nargs="+", default=None, help="summarize only these vehicles")
+    parser.add_argument("--csv", type=Path, default=None, help="write the per-vehicle table here")
+    args = parser.parse_args()
+
+    df, jerk = vehicle_metrics(args.output_dir)
+    if args.csv:
+        df.to_csv(args.csv)
+    summary = summarize(df, jerk, args.vehicles)
+    if args.model:
+        summary = {"model": args.model, **summary}
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
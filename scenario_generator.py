@@ -0,0 +1,229 @@
+"""
+Generated variants of the hand-made scenarios at other traffic densities.
+
+A variant copies a scenario directory to scenarios/generated/<name> and changes
+
+    demand  the flows of the route files are scaled: vehsPerHour, number and
+            probability are multiplied, period is divided. Single vehicles and
+            trips (the controlled ones) are kept as they are.
+    lanes   the edges with the most lanes (the carriageway; ramps and exits keep
+            theirs) get this many lanes. The network is rebuilt with netconvert
+            from its plain XML, so the connections are guessed again, and the
+            depart and arrival lanes of the routes are clamped to the new edges.
+    mix     every flow draws its vehicle types from a vTypeDistribution over the
+            given vTypes of the route files, with the given shares.
+
+The output section of the configuration is dropped, so a variant runs without
+output_dir even when its base names output paths of another machine. The
+variant is a scenario like the others, SimulationManager("generated/<name>", ...).
+
+    python scenario_generator.py ScenarioC --demand 0.5 1 2 --lanes 3 --mix car=0.8 bus=0.2
+"""
+
+import argparse
+import itertools
+import json
+import shutil
+import subprocess
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import sumolib
+
+SCENARIOS_DIR = Path("scenarios")
+GENERATED_DIR = "generated"
+CONFIG_FILE = "simulation.sumocfg"
+MIX_TYPE = "mix"
+
+# keep the schema references of the rewritten files readable
+ET.register_namespace("xsi", "http://www.w3.org/2001/XMLSchema-instance")
+
+
+def variant_name(base: str, demand: float = 1.0, lanes: int | None = None, mix: dict | None = None) -> str:
+    name = f"{base}_x{demand:g}"
+    if lanes is not None:
+        name += f"_{lanes}lanes"
+    if mix:
+        total = sum(mix.values())
+        name += "_" + "-".join(f"{vtype}{round(100 * share / total)}" for vtype, share in mix.items())
+    return name
+
+
+def _rebuild_net(net_file: Path, lanes: int, out_file: Path):
+    """Rebuilds the network with `lanes` lanes on its widest edges."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        prefix = Path(tmp_dir) / "plain"
+        subprocess.run(
+            [sumolib.checkBinary("netconvert"), "--sumo-net-file", str(net_file),
+             "--plain-output-prefix", str(prefix)],
+            check=True, capture_output=True,
+        )
+        edges_file = prefix.with_suffix(".edg.xml")
+        tree = ET.parse(edges_file)
+        edges = list(tree.getroot().iter("edge"))
+        widest = max(int(edge.get("numLanes", 1)) for edge in edges)
+        for edge in edges:
+            if int(edge.get("numLanes", 1)) != widest:
+                continue
+            edge.set("numLanes", str(lanes))
+            lane_elements = edge.findall("lane")
+            for lane in lane_elements:
+                if int(lane.get("index")) >= lanes:
+                    edge.remove(lane)
+            # added lanes are copies of the leftmost one (speed limit, permissions)
+            if lane_elements:
+                for index in range(widest, lanes):
+                    lane = ET.SubElement(edge, "lane", lane_elements[-1].attrib)
+                    lane.set("index", str(index))
+        tree.write(edges_file)
+        # the plain connections refer to the old lanes; netconvert guesses new ones
+        cmd = [sumolib.checkBinary("netconvert"),
+               "--node-files", str(prefix.with_suffix(".nod.xml")),
+               "--edge-files", str(edges_file),
+               "--offset.disable-normalization", "true",
+               "--no-turnarounds", "true",
+               "--output-file", str(out_file)]
+        types_file = prefix.with_suffix(".typ.xml")
+        if types_file.exists():
+            cmd += ["--type-files", str(types_file)]
+        subprocess.run(cmd, check=True, capture_output=True)
+
+
+def _scale_flow(flow: ET.Element, demand: float) -> bool:
+    """Scales the demand of a flow; False when nothing of it is left."""
+    if flow.get("vehsPerHour") is not None:
+        flow.set("vehsPerHour", f"{float(flow.get('vehsPerHour')) * demand:g}")
+    if flow.get("period") is not None and demand > 0:
+        flow.set("period", f"{float(flow.get('period')) / demand:g}")
+    if flow.get("probability") is not None:
+        flow.set("probability", f"{min(float(flow.get('probability')) * demand, 1.0):g}")
+    if flow.get("number") is not None:
+        flow.set("number", str(round(int(flow.get("number")) * demand)))
+        return int(flow.get("number")) > 0
+    return demand > 0
+
+
+def _clamp_lane(element: ET.Element, attr: str, lane_count: int | None):
+    value = element.get(attr)
+    if lane_count is not None and value is not None and value.isdigit():
+        element.set(attr, str(min(int(value), lane_count - 1)))
+
+
+def _rewrite_routes(route_file: Path, demand: float, mix: dict | None, lane_counts: dict[str, int] | None):
+    tree = ET.parse(route_file)
+    root = tree.getroot()
+    routes = {route.get("id"): route.get("edges").split() for route in root.iter("route") if route.get("id")}
+    if mix:
+        vtypes = {vtype.get("id") for vtype in root.iter("vType")}
+        unknown = set(mix) - vtypes
+        if unknown:
+            raise ValueError(f"vTypes {sorted(unknown)} are not defined in {route_file}, expected some of {sorted(vtypes)}")
+        distribution = ET.Element(
+            "vTypeDistribution",
+            id=MIX_TYPE,
+            vTypes=" ".join(mix),
+            probabilities=" ".join(f"{share:g}" for share in mix.values()),
+        )
+        distribution.tail = "\n    "
+        # after the vTypes it refers to
+        last_vtype = max(i for i, child in enumerate(root) if child.tag == "vType")
+        root.insert(last_vtype + 1, distribution)
+    for element in list(root):
+        if element.tag == "flow":
+            if not _scale_flow(element, demand):
+                root.remove(element)
+                continue
+            if mix:
+                element.set("type", MIX_TYPE)
+        if element.tag not in ("flow", "vehicle", "trip") or lane_counts is None:
+            continue
+        if element.get("route") in routes:
+            edges = routes[element.get("route")]
+        elif element.find("route") is not None:
+            edges = element.find("route").get("edges").split()
+        else:
+            edges = [element.get("from"), element.get("to")]
+        _clamp_lane(element, "departLane", lane_counts.get(edges[0]))
+        _clamp_lane(element, "arrivalLane", lane_counts.get(edges[-1]))
+    tree.write(route_file, encoding="UTF-8", xml_declaration=True)
+
+
+def generate(
+    base: str,
+    demand: float = 1.0,
+    lanes: int | None = None,
+    mix: dict[str, float] | None = None,
+    name: str | None = None,
+) -> str:
+    """
+    Writes a variant of a scenario, replacing an earlier one of the same name.
+
+    Args:
+        base (str): Name of the scenario directory under scenarios/.
+        demand (float): Multiplier of the flows.
+        lanes (int | None): Lane count of the widest edges; None keeps the network.
+        mix (dict[str, float] | None): Share of each vType in the flows; None keeps
+            the types of the flows.
+        name (str | None): Directory name of the variant; derived from the
+            parameters by default.
+
+    Returns:
+        str: The scenario name of the variant, for SimulationManager.
+    """
+    base_dir = SCENARIOS_DIR / base
+    name = name or variant_name(base, demand, lanes, mix)
+    out_dir = SCENARIOS_DIR / GENERATED_DIR / name
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    shutil.copytree(base_dir, out_dir)
+
+    config = ET.parse(out_dir / CONFIG_FILE)
+    inputs = config.getroot().find("input")
+    output = config.getroot().find("output")
+    if output is not None:
+        for option in list(output):
+            output.remove(option)
+    config.write(out_dir / CONFIG_FILE, encoding="UTF-8", xml_declaration=True)
+
+    lane_counts = None
+    if lanes is not None:
+        net_file = inputs.find("net-file").get("value")
+        _rebuild_net(base_dir / net_file, lanes, out_dir / net_file)
+        net = sumolib.net.readNet(str(out_dir / net_file))
+        lane_counts = {edge.getID(): edge.getLaneNumber() for edge in net.getEdges()}
+    for route_file in inputs.find("route-files").get("value").split(","):
+        _rewrite_routes(out_dir / route_file.strip(), demand, mix, lane_counts)
+
+    parameters = {"base": base, "demand": demand, "lanes": lanes, "mix": mix}
+    (out_dir / "generator.json").write_text(json.dumps(parameters, indent=1))
+    return f"{GENERATED_DIR}/{name}"
+
+
+def parse_mix(items: list[str] | None) -> dict[str, float] | None:
+    """{"car": 0.8, "bus": 0.2} from ["car=0.8", "bus=0.2"]."""
+    if not items:
+        return None
+    mix = {}
+    for item in items:
+        vtype, _, share = item.partition("=")
+        mix[vtype] = float(share)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base", help="scenario directory under scenarios/")
+    parser.add_argument("--demand", nargs="+", type=float, default=[1.0], help="flow multipliers")
+    parser.add_argument("--lanes", nargs="+", type=int, default=[None], help="lane counts of the carriageway")
+    parser.add_argument("--mix", nargs="+", default=None, metavar="VTYPE=SHARE",
+                        help="vehicle-type shares of the flows")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    for demand, lanes in itertools.product(args.demand, args.lanes):
+        print(generate(args.base, demand, lanes, mix))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,74 @@
+import contextlib
 import os
+import tempfile
+import time
+from collections.abc import Callable, Collection
+from concurrent.futures import ProcessPoolExecutor
 
 import sumolib
 import traci
 
+import sumo_backend
+
+from models.artifacts import registry
 from models.base_model import BaseDecisionModel
+from models.neighborhood import NeighborhoodSnapshot
+from models.topology import LaneTopology
+from decision_scheduler import DecisionScheduler
+from decision_trace import DecisionTrace
+from online_metrics import OnlineMetrics
+from output_metrics import OUTPUT_FILES, summarize, vehicle_metrics
+from state_log import StateRecorder
+from traci_profiler import TraciProfiler
+from warmup import STATE_SUFFIX, WarmupCache
 
 # Settings
 DELAY = "225"
 BEGIN_TIME = "100"
+EGO_VEHICLES = frozenset({"Ego"})
 
 
 def kmh_2_ms(speed: float) -> float:
     return speed / 3.6
 
 
+def _run_model_worker(
+    manager: "SimulationManager", model_name: str, model_instance: BaseDecisionModel
+):
+    # Module-level so it can be pickled into a worker process
+    try:
+        return model_name, manager.run_simulation_for_model(model_name, model_instance)
+    except Exception as exc:
+        # libsumo's exceptions wrap SWIG objects and cannot be pickled back to the parent
+        raise RuntimeError(f"{model_name}: {type(exc).__name__}: {exc}") from None
+
+
+def _phase(profiler: TraciProfiler | None, name: str):
+    return profiler.phase(name) if profiler is not None else contextlib.nullcontext()
+
+
 class SimulationManager:
     def __init__(
-        self, scenario: str, models: dict[str, BaseDecisionModel], max_steps: int = 500
+        self,
+        scenario: str,
+        models: dict[str, BaseDecisionModel],
+        max_steps: int = 500,
+        gui: bool = True,
+        controlled: Collection[str] | Callable[[str], bool] = EGO_VEHICLES,
+        seed: int | None = None,
+        scale: float | None = None,
+        output_dir: str | None = None,
+        online_metrics: bool = True,
+        record_dir: str | None = None,
+        profile_dir: str | None = None,
+        trace_dir: str | None = None,
+        trace_level: str = "decisions",
+        trace_every: int = 1,
+        trace_rate: float = 1.0,
+        backend: str = "traci",
+        warmup_dir: str | None = None,
+        event_driven: bool = False,
+        log_dir: str = ".",
     ):
         # Determine the correct path separator based on OS
         if os.name == "nt":
@@ -25,80 +77,376 @@ class SimulationManager:
             self.config_file = f"scenarios/{scenario}/simulation.sumocfg"
         self.models = models  # {'ModelName': model_instance}
         self.max_steps = max_steps
+        # Headless runs use plain sumo without the visualisation delay
+        self.gui = gui
+        # IDs of the vehicles driven by the decision model, or a predicate on the ID.
+        # Predicates must be module-level functions to run in worker processes.
+        self.controlled = controlled
+        # SUMO random seed and demand scaling factor; None keeps the SUMO defaults
+        self.seed = seed
+        self.scale = scale
+        # Write the trajectory, trip, lane-change and collision outputs of each run
+        # to output_dir/<model name> and summarize them in the run results
+        self.output_dir = output_dir
+        # Accumulate the metrics of the controlled vehicles inside the step loop
+        self.online_metrics = online_metrics
+        # Record the neighborhood states and decisions of each run to
+        # record_dir/<model name>, for replay without SUMO (see state_log.py)
+        self.record_dir = record_dir
+        # Count and time the TraCI calls of each run and write the reports to
+        # profile_dir/<model name>.json and .folded (see traci_profiler.py)
+        self.profile_dir = profile_dir
+        # Trace the decisions of each run to trace_dir/<model name>.parquet, at the
+        # given level, on every trace_every-th step and for a trace_rate fraction of
+        # the decisions (see decision_trace.py)
+        self.trace_dir = trace_dir
+        self.trace_level = trace_level
+        self.trace_every = trace_every
+        self.trace_rate = trace_rate
+        # SUMO client library of headless runs, "traci" or "libsumo" (in-process);
+        # GUI runs always use traci (see sumo_backend.py)
+        self.backend = backend
+        # Cache the traffic warm-up before the first controlled vehicle appears in
+        # warmup_dir and start every run from it; the results of such runs are
+        # not comparable to uncached ones (see warmup.py)
+        self.warmup_dir = warmup_dir
+        # Only call the model for vehicles whose neighborhood changed, keeping the
+        # last decision of the others (see decision_scheduler.py)
+        self.event_driven = event_driven
+        # Directory of the SUMO log of each headless run, sumo_log_<model name>.txt
+        self.log_dir = log_dir
+        # Lanes of the scenario's network, read once and cached on disk (see models/topology.py)
+        self.topology = LaneTopology.for_config(self.config_file)
+
+    def is_controlled(self, veh_id: str) -> bool:
+        if callable(self.controlled):
+            return self.controlled(veh_id)
+        return veh_id in self.controlled
+
+    def desired_lane(self, current_lane: str) -> tuple[str, int]:
+        """The lane to the right of current_lane (or current_lane itself on the rightmost lane)."""
+        if current_lane not in self.topology:
+            x = current_lane.rsplit("_", 1)
+            if int(x[1]) <= 0:
+                return current_lane, int(x[1])
+            return f"{x[0]}_{int(x[1]) - 1}", int(x[1]) - 1
+        lane = self.topology[current_lane]
+        if lane.right is None:
+            return current_lane, lane.index
+        return lane.right, lane.index - 1
 
-    def get_sumo_cmd(self, sumo_binary: str = "sumo"):
+    def get_sumo_cmd(
+        self,
+        sumo_binary: str = "sumo",
+        log_file: str = "sumo_log.txt",
+        output_dir: str | None = None,
+        state_file: str | None = None,
+        begin_time: str = BEGIN_TIME,
+    ):
         sumo_binary_path = sumolib.checkBinary(sumo_binary)
-        return [
+        cmd = [
             sumo_binary_path,
             "-c",
             self.config_file,
             "--log",
-            "sumo_log.txt",
-            "--delay",
-            DELAY,
-            "-b",
-            BEGIN_TIME,
+            log_file,
         ]
+        if self.gui:
+            cmd += ["--delay", DELAY]
+        if self.seed is not None:
+            cmd += ["--seed", str(self.seed)]
+        if self.scale is not None:
+            cmd += ["--scale", str(self.scale)]
+        if output_dir is not None:
+            for option, file_name in OUTPUT_FILES.items():
+                cmd += [f"--{option}", os.path.join(output_dir, file_name)]
+            # fuel consumption in the trip info, also for vehicles still driving at the end
+            cmd += ["--device.emissions.probability", "1"]
+            cmd += ["--tripinfo-output.write-unfinished", "true"]
+        if state_file is not None:
+            # the begin time has to be the time the state was saved at
+            cmd += ["--load-state", state_file]
+        cmd += ["-b", begin_time]
+        return cmd
+
+    def _controlled_key(self) -> str:
+        if callable(self.controlled):
+            return f"{self.controlled.__module__}.{self.controlled.__qualname__}"
+        return repr(sorted(self.controlled))
+
+    def warm_up(self) -> dict | None:
+        """
+        Simulates the steps before the first controlled vehicle appears and saves
+        the state, once per scenario, seed, scale and set of controlled vehicles.
+
+        Returns:
+            dict | None: The cache entry with the path of the saved state, or None
+                without warmup_dir or when the warm-up is longer than max_steps.
+        """
+        if self.warmup_dir is None:
+            return None
+        cache = WarmupCache(self.warmup_dir)
+        key = cache.key(
+            self.config_file,
+            seed=self.seed,
+            scale=self.scale,
+            begin=BEGIN_TIME,
+            controlled=self._controlled_key(),
+            # the emissions device of the output runs is part of the state
+            outputs=self.output_dir is not None,
+        )
+        entry = cache.get(key)
+        # a warm-up cut short by the step limit of a shorter run is simulated again
+        if entry is None or (not entry["complete"] and entry["steps"] < self.max_steps):
+            entry = self._simulate_warm_up(cache, key)
+        if entry["steps"] > self.max_steps:
+            return None
+        return {**entry, "state": str(cache.path(key))}
+
+    def _simulate_warm_up(self, cache: WarmupCache, key: str) -> dict:
+        # next to the cache, so the state is moved into it without crossing file systems
+        with tempfile.TemporaryDirectory(dir=cache.root) as tmp_dir:
+            # same options as the runs, with the outputs thrown away
+            output_dir = tmp_dir if self.output_dir is not None else None
+            sumo_cmd = self.get_sumo_cmd(log_file=os.devnull, output_dir=output_dir)
+            # full precision, positions and speeds are rounded to 2 decimals by default
+            sumo_cmd += ["--save-state.rng", "true", "--save-state.precision", "17"]
+            sumo_backend.use(self.backend)
+            traci.start(
+                sumo_cmd, port=sumolib.miscutils.getFreeSocketPort(), label=f"warmup_{key}"
+            )
+            initial_vehicles = list(traci.vehicle.getIDList())
+            for veh_id in initial_vehicles:
+                traci.vehicle.setLaneChangeMode(veh_id, 0)
+            state_file = os.path.join(tmp_dir, f"state{STATE_SUFFIX}")
+            steps = 0
+            complete = False
+            while True:
+                # the state before the step in which the first controlled vehicle appears
+                traci.simulation.saveState(state_file)
+                state_time = traci.simulation.getTime()
+                if steps >= self.max_steps:
+                    break
+                traci.simulationStep()
+                if any(self.is_controlled(veh_id) for veh_id in traci.vehicle.getIDList()):
+                    complete = True
+                    break
+                steps += 1
+            traci.close()
+            entry = {
+                "steps": steps,
+                "time": state_time,
+                "complete": complete,
+                "initial_vehicles": initial_vehicles,
+            }
+            cache.put(key, state_file, entry)
+        return entry
 
     def run_simulation_for_model(
         self, model_name: str, model_instance: BaseDecisionModel
-    ):
-        traci.start(self.get_sumo_cmd(sumo_binary="sumo-gui"))
+    ) -> dict:
+        """
+        Runs one simulation with the given decision model controlling the controlled vehicles.
+
+        Each step the state of all controlled vehicles comes from one shared snapshot
+        and the model is called once with the requests of all of them.
+
+        Every run gets its own TraCI connection label and port, so several runs can
+        be active at the same time (one per worker process).
+
+        Returns:
+            dict: Summary of the run (steps, decisions, lane changes, wall time,
+                time of the step loop, step length, mean number of vehicles in
+                the network, loaded model artifacts, online metrics of the controlled vehicles,
+                their output-file metrics when output_dir is set, the TraCI
+                profile when profile_dir is set, the decision trace when
+                trace_dir is set and the skip statistics of event_driven runs).
+        """
+        output_dir = None
+        if self.output_dir is not None:
+            output_dir = os.path.join(self.output_dir, model_name)
+            os.makedirs(output_dir, exist_ok=True)
+        warm_up = self.warm_up()
+        start_options = {"output_dir": output_dir}
+        if warm_up is not None:
+            start_options.update(state_file=warm_up["state"], begin_time=f"{warm_up['time']:g}")
+        if self.gui:
+            sumo_cmd = self.get_sumo_cmd(sumo_binary="sumo-gui", **start_options)
+        else:
+            sumo_cmd = self.get_sumo_cmd(
+                log_file=os.path.join(self.log_dir, f"sumo_log_{model_name}.txt"), **start_options
+            )
+        sumo_backend.use("traci" if self.gui else self.backend)
+        start_time = time.perf_counter()
+        traci.start(
+            sumo_cmd, port=sumolib.miscutils.getFreeSocketPort(), label=model_name
+        )
+        metrics = OnlineMetrics(self.is_controlled) if self.online_metrics else None
+        recorder = None
+        if self.record_dir is not None:
+            recorder = StateRecorder(os.path.join(self.record_dir, model_name))
+        trace = None
+        if self.trace_dir is not None:
+            trace = DecisionTrace(
+                os.path.join(self.trace_dir, f"{model_name}.parquet"),
+                level=self.trace_level,
+                every=self.trace_every,
+                rate=self.trace_rate,
+                seed=self.seed or 0,
+            )
+        scheduler = DecisionScheduler() if self.event_driven else None
+        profiler = None
+        if self.profile_dir is not None:
+            profiler = TraciProfiler(model_name)
+            profiler.install()
+        decisions = 0
+        lane_changes = 0
+        # vehicles in the network summed over the simulated steps
+        vehicle_steps = 0
         # Disable default lane change logic for all vehicles
-        for veh_id in traci.vehicle.getIDList():
+        initial_vehicles = traci.vehicle.getIDList()
+        step = 0
+        step_length = traci.simulation.getDeltaT()
+        if warm_up is not None:
+            # the vehicles of the begin time, not all the ones of the loaded state
+            present = set(initial_vehicles)
+            initial_vehicles = [veh_id for veh_id in warm_up["initial_vehicles"] if veh_id in present]
+            step = warm_up["steps"]
+        for veh_id in initial_vehicles:
             traci.vehicle.setLaneChangeMode(veh_id, 0)
             # traci.vehicle.setSpeedMode(veh_id, 0)
 
-        step = 0
+        loop_start = time.perf_counter()
         while step < self.max_steps:
+            if profiler is not None:
+                profiler.end_step()
+                profiler.begin_step(step + 1)
             traci.simulationStep()
             step += 1
-            # Check if ego vehicle is in simulation:
-            if "Ego" in traci.vehicle.getIDList():
-                print("Ego vehicle is in simulation")
+            if metrics is not None:
+                metrics.count_collisions()
+            # Check if controlled vehicles are in simulation:
+            vehicles = traci.vehicle.getIDList()
+            vehicle_steps += len(vehicles)
+            controlled = [veh_id for veh_id in vehicles if self.is_controlled(veh_id)]
+            if not controlled:
+                continue
 
-                veh_id = "Ego"
-                current_lane = traci.vehicle.getLaneID(veh_id)
+            # one subscription read per step, shared by all controlled vehicles and the model
+            with _phase(profiler, "snapshot"):
+                snapshot = NeighborhoodSnapshot.from_subscriptions(
+                    controlled, topology=self.topology
+                )
+            if metrics is not None:
+                metrics.update(controlled, snapshot)
 
-                # desired_lane_id = self.get_lane_id(edge, desired_lane_idx)
+            # prepare arguments for the decision model
+            requests = []
+            desired_lane_idxs = []
+            for veh_id in controlled:
+                current_lane = snapshot.lane_id(veh_id)
+                desired_lane, desired_lane_idx = self.desired_lane(current_lane)
                 # vehicle is already in the desired lane; no action needed
-                print("current lane", current_lane)
-                x = current_lane.split("_")
-                if int(x[-1]) <= 0:
-                    desired_lane = current_lane
-                else:
-                    desired_lane_idx = int(x[-1]) - 1
-                    desired_lane = x[0] + "_" + str(desired_lane_idx)
-                print("desired lane", desired_lane)
                 if desired_lane == current_lane:
                     continue
-                # prepare arguments for the decision model
-                decision_kwargs = {
-                    "veh_id": veh_id,
-                    "current_lane": current_lane,
-                    "desired_lane": desired_lane,
-                }
-                # invoke the decision model
-
-                should_change_lane = model_instance.decide_lane_change(
-                    **decision_kwargs
+                requests.append(
+                    {
+                        "veh_id": veh_id,
+                        "current_lane": current_lane,
+                        "desired_lane": desired_lane,
+                        "snapshot": snapshot,
+                    }
                 )
-                print("lane change: ", should_change_lane)
+                desired_lane_idxs.append(desired_lane_idx)
+            if scheduler is not None:
+                # the others keep their last decision and the command issued for it
+                dirty = scheduler.select(step, requests)
+                requests = [request for request, d in zip(requests, dirty) if d]
+                desired_lane_idxs = [idx for idx, d in zip(desired_lane_idxs, dirty) if d]
+            if not requests:
+                continue
+
+            # invoke the decision model once for all vehicles
+            with (
+                profiler.decision(len(requests))
+                if profiler is not None
+                else contextlib.nullcontext()
+            ):
+                decisions_this_step = model_instance.decide_lane_changes(requests)
+            decisions += len(requests)
+            if scheduler is not None:
+                scheduler.update(step, requests, decisions_this_step)
+            if recorder is not None:
+                recorder.record(step, snapshot, requests, decisions_this_step)
+            if trace is not None:
+                trace.record(step, requests, decisions_this_step, model_instance)
 
-                if should_change_lane and not desired_lane == current_lane:
-                    traci.vehicle.changeLane(veh_id, int(desired_lane_idx), 20)
+            for request, desired_lane_idx, should_change_lane in zip(
+                requests, desired_lane_idxs, decisions_this_step
+            ):
+                veh_id = request["veh_id"]
+                if should_change_lane:
+                    traci.vehicle.changeLane(veh_id, desired_lane_idx, 20)
+                    lane_changes += 1
                 else:
                     # implement slowing down if safety metric is not met
                     # this requires fetching the safety metric, which the model does internally
                     # for simplicity, let's assume we slow down if a lane change was considered but not executed
-                    current_speed = traci.vehicle.getSpeed(veh_id)
+                    current_speed = snapshot.speed(veh_id)
                     target_speed = max(
                         current_speed - kmh_2_ms(2), 0
                     )  # slow down by 2 km/h
                     duration = 5
                     traci.vehicle.slowDown(veh_id, target_speed, duration)
 
+        step_time = time.perf_counter() - loop_start
+        if recorder is not None:
+            recorder.close()
+        trace_summary = trace.close() if trace is not None else None
+        profile = None
+        if profiler is not None:
+            profiler.end_step()
+            profiler.uninstall()
+            profile = profiler.write(self.profile_dir)
+        # the subscriptions are gone once the connection is closed
+        online_report = metrics.report() if metrics is not None else None
         traci.close()
+        warmup_steps = warm_up["steps"] if warm_up is not None else 0
+        result = {
+            "steps": step,
+            "decisions": decisions,
+            "lane_changes": lane_changes,
+            "wall_time": time.perf_counter() - start_time,
+            # the step loop alone, without starting and closing SUMO
+            "step_time": step_time,
+            # steps loaded from the warm-up cache instead of simulated
+            "warmup_steps": warmup_steps,
+            # runs from a cached warm-up are not comparable to uncached ones (see warmup.py)
+            "warmup_cached": warm_up is not None,
+            "step_length": step_length,
+            # mean number of vehicles in the network over the simulated steps
+            "mean_vehicles": vehicle_steps / max(step - warmup_steps, 1),
+            # load time and resident size of the model artifacts used in this process
+            "artifacts": registry.report(),
+        }
+        if online_report is not None:
+            result["online_metrics"] = online_report
+        if scheduler is not None:
+            result["scheduler"] = scheduler.report()
+        if trace_summary is not None:
+            result["trace"] = trace_summary
+        if profile is not None:
+            result["profile"] = {
+                key: profile[key]
+                for key in ("traci_calls", "traci_time", "decision_latency_us")
+            }
+            result["profile"]["report"] = os.path.join(self.profile_dir, f"{model_name}.json")
+        if output_dir is not None:
+            # the output files are complete once SUMO has closed
+            df, jerk = vehicle_metrics(output_dir)
+            controlled = [veh_id for veh_id in df.index if self.is_controlled(veh_id)]
+            result["metrics"] = summarize(df, jerk, controlled)
+        return result
 
     # def compute_desired_lanes(self):
     #     """
@@ -164,9 +512,40 @@ class SimulationManager:
     #         return edge, lane_idx
     #     return None, None
 
-    def run_all_simulations(self):
+    def run_all_simulations(self, parallel: bool | None = None) -> dict[str, dict]:
+        """
+        Runs the simulation once for every model.
+
+        Args:
+            parallel (bool | None): Run each model in its own worker process.
+                Defaults to True for headless runs and False when using the GUI.
+
+        Returns:
+            dict[str, dict]: Run summary per model name.
+        """
         print("run_all_simulations")
-        for model_name, model_instance in self.models.items():
-            print(f"Starting simulation for model: {model_name}")
-            self.run_simulation_for_model(model_name, model_instance)
-            print(f"Completed simulation for model: {model_name}")
+        if parallel is None:
+            parallel = not self.gui
+        # simulate a missing warm-up once, before the runs that start from it
+        self.warm_up()
+        results = {}
+        if not parallel:
+            for model_name, model_instance in self.models.items():
+                print(f"Starting simulation for model: {model_name}")
+                results[model_name] = self.run_simulation_for_model(
+                    model_name, model_instance
+                )
+                print(f"Completed simulation for model: {model_name}")
+            return results
+
+        workers = min(len(self.models), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_run_model_worker, self, model_name, model_instance)
+                for model_name, model_instance in self.models.items()
+            ]
+            for future in futures:
+                model_name, result = future.result()
+                print(f"Completed simulation for model: {model_name}")
+                results[model_name] = result
+        return results
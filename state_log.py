@@ -0,0 +1,243 @@
+"""
+Record and replay of the neighborhood states the decision models see.
+
+StateRecorder writes, for every step with lane-change requests, the state of all
+vehicles in the step's NeighborhoodSnapshot, the requests and the decisions of
+the live model. The log is a directory of fixed-size binary records:
+
+    steps.bin     one STEP_DTYPE record per recorded step
+    vehicles.bin  VEHICLE_DTYPE records, the vehicles of each step in a row
+    requests.bin  REQUEST_DTYPE records, the requests of each step in a row
+    index.json    vehicle and lane names, lane lengths and the record layouts
+
+StateLog opens the record files with np.memmap, so a log of hours of traffic is
+read lazily, and replay feeds its steps to any BaseDecisionModel without a SUMO
+process:
+
+    python state_log.py recordings/Liu --model LiuImproved
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import traci.constants as tc
+
+from models.base_model import BaseDecisionModel
+from models.neighborhood import NeighborhoodSnapshot
+
+LOG_VERSION = 1
+
+STEP_DTYPE = np.dtype([
+    ("step", "<i4"),
+    ("first_vehicle", "<i8"),
+    ("vehicles", "<i4"),
+    ("first_request", "<i8"),
+    ("requests", "<i4"),
+])
+VEHICLE_DTYPE = np.dtype([
+    ("vehicle", "<i4"),  # index into index.json "vehicles"
+    ("lane", "<i4"),  # index into index.json "lanes"
+    ("lane_index", "<i4"),
+    ("x", "<f8"),
+    ("y", "<f8"),
+    ("speed", "<f8"),
+    ("acceleration", "<f8"),
+    ("lane_position", "<f8"),
+    ("max_speed", "<f8"),
+])
+REQUEST_DTYPE = np.dtype([
+    ("vehicle", "<i4"),
+    ("current_lane", "<i4"),
+    ("desired_lane", "<i4"),
+    ("decision", "i1"),  # decision of the recorded run
+])
+RECORD_FILES = {
+    "steps": ("steps.bin", STEP_DTYPE),
+    "vehicles": ("vehicles.bin", VEHICLE_DTYPE),
+    "requests": ("requests.bin", REQUEST_DTYPE),
+}
+
+
+class StateRecorder:
+    """Appends the steps of one run to a state log directory."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._files = {
+            name: open(self.path / file_name, "wb") for name, (file_name, _) in RECORD_FILES.items()
+        }
+        self._vehicle_ids: dict[str, int] = {}
+        self._lane_ids: dict[str, int] = {}
+        self._lane_lengths: dict[str, float] = {}
+        self._counts = {name: 0 for name in RECORD_FILES}
+
+    def _vehicle(self, veh_id: str) -> int:
+        return self._vehicle_ids.setdefault(veh_id, len(self._vehicle_ids))
+
+    def _lane(self, lane_id: str, snapshot: NeighborhoodSnapshot | None = None) -> int:
+        if snapshot is not None and lane_id not in self._lane_lengths:
+            self._lane_lengths[lane_id] = snapshot.lane_length(lane_id)
+        return self._lane_ids.setdefault(lane_id, len(self._lane_ids))
+
+    def record(self, step: int, snapshot: NeighborhoodSnapshot, requests: list[dict], decisions):
+        vehicles = np.empty(len(snapshot), dtype=VEHICLE_DTYPE)
+        for i, veh_id in enumerate(snapshot):
+            x, y = snapshot.position(veh_id)
+            vehicles[i] = (
+                self._vehicle(veh_id),
+                self._lane(snapshot.lane_id(veh_id)),
+                snapshot.lane_index(veh_id),
+                x,
+                y,
+                snapshot.speed(veh_id),
+                snapshot.acceleration(veh_id),
+                snapshot.lane_position(veh_id),
+                snapshot.max_speed(veh_id),
+            )
+        rows = np.empty(len(requests), dtype=REQUEST_DTYPE)
+        for i, (request, decision) in enumerate(zip(requests, decisions)):
+            rows[i] = (
+                self._vehicle(request["veh_id"]),
+                self._lane(request["current_lane"], snapshot),
+                # the models read the length of the target lane
+                self._lane(request["desired_lane"], snapshot),
+                bool(decision),
+            )
+        steps = np.array(
+            [(step, self._counts["vehicles"], len(vehicles), self._counts["requests"], len(rows))],
+            dtype=STEP_DTYPE,
+        )
+        for name, records in (("steps", steps), ("vehicles", vehicles), ("requests", rows)):
+            self._files[name].write(records.tobytes())
+            self._counts[name] += len(records)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        index = {
+            "version": LOG_VERSION,
+            "vehicles": list(self._vehicle_ids),
+            "lanes": list(self._lane_ids),
+            "lane_lengths": self._lane_lengths,
+            "counts": self._counts,
+            "dtypes": {name: dtype.descr for name, (_, dtype) in RECORD_FILES.items()},
+        }
+        (self.path / "index.json").write_text(json.dumps(index))
+
+
+class StateLog:
+    """Read access to a state log written by StateRecorder."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        index = json.loads((self.path / "index.json").read_text())
+        if index["version"] != LOG_VERSION:
+            raise ValueError(f"{self.path}: state log version {index['version']}, expected {LOG_VERSION}")
+        self.vehicle_ids = index["vehicles"]
+        self.lane_ids = index["lanes"]
+        self.lane_lengths = index["lane_lengths"]
+        self.steps, self.vehicles, self.requests = (
+            _memmap(self.path / file_name, dtype, index["counts"][name])
+            for name, (file_name, dtype) in RECORD_FILES.items()
+        )
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def state(self, i: int) -> dict[str, dict[int, object]]:
+        """The vehicles of the i-th recorded step, in the format of the context subscription results."""
+        step = self.steps[i]
+        rows = self.vehicles[step["first_vehicle"]: step["first_vehicle"] + step["vehicles"]]
+        vehicles = {}
+        for row in rows.tolist():
+            veh, lane, lane_index, x, y, speed, acceleration, lane_position, max_speed = row
+            vehicles[self.vehicle_ids[veh]] = {
+                tc.VAR_POSITION: (x, y),
+                tc.VAR_SPEED: speed,
+                tc.VAR_ACCELERATION: acceleration,
+                tc.VAR_LANE_ID: self.lane_ids[lane],
+                tc.VAR_LANE_INDEX: lane_index,
+                tc.VAR_LANEPOSITION: lane_position,
+                tc.VAR_MAXSPEED: max_speed,
+            }
+        return vehicles
+
+    def snapshot(self, i: int) -> NeighborhoodSnapshot:
+        """The NeighborhoodSnapshot of the i-th recorded step."""
+        return NeighborhoodSnapshot(self.state(i), self.lane_lengths)
+
+    def step_requests(self, i: int, snapshot: NeighborhoodSnapshot) -> list[dict]:
+        """The decide_lane_change keyword arguments of the i-th recorded step."""
+        step = self.steps[i]
+        rows = self.requests[step["first_request"]: step["first_request"] + step["requests"]]
+        return [
+            {
+                "veh_id": self.vehicle_ids[veh],
+                "current_lane": self.lane_ids[current_lane],
+                "desired_lane": self.lane_ids[desired_lane],
+                "snapshot": snapshot,
+            }
+            for veh, current_lane, desired_lane, _ in rows.tolist()
+        ]
+
+    def __iter__(self):
+        """Yields (step, snapshot, requests) for every recorded step."""
+        for i in range(len(self)):
+            snapshot = self.snapshot(i)
+            yield int(self.steps[i]["step"]), snapshot, self.step_requests(i, snapshot)
+
+
+def _memmap(path: Path, dtype: np.dtype, count: int) -> np.ndarray:
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+
+def replay(log: StateLog, model: BaseDecisionModel) -> dict:
+    """
+    Runs a decision model open-loop over a state log.
+
+    The recorded vehicles keep moving as they did in the recorded run, whatever
+    the model decides, so the result compares decisions and not their effects.
+
+    Returns:
+        dict: Decisions, lane changes, how many decisions differ from the recorded
+            run, and the wall time.
+    """
+    start_time = time.perf_counter()
+    decisions = np.zeros(len(log.requests), dtype=bool)
+    offset = 0
+    for _, _, requests in log:
+        decisions[offset: offset + len(requests)] = model.decide_lane_changes(requests)
+        offset += len(requests)
+    recorded = log.requests["decision"].astype(bool)
+    return {
+        "steps": len(log),
+        "decisions": len(decisions),
+        "lane_changes": int(decisions.sum()),
+        "changed_decisions": int(np.count_nonzero(decisions != recorded)),
+        "wall_time": time.perf_counter() - start_time,
+    }
+
+
+def main():
+    # sweep imports simulation_manager, which imports this module
+    from sweep import MODELS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", type=Path, help="state log directory")
+    parser.add_argument("--model", nargs="+", default=list(MODELS), choices=list(MODELS))
+    args = parser.parse_args()
+
+    log = StateLog(args.log)
+    print(f"{args.log}: {len(log)} steps, {len(log.vehicles)} vehicle states, {len(log.requests)} requests")
+    for name in args.model:
+        print(f"{name}: {replay(log, MODELS[name]())}")
+
+
+if __name__ == "__main__":
+    main()
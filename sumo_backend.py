@@ -0,0 +1,43 @@
+"""
+Choice of the SUMO client library.
+
+traci talks to a separate SUMO process over a socket, so every getter is a
+round-trip. libsumo runs SUMO inside the Python process behind the same API, so
+the same calls are plain function calls. libsumo has no GUI and runs one
+simulation per process; the worker processes of run_all_simulations each get
+their own.
+
+The modules that talk to SUMO call it through a module-level name `traci`;
+use() binds that name to the chosen backend.
+"""
+
+import importlib
+import sys
+
+BACKENDS = ("traci", "libsumo")
+
+# Modules with a module-level `traci` they call SUMO through
+CLIENT_MODULES = (
+    "models.neighborhood",
+    "models.sl2015_model",
+    "online_metrics",
+    "simulation_manager",
+    "traci_profiler",
+)
+
+
+def load(name: str):
+    """The backend module (traci or libsumo)."""
+    if name not in BACKENDS:
+        raise ValueError(f"unknown SUMO backend {name!r}, expected one of {BACKENDS}")
+    return importlib.import_module(name)
+
+
+def use(name: str):
+    """Binds `traci` in the imported client modules to the backend and returns it."""
+    backend = load(name)
+    for module_name in CLIENT_MODULES:
+        module = sys.modules.get(module_name)
+        if module is not None:
+            module.traci = backend
+    return backend
@@ -0,0 +1,246 @@
+"""
+Monte Carlo sweep over scenarios, models, SUMO seeds and demand scales.
+
+Every combination of the grid is one headless SUMO run. Runs execute on a process
+pool and each finished run is appended to a JSON-lines results file, so an
+interrupted sweep skips the runs it already has when it is started again. The
+aggregate table (mean, std and 95% confidence interval per scenario, model and
+scale) is written as CSV next to the results file.
+
+    python sweep.py --scenarios ScenarioC --seeds 50 --scales 0.5 1.0 1.5
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from models.improved_liu_model import LiuImproved
+from models.liu_model import Liu
+from models.ml_model import ML
+from models.sl2015_model import SL2015
+from simulation_manager import SimulationManager
+from sumo_backend import BACKENDS
+
+# Models by name; each run builds its own instance in the worker process
+MODELS = {
+    "Liu": Liu,
+    "ML": ML,
+    "LiuImproved": LiuImproved,
+    "SL2015": SL2015,
+}
+
+# Run fields that identify a job in the results file
+JOB_FIELDS = ("scenario", "model", "seed", "scale", "max_steps")
+
+# Run summary fields that are aggregated; the online metrics of the controlled
+# vehicles are added with a "metric_" prefix
+METRICS = (
+    "decisions",
+    "lane_changes",
+    "steps",
+    "wall_time",
+    "metric_mean_abs_jerk",
+    "metric_rms_jerk",
+    "metric_peak_rms_jerk",
+    "metric_km_per_l",
+    "metric_min_leader_gap",
+    "metric_min_time_headway",
+    "metric_min_ttc",
+    "metric_collisions",
+)
+
+
+@dataclass(frozen=True)
+class SweepJob:
+    scenario: str
+    model: str
+    seed: int
+    scale: float
+    max_steps: int
+
+    @property
+    def label(self) -> str:
+        # TraCI connection label and SUMO log name of the run
+        return f"{self.model}_{self.scenario}_seed{self.seed}_x{self.scale:g}"
+
+    def key(self) -> tuple:
+        return tuple(getattr(self, field) for field in JOB_FIELDS)
+
+
+def expand_grid(scenarios, models, seeds, scales, max_steps: int) -> list[SweepJob]:
+    return [
+        SweepJob(scenario, model, int(seed), float(scale), max_steps)
+        for scenario, model, seed, scale in itertools.product(scenarios, models, seeds, scales)
+    ]
+
+
+class ConfigurationError(RuntimeError):
+    """A job whose scenario or model cannot be loaded; running it again fails the same way."""
+
+
+def _error_message(exc: Exception) -> str:
+    # libsumo's exceptions wrap SWIG objects and cannot be pickled back to the
+    # parent, so errors travel as messages with their traceback
+    return f"{type(exc).__name__}: {exc}\n{traceback.format_exc()}"
+
+
+def run_job(job: SweepJob, backend: str = "traci", warmup_dir: str | None = None) -> dict:
+    """
+    Runs one job headless with the given SUMO backend and returns its result row.
+
+    Raises:
+        ConfigurationError: When the scenario or the model cannot be loaded.
+        RuntimeError: When the run fails.
+    """
+    # metrics are collected in the step loop, so no SUMO output files are written, and
+    # the SUMO log of a thousand runs would only pile up next to the caller
+    with tempfile.TemporaryDirectory() as log_dir, open(os.devnull, "w") as devnull:
+        # the progress prints of a thousand runs are not useful
+        with contextlib.redirect_stdout(devnull):
+            try:
+                manager = SimulationManager(
+                    scenario=job.scenario,
+                    models={},
+                    max_steps=job.max_steps,
+                    gui=False,
+                    seed=job.seed,
+                    scale=job.scale,
+                    backend=backend,
+                    warmup_dir=warmup_dir,
+                    log_dir=log_dir,
+                )
+                model = MODELS[job.model]()
+            except Exception as exc:
+                raise ConfigurationError(_error_message(exc)) from None
+            try:
+                result = manager.run_simulation_for_model(job.label, model)
+            except Exception as exc:
+                raise RuntimeError(_error_message(exc)) from None
+    row = asdict(job)
+    row.update({key: value for key, value in result.items() if np.isscalar(value)})
+    row.update({f"metric_{key}": value for key, value in result["online_metrics"].items()})
+    return row
+
+
+def load_results(results_path: Path) -> list[dict]:
+    rows = []
+    if not results_path.exists():
+        return rows
+    with open(results_path) as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                # last line of an interrupted write
+                continue
+    return rows
+
+
+def run_sweep(
+    jobs: list[SweepJob],
+    results_path,
+    workers: int | None = None,
+    backend: str = "traci",
+    warmup_dir: str | None = None,
+) -> list[dict]:
+    """
+    Runs the jobs that are not in results_path yet, appending each result as it finishes.
+
+    Returns:
+        list[dict]: The result rows of all jobs, including earlier runs.
+    """
+    results_path = Path(results_path)
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    rows = load_results(results_path)
+    done = {tuple(row[field] for field in JOB_FIELDS) for row in rows}
+    todo = [job for job in jobs if job.key() not in done]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(todo)} already done")
+    if not todo:
+        return rows
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(results_path, "a") as f:
+        futures = {executor.submit(run_job, job, backend, warmup_dir): job for job in todo}
+        for finished, future in enumerate(as_completed(futures), start=1):
+            job = futures[future]
+            try:
+                row = future.result()
+            except Exception as error:
+                # a failed run is reported and retried by the next sweep
+                print(f"[{finished}/{len(todo)}] {job.label} failed: {error}")
+                continue
+            f.write(json.dumps(row) + "\n")
+            f.flush()
+            rows.append(row)
+            print(f"[{finished}/{len(todo)}] {job.label}: "
+                  f"{row['decisions']} decisions, {row['lane_changes']} lane changes")
+    return rows
+
+
+def aggregate(rows: list[dict], metrics=METRICS) -> pd.DataFrame:
+    """
+    Mean, std and 95% confidence half-width of each metric per scenario, model,
+    scale and length; runs from a cached warm-up are aggregated apart from the others.
+    """
+    df = pd.DataFrame(rows)
+    # results written before the warm-up cache existed come from uncached runs
+    if "warmup_cached" not in df.columns:
+        df["warmup_cached"] = False
+    df["warmup_cached"] = df["warmup_cached"].eq(True)
+    keys = ["scenario", "model", "scale", "max_steps", "warmup_cached"]
+    grouped = df.groupby(keys, dropna=False)
+    table = grouped.size().rename("runs").to_frame()
+    for metric in metrics:
+        if metric not in df.columns:
+            continue
+        stats = grouped[metric].agg(["mean", "std"])
+        table[f"{metric}_mean"] = stats["mean"]
+        table[f"{metric}_std"] = stats["std"]
+        # normal approximation, fine for the tens of seeds a sweep uses
+        table[f"{metric}_ci95"] = 1.96 * stats["std"] / np.sqrt(table["runs"])
+    return table.reset_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=["ScenarioC"])
+    parser.add_argument("--models", nargs="+", default=list(MODELS), choices=list(MODELS))
+    parser.add_argument("--seeds", type=int, default=10, help="number of seeds per combination")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--scales", nargs="+", type=float, default=[1.0], help="demand scaling factors")
+    parser.add_argument("--max-steps", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--backend", default="traci", choices=list(BACKENDS),
+                        help="SUMO client; libsumo runs SUMO in the worker process")
+    parser.add_argument("--warmup-dir", default=None,
+                        help="cache the warm-up of each scenario, seed and scale here (see warmup.py); "
+                             "the results are not comparable to uncached runs")
+    parser.add_argument("--out", type=Path, default=Path("sweeps/results.jsonl"))
+    args = parser.parse_args()
+
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    jobs = expand_grid(args.scenarios, args.models, seeds, args.scales, args.max_steps)
+    rows = run_sweep(jobs, args.out, workers=args.workers, backend=args.backend,
+                     warmup_dir=args.warmup_dir)
+    if not rows:
+        return
+
+    table = aggregate(rows)
+    table_path = args.out.with_name(args.out.stem + "_summary.csv")
+    table.to_csv(table_path, index=False)
+    print(table.to_string(index=False))
+    print(f"Wrote {table_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Opt-in profiler for the TraCI traffic and hot paths of one simulation run.
+
+While installed, every public method of the traci domains (traci.vehicle,
+traci.lane, ...), traci.simulationStep and print are wrapped to count and time
+their calls. Calls are attributed to the phase they happen in (for example the
+snapshot read or the model's decision), so the report separates the round-trips
+of the simulation loop from those of the models.
+
+At the end of a run the profiler writes:
+
+    <name>.json    calls and time per domain.method, per-step totals, decision
+                   latency percentiles and peak memory
+    <name>.folded  collapsed stacks ("run;phase;domain.method microseconds"),
+                   for flamegraph.pl or speedscope
+"""
+
+import builtins
+import contextlib
+import json
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+import traci
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class TraciProfiler:
+    def __init__(self, name: str, trace_allocations: bool = False):
+        """
+        Args:
+            name (str): Root frame of the stacks and name of the report files.
+            trace_allocations (bool): Also record the tracemalloc peak, which slows
+                Python code down noticeably.
+        """
+        self.name = name
+        self.trace_allocations = trace_allocations
+        self.calls = Counter()  # "domain.method" -> calls
+        self.times = defaultdict(float)  # "domain.method" -> seconds
+        self.stacks = defaultdict(float)  # collapsed stack -> self time in seconds
+        self.steps: list[tuple[int, int, float, float, int]] = []
+        self.decision_latencies: list[float] = []
+        self._stack = [name]
+        self._child_time = [0.0]
+        self._step = None
+        self._patched: list[tuple[object, str, object]] = []
+        self._start_time = None
+
+    def _wrap(self, key: str, function):
+        def profiled(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.calls[key] += 1
+                self.times[key] += elapsed
+                self.stacks[";".join(self._stack) + ";" + key] += elapsed
+                self._child_time[-1] += elapsed
+                if self._step is not None:
+                    self._step[1] += 1
+                    self._step[2] += elapsed
+
+        return profiled
+
+    def _patch(self, owner, attribute: str, key: str):
+        # traci domains are instances: their methods are shadowed on the instance and
+        # the shadow deleted again; libsumo domains are classes and get the original back
+        self._patched.append((owner, attribute, vars(owner).get(attribute)))
+        setattr(owner, attribute, self._wrap(key, getattr(owner, attribute)))
+
+    def install(self):
+        for domain in traci.DOMAINS:
+            name = getattr(domain, "_name", None) or domain.__name__
+            for method in dir(domain):
+                if not method.startswith("_") and callable(getattr(domain, method)):
+                    self._patch(domain, method, f"{name}.{method}")
+        self._patch(traci, "simulationStep", "simulationStep")
+        self._patch(builtins, "print", "print")
+        if self.trace_allocations:
+            tracemalloc.start()
+        self._start_time = time.perf_counter()
+
+    def uninstall(self):
+        for owner, attribute, original in reversed(self._patched):
+            if original is None:
+                delattr(owner, attribute)
+            else:
+                setattr(owner, attribute, original)
+        self._patched.clear()
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Attributes the calls and the time spent inside the block to a named frame."""
+        self._stack.append(name)
+        self._child_time.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stacks[";".join(self._stack)] += elapsed - self._child_time.pop()
+            self._stack.pop()
+            self._child_time[-1] += elapsed
+
+    def begin_step(self, step: int):
+        # step, TraCI calls, TraCI seconds, decision seconds, requests
+        self._step = [step, 0, 0.0, 0.0, 0]
+
+    def end_step(self):
+        if self._step is not None:
+            self.steps.append(tuple(self._step))
+            self._step = None
+
+    @contextlib.contextmanager
+    def decision(self, requests: int):
+        """Times one call of the decision model, as the "decide" phase."""
+        start = time.perf_counter()
+        with self.phase("decide"):
+            yield
+        elapsed = time.perf_counter() - start
+        self.decision_latencies.append(elapsed)
+        if self._step is not None:
+            self._step[3] += elapsed
+            self._step[4] += requests
+
+    def report(self) -> dict:
+        wall_time = time.perf_counter() - self._start_time if self._start_time else 0.0
+        # everything not inside a traced call or phase is the run's own time
+        self.stacks[self.name] += max(wall_time - self._child_time[0], 0.0)
+        latencies = np.array(self.decision_latencies) * 1e6
+        steps = np.array([row[1:] for row in self.steps]).reshape(-1, 4)
+        report = {
+            "name": self.name,
+            "wall_time": wall_time,
+            "traci_calls": sum(count for key, count in self.calls.items() if key != "print"),
+            "traci_time": sum(seconds for key, seconds in self.times.items() if key != "print"),
+            "methods": {
+                key: {"calls": self.calls[key], "time": self.times[key]}
+                for key in sorted(self.times, key=self.times.get, reverse=True)
+            },
+            "decision_latency_us": {
+                "calls": len(latencies),
+                **({
+                    "p50": float(np.percentile(latencies, 50)),
+                    "p90": float(np.percentile(latencies, 90)),
+                    "p99": float(np.percentile(latencies, 99)),
+                    "max": float(latencies.max()),
+                } if len(latencies) else {}),
+            },
+            "per_step": {
+                "steps": [row[0] for row in self.steps],
+                "traci_calls": steps[:, 0].astype(int).tolist(),
+                "traci_time": steps[:, 1].tolist(),
+                "decision_time": steps[:, 2].tolist(),
+                "requests": steps[:, 3].astype(int).tolist(),
+            },
+        }
+        if resource is not None:
+            # kilobytes on Linux
+            report["peak_rss_kib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if self.trace_allocations and tracemalloc.is_tracing():
+            report["tracemalloc_peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+        return report
+
+    def folded(self) -> str:
+        """Collapsed stacks with self time in microseconds."""
+        return "".join(
+            f"{stack} {round(seconds * 1e6)}\n"
+            for stack, seconds in sorted(self.stacks.items())
+            if round(seconds * 1e6) > 0
+        )
+
+    def write(self, output_dir) -> dict:
+        """Writes <name>.json and <name>.folded and returns the report."""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        report = self.report()
+        (output_dir / f"{self.name}.json").write_text(json.dumps(report, indent=1))
+        (output_dir / f"{self.name}.folded").write_text(self.folded())
+        return report
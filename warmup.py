@@ -0,0 +1,83 @@
+"""
+Cache of warmed-up simulation states.
+
+Until the first controlled vehicle enters the network the decision models have
+nothing to do, so the traffic of those steps is the same for every model. It is
+simulated once per scenario, seed and demand scale, saved with SUMO's state
+saving (including the random number generators) and every model run starts from
+the saved state instead.
+
+An entry is keyed by a hash of the scenario directory's files, the seed, the
+scale and the begin time, so editing a network or route file invalidates it.
+
+SUMO does not save every bit of vehicle state (for example the state of the
+lane-change model), so a run from a cached state is not step-for-step the run
+that simulates its own warm-up, and its results differ from an uncached run of
+the same scenario and seed. It is deterministic and all models of a scenario
+and seed start from the same traffic, so cached runs compare with each other
+but not with uncached ones. The cache is therefore off unless a warmup_dir is
+given, and results of cached runs carry warmup_cached=True.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# Binary state files load faster than XML ones
+STATE_SUFFIX = ".sbx"
+
+
+def scenario_hash(config_file) -> str:
+    """Hash of the contents of all files next to (and including) the configuration."""
+    digest = hashlib.sha256()
+    for path in sorted(Path(config_file).parent.iterdir()):
+        if path.is_file():
+            digest.update(path.name.encode())
+            digest.update(hashlib.sha256(path.read_bytes()).digest())
+    return digest.hexdigest()
+
+
+class WarmupCache:
+    """
+    Saved warm-up states, each with a <key>.json file of its metadata:
+
+        steps             simulation steps the state is ahead of the begin time
+        complete          whether a controlled vehicle appeared in the next step; if
+                          not, the warm-up stopped at the step limit of its run
+        initial_vehicles  vehicles present at the begin time, which the run
+                          configures before its first step
+
+    Both files are moved into place with os.replace, the metadata last, so
+    concurrent runs never see a partial entry and never overwrite each other's.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def key(self, config_file, **params) -> str:
+        """Key of the scenario and the run parameters that change its traffic (seed, scale, ...)."""
+        params["scenario"] = scenario_hash(config_file)
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:32]
+
+    def path(self, key: str) -> Path:
+        return self.root / f"{key}{STATE_SUFFIX}"
+
+    def metadata_path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def get(self, key: str) -> dict | None:
+        """Metadata of the entry, or None when it is not cached."""
+        metadata_path = self.metadata_path(key)
+        if metadata_path.exists() and self.path(key).exists():
+            return json.loads(metadata_path.read_text())
+        return None
+
+    def put(self, key: str, state_file, metadata: dict):
+        """Moves a saved state into the cache; state_file has to be on the cache's file system."""
+        os.replace(state_file, self.path(key))
+        metadata_path = self.metadata_path(key)
+        tmp_path = metadata_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(metadata, indent=1, sort_keys=True))
+        os.replace(tmp_path, metadata_path)